@@ -0,0 +1,171 @@
+"""Проверка планов горячих запросов: ни один не должен читать таблицу целиком.
+
+Для каждого запроса из HOT_QUERIES выполняется EXPLAIN QUERY PLAN. Строка плана
+«SCAN <таблица>» без индекса означает полный просмотр таблицы - такой запрос
+считается регрессией, и скрипт завершается с кодом 1.
+
+По умолчанию проверяется свежая схема: в пустом каталоге применяются все
+миграции (routers/migrations.py). С --db проверяется существующая БД
+(например, копия рабочей) как есть.
+
+Запуск из корня репозитория:
+    python benchmarks/check_query_plans.py
+    python benchmarks/check_query_plans.py --db users.db
+
+В список попадают выборки по ключу, которые выполняются на каждый запрос
+пользователя или на каждую страну при переходе хода. Выгрузки всей таблицы
+(списки для админа, полный пересчёт мира) сюда не входят: для них полный
+просмотр ожидаем.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Каталоги, которые main монтирует при импорте и из которых читает справочники
+LINKED_DIRS = ('js', 'css', 'data')
+
+# (роутер, запрос)
+HOT_QUERIES = (
+    ('main', 'SELECT username, password, email, country, role, banned, muted, ban_until, mute_until, avatar, id FROM users WHERE username=?'),
+    ('main', 'SELECT username, password, email, country, role, banned, muted, ban_until, mute_until, avatar, id FROM users WHERE email=?'),
+    ('main', 'SELECT id FROM users WHERE referral_code=?'),
+    ('auth', 'SELECT id, username, email, role, country, banned, muted FROM users WHERE username=?'),
+    ('main', 'SELECT id FROM characters WHERE user_id=?'),
+    ('main', 'DELETE FROM player_applications WHERE user_id=?'),
+    ('main', 'DELETE FROM messages WHERE username=?'),
+    ('main', 'DELETE FROM characters WHERE user_id=?'),
+    ('main', 'DELETE FROM countries WHERE player_id=?'),
+
+    ('chat', 'SELECT id, username, role, text, timestamp FROM messages WHERE id < ? ORDER BY id DESC LIMIT ?'),
+    ('chat', 'SELECT username FROM messages WHERE id=?'),
+
+    ('characters', 'SELECT * FROM characters WHERE user_id = ?'),
+    ('characters', 'SELECT * FROM characters WHERE id = ?'),
+
+    ('registration', 'SELECT id, status FROM player_applications WHERE user_id = ? AND world_id = ?'),
+    ('registration', "SELECT id FROM player_applications WHERE world_id = ? AND country = ? AND status != 'rejected' AND user_id IS NOT ?"),
+    ('registration', 'SELECT id FROM countries WHERE id = ? AND player_id IS NOT NULL AND player_id IS NOT ?'),
+    ('registration', 'SELECT id FROM characters WHERE user_id = ?'),
+
+    ('economic', 'SELECT player_id, main_currency FROM countries WHERE id = ?'),
+    ('economic', 'SELECT id FROM countries WHERE player_id = ?'),
+    ('economic', 'SELECT social_layer, tax_rate FROM country_tax_settings WHERE country_id = ?'),
+    ('economic', 'SELECT social_layer, avg_income FROM country_income_settings WHERE country_id = ?'),
+    ('economic', 'SELECT education_level, science_level FROM country_education_science WHERE country_id = ?'),
+    ('economic', 'SELECT equipment_code, amount FROM country_military_equipment WHERE country_id = ?'),
+    ('economic', 'SELECT currency_code, amount FROM country_currencies WHERE country_id = ?'),
+    ('economic', 'SELECT resource_code, amount FROM country_resources WHERE country_id = ?'),
+    ('economic', '''SELECT turn_number, balance_start, balance_end, income, expenses, tax_income, tax_settings, created_at
+                    FROM economy_history WHERE country_id = ? ORDER BY turn_number DESC LIMIT 20'''),
+
+    ('statistics', 'SELECT population FROM country_stats WHERE country_id = ?'),
+    ('statistics', 'SELECT religion_name, percentage FROM country_religions WHERE country_id = ?'),
+    ('statistics', 'SELECT ethnos, nation, percentage FROM country_cultures WHERE country_id = ?'),
+    ('statistics', 'SELECT layer_name, percentage FROM country_social_layers WHERE country_id = ?'),
+    ('statistics', 'DELETE FROM country_religions WHERE country_id = ?'),
+    ('statistics', 'DELETE FROM country_cultures WHERE country_id = ?'),
+    ('statistics', 'DELETE FROM country_social_layers WHERE country_id = ?'),
+
+    ('tech', 'SELECT tech_id, researched_at FROM country_technologies WHERE country_id = ? ORDER BY researched_at ASC'),
+    ('tech', 'SELECT id FROM country_technologies WHERE country_id = ? AND tech_id = ?'),
+    ('tech', '''SELECT b.building_type_name, COUNT(b.id) as building_count
+                FROM buildings b JOIN provinces p ON b.province_id = p.id
+                WHERE p.country_id = ? GROUP BY b.building_type_name'''),
+
+    ('provinces', 'SELECT id, name, city_name, square, created_at FROM provinces WHERE country_id = ? ORDER BY name'),
+    ('provinces', '''SELECT id, building_type_name, level, production_type, funding_percentage, built_at
+                     FROM buildings WHERE province_id = ? ORDER BY built_at DESC'''),
+    ('provinces', '''SELECT p.id, p.country_id, c.player_id, c.main_currency
+                     FROM provinces p JOIN countries c ON p.country_id = c.id WHERE p.id = ?'''),
+    ('provinces', '''SELECT b.id, b.building_type_name, c.id as country_id, c.player_id
+                     FROM buildings b JOIN provinces p ON b.province_id = p.id
+                     JOIN countries c ON p.country_id = c.id WHERE b.id = ?'''),
+
+    ('game_main', 'SELECT current_turn, game_date, is_paused, turn_processing FROM game_state WHERE id = 1'),
+
+    ('turn_engine', '''SELECT p.country_id, b.building_type_name, b.production_type, b.funding_percentage
+                       FROM buildings b JOIN provinces p ON b.province_id = p.id
+                       WHERE p.country_id IN (?) ORDER BY p.country_id, b.id'''),
+    ('turn_engine', 'UPDATE country_turn_deltas SET dirty = 1 WHERE country_id = ?'),
+    ('turn_engine', 'UPDATE country_turn_deltas SET dirty = 1 WHERE country_id IN (SELECT id FROM countries WHERE main_currency = ?)'),
+
+    ('archive', 'SELECT id, username, role, text, timestamp FROM messages WHERE timestamp < ? ORDER BY timestamp LIMIT ?'),
+    ('archive', '''SELECT id, country_id, turn_number, balance_start, balance_end, income, expenses,
+                   tax_income, tax_settings, created_at
+                   FROM economy_history WHERE turn_number < ? ORDER BY turn_number LIMIT ?'''),
+)
+
+def explain(conn, sql):
+    """Строки плана запроса (поле detail EXPLAIN QUERY PLAN)"""
+    rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, (None,) * sql.count('?')).fetchall()
+    return [row[3] for row in rows]
+
+def full_scans(plan):
+    """Полные просмотры таблиц: «SCAN t» без индекса"""
+    return [detail for detail in plan
+            if detail.startswith('SCAN ') and ' USING ' not in detail and detail != 'SCAN CONSTANT ROW']
+
+def check_plans(db_file, verbose=False):
+    """Проверка всех HOT_QUERIES; возвращает список (роутер, запрос, полные просмотры)"""
+    conn = sqlite3.connect(db_file)
+    failures = []
+    try:
+        for router, sql in HOT_QUERIES:
+            plan = explain(conn, sql)
+            scans = full_scans(plan)
+            if scans:
+                failures.append((router, sql, scans))
+            if verbose:
+                print(f'[{router}] {" ".join(sql.split())}')
+                for detail in plan:
+                    print(f'    {detail}')
+    finally:
+        conn.close()
+    return failures
+
+def fresh_schema_db(base_dir):
+    """Свежая схема: все миграции на пустой БД, как при первом старте приложения"""
+    for name in LINKED_DIRS:
+        os.symlink(os.path.join(REPO_ROOT, name), os.path.join(base_dir, name))
+    os.chdir(base_dir)
+    sys.path.insert(0, REPO_ROOT)
+    from routers import database, migrations
+    migrations.migrate()
+    return os.path.join(base_dir, database.DB_FILE)
+
+def main():
+    parser = argparse.ArgumentParser(description='Проверка планов горячих запросов на полный просмотр таблиц')
+    parser.add_argument('--db', help='Проверить существующую БД вместо свежей схемы')
+    parser.add_argument('--verbose', action='store_true', help='Печатать планы всех запросов')
+    args = parser.parse_args()
+
+    base_dir = None
+    if args.db:
+        db_file = os.path.abspath(args.db)
+    else:
+        base_dir = tempfile.mkdtemp(prefix='viau_plans_')
+        db_file = fresh_schema_db(base_dir)
+
+    try:
+        failures = check_plans(db_file, args.verbose)
+    finally:
+        if base_dir:
+            os.chdir(REPO_ROOT)
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    for router, sql, scans in failures:
+        print(f'[{router}] полный просмотр: {"; ".join(scans)}')
+        print(f'    {" ".join(sql.split())}')
+
+    if failures:
+        print(f'Запросов с полным просмотром таблиц: {len(failures)} из {len(HOT_QUERIES)}')
+        raise SystemExit(1)
+    print(f'Проверено горячих запросов: {len(HOT_QUERIES)}, полных просмотров таблиц нет')
+
+if __name__ == '__main__':
+    main()
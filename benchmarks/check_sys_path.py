@@ -0,0 +1,132 @@
+"""Проверка, что обработка запросов не меняет sys.path.
+
+Раньше обработчики роутеров делали sys.path.append('..') на каждый вызов, и
+sys.path рос на элемент с каждым запросом (см. routers/auth.py). Скрипт:
+
+    1. ищет sys.path в исходниках routers/ - там его быть не должно;
+    2. в пустом каталоге поднимает приложение (TestClient), выполняет
+       REQUESTS_PER_ENDPOINT авторизованных запросов к каждому эндпоинту из
+       ENDPOINTS и сравнивает sys.path до и после.
+
+При любом отклонении скрипт завершается с кодом 1.
+
+Запуск из корня репозитория:
+    python benchmarks/check_sys_path.py
+    python benchmarks/check_sys_path.py --requests 500
+"""
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Каталоги, которые main монтирует при импорте и из которых читает справочники
+LINKED_DIRS = ('js', 'css', 'data')
+
+# Фоновые задачи приложения для проверки не нужны
+DISABLED_BACKGROUND = {
+    'GAME_CLOCK_ENABLED': '0',
+    'MAINTENANCE_ENABLED': '0',
+    'BACKUP_INTERVAL_HOURS': '0',
+}
+
+REQUESTS_PER_ENDPOINT = 100
+
+# Эндпоинты разных роутеров, которые определяют пользователя по токену
+ENDPOINTS = (
+    '/api/characters/my',
+    '/api/characters/admin/all',
+    '/api/settings/referral',
+    '/api/registration/my-application',
+    '/api/tech/country/bench/progress',
+    '/api/tech/player/progress',
+    '/api/statistics/country/bench',
+    '/api/game/research-points/bench',
+    '/api/admin/game/maintenance',
+    '/api/admin/check',
+)
+
+SYS_PATH_SOURCE = re.compile(r'\bsys\.path\b')
+
+def source_offenders():
+    """Строки routers/*.py, которые трогают sys.path"""
+    offenders = []
+    routers_dir = os.path.join(REPO_ROOT, 'routers')
+    for name in sorted(os.listdir(routers_dir)):
+        if not name.endswith('.py'):
+            continue
+        with open(os.path.join(routers_dir, name), encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                if SYS_PATH_SOURCE.search(line):
+                    offenders.append(f'routers/{name}:{number}: {line.strip()}')
+    return offenders
+
+def check_requests(base_dir, requests_per_endpoint):
+    """Запросы через приложение; возвращает (длина sys.path до, после, число запросов)"""
+    for name in LINKED_DIRS:
+        os.symlink(os.path.join(REPO_ROOT, name), os.path.join(base_dir, name))
+    os.chdir(base_dir)
+    os.environ.update(DISABLED_BACKGROUND)
+    sys.path.insert(0, REPO_ROOT)
+
+    import main
+    from fastapi.testclient import TestClient
+    from routers import passwords
+
+    with TestClient(main.app) as client:
+        conn = sqlite3.connect(main.DB_FILE)
+        conn.execute(
+            "INSERT INTO users (username, password, email, role) VALUES ('path_admin', ?, 'path@localhost', 'admin')",
+            (passwords.hash_password('path'),)
+        )
+        conn.commit()
+        conn.close()
+        response = client.post('/login', json={'username': 'path_admin', 'password': 'path'})
+        headers = {'Authorization': response.json()['token']}
+
+        # Первый проход - прогрев: ленивые импорты модулей не считаются
+        for endpoint in ENDPOINTS:
+            client.get(endpoint, headers=headers)
+
+        before = list(sys.path)
+        sent = 0
+        for _ in range(requests_per_endpoint):
+            for endpoint in ENDPOINTS:
+                client.get(endpoint, headers=headers)
+                sent += 1
+        after = list(sys.path)
+    return before, after, sent
+
+def main():
+    parser = argparse.ArgumentParser(description='Проверка, что запросы не меняют sys.path')
+    parser.add_argument('--requests', type=int, default=REQUESTS_PER_ENDPOINT,
+                        help='Запросов на каждый эндпоинт')
+    args = parser.parse_args()
+
+    failed = False
+    offenders = source_offenders()
+    for line in offenders:
+        print(f'sys.path в роутере: {line}')
+        failed = True
+
+    base_dir = tempfile.mkdtemp(prefix='viau_sys_path_')
+    try:
+        before, after, sent = check_requests(base_dir, args.requests)
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    if after != before:
+        print(f'sys.path изменился за {sent} запросов: {len(before)} -> {len(after)} элементов')
+        failed = True
+
+    if failed:
+        raise SystemExit(1)
+    print(f'Выполнено запросов: {sent}, длина sys.path не изменилась ({len(before)})')
+
+if __name__ == '__main__':
+    main()
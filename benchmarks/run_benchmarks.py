@@ -0,0 +1,348 @@
+"""Бенчмарк движка хода и тяжёлых эндпоинтов экономики.
+
+Для каждого размера мира создаётся отдельный каталог с пустой БД, в нём
+запускается дочерний процесс: миграции создают настоящие схемы всех
+роутеров, генератор заполняет мир, а замеры идут через ASGI-приложение
+(TestClient), то есть вместе с авторизацией, JSON и фоновой задачей хода.
+
+Отдельно замеряется задержка GET /api/game/turn в простое и во время хода,
+когда параллельно выполняется тяжёлый запрос истории экономики: запросы идут
+через httpx.AsyncClient в одном event loop, поэтому блокирующий обработчик
+сразу виден в p99. Ход не должен поднимать p99: если во время хода он выше,
+чем в простое, больше чем на --p99-budget секунд, результаты всё равно
+пишутся в --output, но скрипт завершается с кодом 1.
+
+Замеряется и определение пользователя по токену (routers/auth.py): с кэшем
+пользователей и с чтением users на каждый вызов.
+
+Запуск из корня репозитория:
+    python benchmarks/run_benchmarks.py --sizes 10,100,1000,10000 --output bench_results.json
+
+Результаты пишутся в JSON для сравнения прогонов между собой.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Каталоги, которые main монтирует при импорте и из которых читает справочники
+LINKED_DIRS = ('js', 'css', 'data')
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+# Сколько стран опрашивать в замере прогноза баланса за один прогон
+FORECAST_SAMPLE = 20
+
+# Сколько запросов /api/game/turn отправить в простое для замера задержки
+LATENCY_SAMPLES = 200
+
+# Интервал между запросами /api/game/turn во время хода, секунд
+LATENCY_PROBE_INTERVAL = 0.01
+
+# На сколько p99 /api/game/turn во время хода может превышать p99 в простое, секунд
+LATENCY_P99_BUDGET = 0.1
+
+# Сколько раз определить пользователя по токену в замере авторизации
+AUTH_SAMPLES = 1000
+
+def summarize(runs):
+    return {
+        'runs': [round(r, 6) for r in runs],
+        'min': round(min(runs), 6),
+        'median': round(statistics.median(runs), 6),
+        'max': round(max(runs), 6)
+    }
+
+def measure(action, repeat, setup=None):
+    """Время выполнения action (секунды) в repeat прогонах; setup не замеряется"""
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        action()
+        runs.append(time.perf_counter() - started)
+    return summarize(runs)
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+def summarize_latency(samples):
+    ordered = sorted(samples)
+    return {
+        'samples': len(ordered),
+        'min': round(ordered[0], 6),
+        'median': round(statistics.median(ordered), 6),
+        'p95': round(percentile(ordered, 95), 6),
+        'p99': round(percentile(ordered, 99), 6),
+        'max': round(ordered[-1], 6)
+    }
+
+def check_flat_p99(benchmarks, budget):
+    """Сравнение p99 /api/game/turn во время хода и в простое"""
+    idle = benchmarks['game_turn_latency_idle']['p99']
+    during_turn = benchmarks['game_turn_latency_during_turn']['p99']
+    return {
+        'idle_p99': idle,
+        'during_turn_p99': during_turn,
+        'budget': budget,
+        'passed': during_turn <= idle + budget
+    }
+
+async def probe_game_turn(app, headers, load=None):
+    """Задержки GET /api/game/turn (секунды)
+
+    Без load - LATENCY_SAMPLES запросов подряд. С load - запросы отправляются
+    по расписанию каждые LATENCY_PROBE_INTERVAL секунд, пока выполняется
+    корутина load(client, headers) в том же event loop. Задержка считается от
+    запланированного момента: если event loop был занят, запросы, которые не
+    удалось отправить вовремя, тоже попадают в статистику.
+    """
+    import httpx
+
+    samples = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        async def probe(scheduled):
+            check(await client.get('/api/game/turn'))
+            samples.append(time.perf_counter() - scheduled)
+
+        if load is None:
+            for _ in range(LATENCY_SAMPLES):
+                await probe(time.perf_counter())
+            return samples
+
+        task = asyncio.create_task(load(client, headers))
+        probes = []
+        started = time.perf_counter()
+        tick = 0
+        while not task.done():
+            scheduled = started + tick * LATENCY_PROBE_INTERVAL
+            tick += 1
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            probes.append(asyncio.create_task(probe(scheduled)))
+        await task
+        await asyncio.gather(*probes)
+    return samples
+
+async def turn_with_history_load(client, headers):
+    """Полный ход через фоновую задачу и параллельный запрос истории экономики"""
+    job_id = check(await client.post('/api/admin/game/next-turn', headers=headers))['job_id']
+
+    async def wait_job():
+        while True:
+            job = check(await client.get(f'/api/admin/game/turn-jobs/{job_id}', headers=headers))['job']
+            if job['status'] != 'running':
+                break
+            await asyncio.sleep(0.01)
+        if job['status'] != 'completed':
+            raise RuntimeError(f'Ход не обработан: {job["error"]}')
+
+    await asyncio.gather(
+        wait_job(),
+        client.get('/api/economic/economy-history/all', headers=headers)
+    )
+
+def check(response):
+    if response.status_code >= 400 or not response.json().get('success'):
+        raise RuntimeError(f'{response.request.url}: {response.status_code} {response.text[:200]}')
+    return response.json()
+
+def run_world(countries, repeat, seed):
+    """Замеры для одного размера мира (выполняется в дочернем процессе, cwd - каталог мира)"""
+    sys.path.insert(0, REPO_ROOT)
+
+    import main
+    from fastapi.testclient import TestClient
+    from benchmarks.world_generator import generate_world
+    from routers import auth, auth_cache, passwords
+
+    result = {'countries': countries, 'benchmarks': {}}
+
+    with TestClient(main.app) as client:
+        conn = sqlite3.connect(main.DB_FILE)
+        conn.execute(
+            "INSERT INTO users (username, password, email, role) VALUES ('bench_admin', ?, 'bench@localhost', 'admin')",
+            (passwords.hash_password('bench'),)
+        )
+        conn.commit()
+        conn.close()
+        token = check(client.post('/login', json={'username': 'bench_admin', 'password': 'bench'}))['token']
+        headers = {'Authorization': token}
+
+        started = time.perf_counter()
+        result['rows'] = generate_world(countries, seed=seed)
+        result['generate_seconds'] = round(time.perf_counter() - started, 3)
+
+        country_ids = [row[0] for row in sqlite3.connect(main.DB_FILE).execute('SELECT id FROM countries ORDER BY id')]
+        rng = random.Random(seed)
+        job_seconds = []
+
+        def next_turn():
+            job_id = check(client.post('/api/admin/game/next-turn', headers=headers))['job_id']
+            while True:
+                job = check(client.get(f'/api/admin/game/turn-jobs/{job_id}', headers=headers))['job']
+                if job['status'] != 'running':
+                    break
+                time.sleep(0.01)
+            if job['status'] != 'completed':
+                raise RuntimeError(f'Ход не обработан: {job["error"]}')
+            job_seconds.append(job['elapsed_seconds'])
+
+        def invalidate_all():
+            conn = sqlite3.connect(main.DB_FILE)
+            conn.execute('UPDATE country_turn_deltas SET dirty = 1')
+            conn.commit()
+            conn.close()
+
+        def forecast_sample():
+            for country_id in rng.sample(country_ids, min(FORECAST_SAMPLE, len(country_ids))):
+                check(client.get(f'/api/economic/country/{country_id}/balance-forecast', headers=headers))
+
+        async def resolve_tokens():
+            for _ in range(AUTH_SAMPLES):
+                await auth.principal_for_token(token)
+
+        benchmarks = result['benchmarks']
+        # Определение пользователя по токену: с кэшем и с чтением users на каждый вызов
+        benchmarks['auth_resolve_cached_x%d' % AUTH_SAMPLES] = measure(
+            lambda: asyncio.run(resolve_tokens()), repeat, setup=auth_cache.clear)
+        auth_ttl = auth_cache.AUTH_CACHE_TTL
+        auth_cache.AUTH_CACHE_TTL = 0
+        benchmarks['auth_resolve_uncached_x%d' % AUTH_SAMPLES] = measure(
+            lambda: asyncio.run(resolve_tokens()), repeat, setup=auth_cache.clear)
+        auth_cache.AUTH_CACHE_TTL = auth_ttl
+        benchmarks['next_turn_full'] = measure(next_turn, repeat, setup=invalidate_all)
+        benchmarks['next_turn_full']['job_seconds'] = job_seconds[:]
+        job_seconds.clear()
+        benchmarks['next_turn_incremental'] = measure(next_turn, repeat)
+        benchmarks['next_turn_incremental']['job_seconds'] = job_seconds[:]
+        benchmarks['next_turn_preview'] = measure(
+            lambda: check(client.get('/api/admin/game/next-turn/preview', headers=headers)), repeat)
+        benchmarks['balance_forecast_x%d' % min(FORECAST_SAMPLE, countries)] = measure(forecast_sample, repeat)
+        benchmarks['economy_history_all'] = measure(
+            lambda: check(client.get('/api/economic/economy-history/all', headers=headers)), repeat)
+
+        benchmarks['game_turn_latency_idle'] = summarize_latency(
+            asyncio.run(probe_game_turn(main.app, headers)))
+        busy_samples = []
+        for _ in range(repeat):
+            invalidate_all()
+            busy_samples += asyncio.run(probe_game_turn(main.app, headers, load=turn_with_history_load))
+        benchmarks['game_turn_latency_during_turn'] = summarize_latency(busy_samples)
+
+    result['db_size_bytes'] = os.path.getsize(main.DB_FILE)
+    return result
+
+def prepare_world_dir(base_dir, countries):
+    world_dir = os.path.join(base_dir, f'world_{countries}')
+    os.makedirs(world_dir)
+    for name in LINKED_DIRS:
+        os.symlink(os.path.join(REPO_ROOT, name), os.path.join(world_dir, name))
+    return world_dir
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк движка хода и эндпоинтов экономики')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Размеры мира через запятую (число стран)')
+    parser.add_argument('--repeat', type=int, default=3, help='Прогонов каждого замера')
+    parser.add_argument('--seed', type=int, default=0, help='Зерно генератора мира')
+    parser.add_argument('--output', default='bench_results.json', help='Файл с результатами (JSON)')
+    parser.add_argument('--keep', action='store_true', help='Не удалять каталоги сгенерированных миров')
+    parser.add_argument('--p99-budget', type=float, default=LATENCY_P99_BUDGET,
+                        help='Допустимый рост p99 /api/game/turn во время хода, секунд')
+    parser.add_argument('--world', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.world is not None:
+        # Дочерний процесс: результат одной строкой в файл, stdout занят логами роутеров
+        result = run_world(args.world, args.repeat, args.seed)
+        with open('result.json', 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        return
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    report = {
+        'meta': {
+            'started_at': datetime.now().isoformat(),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'turn_engine_workers': os.getenv('TURN_ENGINE_WORKERS', '1'),
+            'p99_budget': args.p99_budget
+        },
+        'results': []
+    }
+
+    failures = []
+    base_dir = tempfile.mkdtemp(prefix='viau_bench_')
+    try:
+        for countries in sizes:
+            world_dir = prepare_world_dir(base_dir, countries)
+            print(f'[bench] {countries} стран...', flush=True)
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--world', str(countries),
+                 '--repeat', str(args.repeat), '--seed', str(args.seed)],
+                cwd=world_dir, capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                print(completed.stdout[-2000:], completed.stderr[-4000:], sep='\n')
+                raise SystemExit(f'Бенчмарк для {countries} стран завершился с ошибкой')
+
+            with open(os.path.join(world_dir, 'result.json'), encoding='utf-8') as f:
+                result = json.load(f)
+            report['results'].append(result)
+            for name, timing in result['benchmarks'].items():
+                line = f'[bench]   {name}: median {timing["median"]:.4f} s'
+                if 'p99' in timing:
+                    line += f', p99 {timing["p99"]:.4f} s'
+                print(line, flush=True)
+
+            result['latency_check'] = check_flat_p99(result['benchmarks'], args.p99_budget)
+            latency = result['latency_check']
+            verdict = 'OK' if latency['passed'] else 'ПРЕВЫШЕН'
+            print(f'[bench]   p99 во время хода {latency["during_turn_p99"]:.4f} s при простое '
+                  f'{latency["idle_p99"]:.4f} s, допуск +{latency["budget"]:.4f} s: {verdict}', flush=True)
+            if not latency['passed']:
+                failures.append(countries)
+    finally:
+        if args.keep:
+            print(f'[bench] Миры сохранены в {base_dir}')
+        else:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'[bench] Результаты записаны в {args.output}')
+
+    if failures:
+        raise SystemExit(f'p99 /api/game/turn во время хода вышел за допуск для миров: '
+                         f'{", ".join(map(str, failures))} стран')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Генератор синтетического мира для бенчмарков.
+
+Заполняет файл мира странами со статистикой, социальными слоями, налогами,
+заработками, провинциями, постройками, технологиями и историей экономики.
+Схему генератор не предполагает: перед заполнением он сам применяет к миру
+недостающие миграции (routers/migrations.py).
+
+Данные детерминированы: один и тот же seed даёт один и тот же мир.
+"""
+import json
+import random
+import sqlite3
+from datetime import datetime
+
+from routers import database, migrations, provinces, tech
+
+SOCIAL_LAYERS = ['Элита', 'Высший класс', 'Средний класс', 'Низший класс', 'Маргиналы']
+
+def _tech_ids():
+    ids = []
+    for category in tech.TECHNOLOGIES.values():
+        for line in category['lines']:
+            ids.extend(t['id'] for t in line['technologies'])
+    return ids
+
+def _currency_codes():
+    with open('data/converter_data.json', 'r', encoding='utf-8') as f:
+        return list(json.load(f)['currencies'])
+
+def generate_world(countries, world_id=database.DEFAULT_WORLD, seed=0, provinces_per_country=3,
+                   buildings_per_province=2, technologies_per_country=15, history_turns=20):
+    """Заполнение БД синтетическим миром
+
+    Args:
+        countries: Число стран
+        world_id: Мир, файл которого заполняется (схема создаётся миграциями)
+        seed: Зерно генератора
+        provinces_per_country: Провинций у каждой страны
+        buildings_per_province: Максимум построек в провинции
+        technologies_per_country: Изученных технологий сверх нужных для построек
+        history_turns: Ходов истории экономики у каждой страны
+
+    Returns:
+        dict: число созданных строк по таблицам
+    """
+    migrations.migrate(world_id)
+
+    rng = random.Random(seed)
+    now = datetime.now().isoformat()
+    currencies = _currency_codes()
+    tech_ids = _tech_ids()
+    building_names = list(provinces.BUILDING_TYPES)
+
+    rows = {name: [] for name in (
+        'countries', 'country_currencies', 'country_stats', 'country_social_layers',
+        'country_tax_settings', 'country_income_settings', 'country_education_science',
+        'country_technologies', 'economy_history'
+    )}
+    buildings_by_country = []
+
+    for i in range(countries):
+        country_id = f'bench_{i:05d}'
+        main_currency = rng.choice(currencies)
+        balance = rng.randint(1_000, 1_000_000)
+
+        rows['countries'].append((country_id, f'Правитель{i}', f'Династия{i}', f'Страна {i}', main_currency,
+                                  rng.randint(0, 5_000), now, now))
+        rows['country_currencies'].append((country_id, main_currency, balance, now, now))
+        rows['country_stats'].append((country_id, round(rng.uniform(0.5, 40.0), 3)))
+
+        shares = [rng.uniform(1, 10) for _ in SOCIAL_LAYERS]
+        total = sum(shares)
+        tax_settings = {}
+        for layer, share in zip(SOCIAL_LAYERS, shares):
+            tax_rate = round(rng.uniform(0, 40), 1)
+            tax_settings[layer] = tax_rate
+            rows['country_social_layers'].append((country_id, layer, round(share / total * 100, 2)))
+            rows['country_tax_settings'].append((country_id, layer, tax_rate, now, now))
+            rows['country_income_settings'].append((country_id, layer, round(rng.uniform(1, 500), 2), now, now))
+
+        rows['country_education_science'].append((country_id, round(rng.uniform(0, 10), 2),
+                                                   round(rng.uniform(0, 10), 2), now, now))
+
+        chosen = [rng.choice(building_names) for _ in range(provinces_per_country * buildings_per_province)]
+        researched = set(rng.sample(tech_ids, min(technologies_per_country, len(tech_ids))))
+        for name in chosen:
+            researched.update(provinces.BUILDING_TYPES[name]['required_tech_ids'])
+        rows['country_technologies'].extend((country_id, tech_id, now) for tech_id in sorted(researched))
+        buildings_by_country.append((country_id, chosen))
+
+        history_balance = balance
+        for turn in range(1, history_turns + 1):
+            income = round(rng.uniform(0, 50_000), 2)
+            expenses = round(rng.uniform(0, 20_000), 2)
+            balance_end = history_balance + income - expenses
+            rows['economy_history'].append((country_id, turn, history_balance, balance_end, income, expenses,
+                                            income, json.dumps(tax_settings, ensure_ascii=False), now))
+            history_balance = balance_end
+
+    conn = sqlite3.connect(database.world_file(world_id))
+    cursor = conn.cursor()
+    try:
+        cursor.executemany('''
+            INSERT INTO countries (id, ruler_first_name, ruler_last_name, country_name, main_currency,
+                                   research_points, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows['countries'])
+        cursor.executemany('''
+            INSERT INTO country_currencies (country_id, currency_code, amount, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows['country_currencies'])
+        cursor.executemany('INSERT INTO country_stats (country_id, population) VALUES (?, ?)', rows['country_stats'])
+        cursor.executemany('''
+            INSERT INTO country_social_layers (country_id, layer_name, percentage) VALUES (?, ?, ?)
+        ''', rows['country_social_layers'])
+        cursor.executemany('''
+            INSERT INTO country_tax_settings (country_id, social_layer, tax_rate, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows['country_tax_settings'])
+        cursor.executemany('''
+            INSERT INTO country_income_settings (country_id, social_layer, avg_income, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows['country_income_settings'])
+        cursor.executemany('''
+            INSERT INTO country_education_science (country_id, education_level, science_level, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows['country_education_science'])
+        cursor.executemany('''
+            INSERT INTO country_technologies (country_id, tech_id, researched_at) VALUES (?, ?, ?)
+        ''', rows['country_technologies'])
+        cursor.executemany('''
+            INSERT INTO economy_history (country_id, turn_number, balance_start, balance_end, income, expenses,
+                                         tax_income, tax_settings, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows['economy_history'])
+
+        province_count = 0
+        building_rows = []
+        for country_id, chosen in buildings_by_country:
+            for p in range(provinces_per_country):
+                cursor.execute('''
+                    INSERT INTO provinces (country_id, name, city_name, square, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (country_id, f'Провинция {p + 1}', f'Город {p + 1}', str(rng.randint(1_000, 50_000)), now))
+                province_id = cursor.lastrowid
+                province_count += 1
+                for name in chosen[p * buildings_per_province:(p + 1) * buildings_per_province][:rng.randint(1, buildings_per_province)]:
+                    building_rows.append((province_id, name, now, rng.choice([50, 80, 100, 100, 120, 150])))
+        cursor.executemany('''
+            INSERT INTO buildings (province_id, building_type_name, built_at, funding_percentage)
+            VALUES (?, ?, ?, ?)
+        ''', building_rows)
+
+        conn.commit()
+    finally:
+        conn.close()
+
+    counts = {name: len(values) for name, values in rows.items()}
+    counts['provinces'] = province_count
+    counts['buildings'] = len(building_rows)
+    return counts
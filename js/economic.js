@@ -36,138 +36,37 @@ const economicModule = (function() {
             return;
         }
         
-        await loadAvailableData();
-        await loadCountryResources();
-        await loadMilitaryEquipment();
-        await loadBalanceData();
-        await loadTaxSettings();
-        await loadIncomeSettings();
+        await loadDashboard();
         renderEconomyView();
     }
 
-    async function loadAvailableData() {
-        try {
-            const [currResponse, resResponse, equipResponse] = await Promise.all([
-                fetch('/api/economic/available-currencies'),
-                fetch('/api/economic/available-resources'),
-                fetch('/api/economic/available-military-equipment')
-            ]);
-            
-            const currData = await currResponse.json();
-            const resData = await resResponse.json();
-            const equipData = await equipResponse.json();
-            
-            console.log('Available currencies loaded:', currData);
-            console.log('Available resources loaded:', resData);
-            console.log('Available military equipment loaded:', equipData);
-            
-            if (currData.success) availableCurrencies = currData.currencies;
-            if (resData.success) availableResources = resData.resources;
-            if (equipData.success) availableMilitaryEquipment = equipData.equipment;
-            
-            console.log('Currencies object:', availableCurrencies);
-            console.log('Resources object:', availableResources);
-            console.log('Military equipment object:', availableMilitaryEquipment);
-        } catch (e) {
-            console.error('Ошибка загрузки валют/ресурсов/снаряжения:', e);
-        }
-    }
+    // Разделы сводки, которые зависят от выбранной страны (справочники не меняются)
+    const COUNTRY_SECTIONS = ['resources', 'military_equipment', 'balance_forecast', 'tax_settings', 'income_settings'];
 
-    async function loadCountryResources() {
+    async function loadDashboard(fields = null) {
         try {
             const token = localStorage.getItem('token');
-            console.log('Loading resources for country:', countryId);
-            const response = await fetch(`/api/economic/country/${countryId}/resources`, {
+            const query = fields ? `?fields=${fields.join(',')}` : '';
+            const response = await fetch(`/api/economic/country/${countryId}/dashboard${query}`, {
                 headers: { 'Authorization': token }
             });
             const data = await response.json();
             
-            console.log('Country resources response:', data);
-            
-            if (data.success) {
-                countryData = data;
-            } else {
-                console.error('Failed to load resources:', data.error);
+            if (!data.success) {
+                console.error('Ошибка загрузки данных экономики:', data.error);
+                return;
             }
-        } catch (e) {
-            console.error('Ошибка загрузки ресурсов:', e);
-        }
-    }
-
-    async function loadMilitaryEquipment() {
-        try {
-            const token = localStorage.getItem('token');
-            console.log('Loading military equipment for country:', countryId);
-            const response = await fetch(`/api/economic/country/${countryId}/military-equipment`, {
-                headers: { 'Authorization': token }
-            });
-            const data = await response.json();
             
-            console.log('Military equipment response:', data);
-            
-            if (data.success) {
-                militaryEquipment = data.equipment;
-            } else {
-                console.error('Failed to load military equipment:', data.error);
-            }
-        } catch (e) {
-            console.error('Ошибка загрузки военного снаряжения:', e);
-        }
-    }
-
-    async function loadBalanceData() {
-        try {
-            const token = localStorage.getItem('token');
-            const response = await fetch(`/api/economic/country/${countryId}/balance-forecast`, {
-                headers: { 'Authorization': token }
-            });
-            const data = await response.json();
-            
-            if (data.success) {
-                balanceData = data;
-            } else {
-                console.error('Ошибка загрузки баланса:', data.message);
-            }
-        } catch (e) {
-            console.error('Ошибка загрузки баланса:', e);
-        }
-    }
-
-    async function loadTaxSettings() {
-        try {
-            const token = localStorage.getItem('token');
-            const response = await fetch(`/api/economic/country/${countryId}/tax-settings`, {
-                headers: { 'Authorization': token }
-            });
-            const data = await response.json();
-            
-            if (data.success) {
-                taxSettings = data.tax_settings;
-                console.log('Tax settings loaded:', taxSettings);
-            } else {
-                console.error('Ошибка загрузки налоговых настроек:', data.message);
-            }
-        } catch (e) {
-            console.error('Ошибка загрузки налоговых настроек:', e);
-        }
-    }
-
-    async function loadIncomeSettings() {
-        try {
-            const token = localStorage.getItem('token');
-            const response = await fetch(`/api/economic/country/${countryId}/income-settings`, {
-                headers: { 'Authorization': token }
-            });
-            const data = await response.json();
-            
-            if (data.success) {
-                incomeSettings = data.income_settings;
-                console.log('Income settings loaded:', incomeSettings);
-            } else {
-                console.error('Ошибка загрузки настроек дохода:', data.message);
-            }
+            if (data.available_currencies) availableCurrencies = data.available_currencies;
+            if (data.available_resources) availableResources = data.available_resources;
+            if (data.available_military_equipment) availableMilitaryEquipment = data.available_military_equipment;
+            if (data.resources) countryData = { success: true, ...data.resources };
+            if (data.military_equipment) militaryEquipment = data.military_equipment;
+            if (data.balance_forecast) balanceData = { success: true, ...data.balance_forecast };
+            if (data.tax_settings) taxSettings = data.tax_settings;
+            if (data.income_settings) incomeSettings = data.income_settings;
         } catch (e) {
-            console.error('Ошибка загрузки настроек дохода:', e);
+            console.error('Ошибка загрузки данных экономики:', e);
         }
     }
 
@@ -580,11 +479,7 @@ const economicModule = (function() {
     }
 
     async function refresh() {
-        await loadCountryResources();
-        await loadMilitaryEquipment();
-        await loadBalanceData();
-        await loadTaxSettings();
-        await loadIncomeSettings();
+        await loadDashboard(COUNTRY_SECTIONS);
         renderEconomyView();
     }
     
@@ -605,11 +500,7 @@ const economicModule = (function() {
         localStorage.setItem('econViewingCountryName', selectedCountryName);
         
         // Перезагружаем данные
-        await loadMilitaryEquipment();
-        await loadCountryResources();
-        await loadBalanceData();
-        await loadTaxSettings();
-        await loadIncomeSettings();
+        await loadDashboard(COUNTRY_SECTIONS);
         renderEconomyView();
     }
 
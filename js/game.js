@@ -350,6 +350,7 @@ function updateGameStateDisplay() {
     const turnElement = document.getElementById('game-turn');
     if (turnElement) {
         turnElement.textContent = gameState.current_turn;
+        turnElement.title = gameState.turn_processing ? 'Идёт обработка хода' : '';
     }
     
     const adminTurnElement = document.getElementById('admin-current-turn');
@@ -374,12 +375,25 @@ async function nextTurn() {
         
         const data = await response.json();
         
-        if (data.success) {
-            gameState.current_turn = data.current_turn;
+        if (!data.success) {
+            await showError(data.error || 'Не удалось изменить ход');
+            return;
+        }
+        
+        gameState.turn_processing = true;
+        updateGameStateDisplay();
+        
+        const job = await waitForTurnJob(data.job_id, token);
+        
+        if (job.status === 'completed') {
+            gameState.current_turn = job.turn_to;
+            gameState.turn_processing = false;
             updateGameStateDisplay();
-            await showSuccess(data.message || 'Ход успешно изменён');
+            await showSuccess(`Ход успешно изменён на ${job.turn_to}. Экономика всех стран пересчитана.`);
         } else {
-            await showError(data.error || 'Не удалось изменить ход');
+            await loadGameState();
+            updateGameStateDisplay();
+            await showError(job.error || 'Не удалось изменить ход');
         }
     } catch (error) {
         console.error('Error advancing turn:', error);
@@ -387,6 +401,24 @@ async function nextTurn() {
     }
 }
 
+async function waitForTurnJob(jobId, token) {
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, 500));
+        
+        const response = await fetch(`/api/admin/game/turn-jobs/${jobId}`, {
+            headers: { 'Authorization': token }
+        });
+        const data = await response.json();
+        
+        if (!data.success) {
+            return { status: 'failed', error: data.error };
+        }
+        if (data.job.status !== 'running') {
+            return data.job;
+        }
+    }
+}
+
 async function setTurn() {
     const turnNumber = await showPrompt('Установка хода', 'Введите номер хода:', (gameState?.current_turn || 1).toString());
     
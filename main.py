@@ -1,6 +1,6 @@
 from fastapi import UploadFile, File
 import uuid
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
 from fastapi.responses import FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from email.mime.text import MIMEText
@@ -17,11 +17,9 @@ import string
 import sqlite3
 from email.mime.text import MIMEText
 import secrets
-import jwt
 from datetime import datetime, timedelta
-import bcrypt
 
-from routers import converter, maps, chat, registration, characters, settings, economic, tech, game_main, game_admin, statistics, provinces
+from routers import converter, maps, chat, registration, characters, settings, economic, tech, game_main, game_admin, statistics, provinces, game_clock, database, migrations, turn_jobs, chat_writer, archive, maintenance, backup, worlds, auth_cache, auth, passwords, background_migrations
 
 load_dotenv()
 GMAIL_CLIENT_ID = os.getenv('GMAIL_CLIENT_ID')
@@ -54,6 +52,7 @@ app.include_router(game_main.router)
 app.include_router(game_admin.router)
 app.include_router(statistics.router)
 app.include_router(provinces.router)
+app.include_router(worlds.router)
 
 AVATARS_DIR = 'avatars'
 if not os.path.exists(AVATARS_DIR):
@@ -81,10 +80,21 @@ class LimitUploadSizeMiddleware(BaseHTTPMiddleware):
 		return await call_next(request)
 
 app.add_middleware(LimitUploadSizeMiddleware, max_upload_size=100 * 1024 * 1024)
+app.add_middleware(worlds.WorldMiddleware)
+
+@app.exception_handler(auth.AuthError)
+async def auth_error_handler(request: Request, exc: auth.AuthError):
+	"""Отказ зависимостей routers/auth.py - в формате ответов обработчиков"""
+	return JSONResponse({'success': False, 'error': exc.detail}, status_code=exc.status_code)
+
+@app.exception_handler(passwords.PasswordQueueFull)
+async def password_queue_full_handler(request: Request, exc: passwords.PasswordQueueFull):
+	"""Пул bcrypt перегружен (см. routers/passwords.py)"""
+	return JSONResponse({'success': False, 'error': 'Сервер перегружен, повторите попытку позже'}, status_code=503)
 
 def generate_referral_code() -> str:
     """Генерирует уникальный 4-буквенный реферальный код из заглавных букв A-Z"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = database.connect()
     c = conn.cursor()
     
     while True:
@@ -94,16 +104,6 @@ def generate_referral_code() -> str:
             conn.close()
             return code
 
-def hash_password(password: str) -> str:
-    """Хеширует пароль с помощью bcrypt"""
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверяет соответствие пароля хешу"""
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
-
 UPLOAD_DIR = 'uploads'
 if not os.path.exists(UPLOAD_DIR):
 	os.makedirs(UPLOAD_DIR)
@@ -124,7 +124,7 @@ async def reset(request: Request):
 		return JSONResponse({'success': False, 'error': 'Неверный код'})
 	if not new_password:
 		return JSONResponse({'success': False, 'error': 'Пароль не может быть пустым'})
-	update_user_password(email, new_password)
+	await update_user_password(email, new_password)
 	RESET_CODES.pop(email)
 	return JSONResponse({'success': True})
 
@@ -132,7 +132,7 @@ async def reset(request: Request):
 async def forgot(request: Request):
 	data = await request.json()
 	email = data.get('email')
-	user = get_user_by_email(email)
+	user = await database.run(get_user_by_email, email)
 	if not user:
 		return JSONResponse({'success': False, 'error': 'Пользователь с такой почтой не найден'})
 	code = ''.join(random.choices(string.digits, k=6))
@@ -141,7 +141,8 @@ async def forgot(request: Request):
 		'email': email
 	}
 	try:
-		send_reset_code(email, code)
+		# Отправка письма - сетевой вызов, event loop его не ждёт
+		await asyncio.to_thread(send_reset_code, email, code)
 	except Exception:
 		return JSONResponse({'success': False, 'error': 'Ошибка отправки почты'})
 	return JSONResponse({'success': True})
@@ -149,12 +150,9 @@ async def forgot(request: Request):
 DB_FILE = 'users.db'
 VERIFICATION_CODES = {}
 RESET_CODES = {}
-JWT_SECRET = 'supersecretkey'
-JWT_ALGORITHM = 'HS256'
 
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
+def init_db(c):
+    """Схема пользователей, чата и карт (миграция, см. routers/migrations.py)"""
     c.execute('''CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         username TEXT UNIQUE NOT NULL,
@@ -190,6 +188,8 @@ def init_db():
         text TEXT NOT NULL,
         timestamp TEXT NOT NULL
     )''')
+    # Сообщения пользователя удаляются вместе с ним
+    c.execute('CREATE INDEX IF NOT EXISTS idx_messages_username ON messages(username)')
     c.execute('''CREATE TABLE IF NOT EXISTS maps (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
@@ -197,8 +197,6 @@ def init_db():
         uploaded_by TEXT NOT NULL,
         uploaded_at TEXT NOT NULL
     )''')
-    conn.commit()
-    conn.close()
 
 import asyncio
 
@@ -206,21 +204,21 @@ import asyncio
 async def change_password(request: Request):
     data = await request.json()
     token = request.headers.get('Authorization')
-    payload = decode_jwt(token)
+    payload = auth.decode_jwt(token)
     if not payload:
         return JSONResponse({'success': False, 'error': 'Unauthorized'}, status_code=401)
     
-    user = get_user_by_username(payload['username'])
+    user = await database.run(get_user_by_username, payload['username'])
     if not user:
         return JSONResponse({'success': False, 'error': 'User not found'}, status_code=404)
     
     current_password = data.get('current_password')
     new_password = data.get('new_password')
     
-    if not verify_password(current_password, user[1]):
+    if not await passwords.verify_async(current_password, user[1]):
         return JSONResponse({'success': False, 'error': 'Неверный текущий пароль'})
     
-    update_user_password(user[2], new_password)
+    await update_user_password(user[2], new_password)
     return JSONResponse({'success': True})
 
 class ConnectionManager:
@@ -268,32 +266,32 @@ async def websocket_endpoint(websocket: WebSocket):
 	try:
 		data = await websocket.receive_json()
 		token = data.get("token")
-		payload = decode_jwt(token)
+		payload = auth.decode_jwt(token)
 		if not payload:
 			await websocket.send_json({"error": "Unauthorized"})
 			await websocket.close()
 			return
-		user = get_user_by_username(payload["username"])
+		user = await auth.principal(payload["username"])
 		if not user:
 			await websocket.send_json({"error": "User not found"})
 			await websocket.close()
 			return
-		if user[5]:
+		if user.banned:
 			await websocket.send_json({"error": "User banned"})
 			await websocket.close()
 			return
-		await manager.connect(websocket, user[0], user[4])
+		await manager.connect(websocket, user.username, user.role)
 		while True:
 			data = await websocket.receive_json()
 			text = data.get("text", "").strip()
-			user = get_user_by_username(payload["username"])
+			user = await auth.principal(payload["username"])
 			if not user:
 				await websocket.send_json({"error": "User not found"})
 				continue
-			if user[5]:
+			if user.banned:
 				await websocket.send_json({"error": "User banned"})
 				continue
-			if user[6]:
+			if user.muted:
 				await websocket.send_json({"error": "User muted"})
 				continue
 			if not text:
@@ -310,18 +308,12 @@ async def websocket_endpoint(websocket: WebSocket):
 			message_json = json.dumps(message_data, ensure_ascii=False)
 			
 			timestamp = datetime.utcnow().isoformat() + 'Z'
-			conn = sqlite3.connect(DB_FILE)
-			c = conn.cursor()
-			c.execute('INSERT INTO messages (username, role, text, timestamp) VALUES (?, ?, ?, ?)',
-					  (user[0], user[4], message_json, timestamp))
-			message_id = c.lastrowid
-			conn.commit()
-			conn.close()
+			message_id = await chat_writer.save_message(user.username, user.role, message_json, timestamp)
 			
 			msg = {
 				"id": message_id,
-				"username": user[0],
-				"role": user[4],
+				"username": user.username,
+				"role": user.role,
 				"text": text,
 				"timestamp": timestamp
 			}
@@ -333,7 +325,7 @@ async def websocket_endpoint(websocket: WebSocket):
 		manager.disconnect(websocket)
 
 def get_user_by_username(username):
-	conn = sqlite3.connect(DB_FILE)
+	conn = database.connect()
 	c = conn.cursor()
 	c.execute('SELECT username, password, email, country, role, banned, muted, ban_until, mute_until, avatar, id FROM users WHERE username=?', (username,))
 	user = c.fetchone()
@@ -341,17 +333,17 @@ def get_user_by_username(username):
 	return user
 
 def get_user_by_email(email):
-	conn = sqlite3.connect(DB_FILE)
+	conn = database.connect()
 	c = conn.cursor()
 	c.execute('SELECT username, password, email, country, role, banned, muted, ban_until, mute_until, avatar, id  FROM users WHERE email=?', (email,))
 	user = c.fetchone()
 	conn.close()
 	return user
 
-def create_user(username, password, email):
-    conn = sqlite3.connect(DB_FILE)
+def create_user(username, hashed_password, email):
+    """Новый пользователь; пароль уже захеширован (passwords.hash_async)"""
+    conn = database.connect()
     c = conn.cursor()
-    hashed_password = hash_password(password)
     referral_code = generate_referral_code()
     c.execute('''
         INSERT INTO users (username, password, email, country, role, banned, muted, referral_code)
@@ -360,61 +352,9 @@ def create_user(username, password, email):
     conn.commit()
     conn.close()
 
-def update_user_password(email, new_password):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    hashed_password = hash_password(new_password)
-    c.execute('UPDATE users SET password=? WHERE email=?', (hashed_password, email))
-    conn.commit()
-    conn.close()
-
-def create_jwt(username, role):
-	role_str = str(role)
-	if role_str == '1':
-		role_str = 'admin'
-	elif role_str == '0':
-		role_str = 'user'
-	payload = {
-		'username': username,
-		'role': role_str,
-		'exp': datetime.utcnow() + timedelta(days=7)
-	}
-	return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
-
-def decode_jwt(token):
-	try:
-		payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-		return payload
-	except jwt.ExpiredSignatureError:
-		return None
-	except jwt.InvalidTokenError:
-		return None
-
-async def get_current_user(request: Request):
-	"""Получает текущего пользователя из токена"""
-	token = request.headers.get('Authorization')
-	if not token:
-		return None
-	
-	# Удаляем префикс "Bearer " если он есть
-	if token.startswith('Bearer '):
-		token = token[7:]
-	
-	payload = decode_jwt(token)
-	if not payload:
-		return None
-	
-	user = get_user_by_username(payload['username'])
-	if not user:
-		return None
-	
-	return {
-		'id': user[10] if len(user) > 10 else user[0],
-		'username': user[0],
-		'email': user[2],
-		'role': user[4],
-		'country': user[3]
-	}
+async def update_user_password(email, new_password):
+    hashed_password = await passwords.hash_async(new_password)
+    await database.execute('UPDATE users SET password=? WHERE email=?', (hashed_password, email))
 
 def send_verification_code(email, code):
 	creds = Credentials(
@@ -437,52 +377,6 @@ def send_verification_code(email, code):
 		print(f"Ошибка Gmail API: {e}")
 		raise
 
-def generate_missing_referral_codes():
-    """Генерирует реферальные коды для пользователей, у которых их нет"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT id FROM users WHERE referral_code IS NULL')
-    users_without_code = c.fetchall()
-    
-    generated_count = 0
-    for user in users_without_code:
-        user_id = user[0]
-        code = generate_referral_code()
-        c.execute('UPDATE users SET referral_code=? WHERE id=?', (code, user_id))
-        generated_count += 1
-    
-    conn.commit()
-    conn.close()
-    
-    if generated_count > 0:
-        print(f'Сгенерировано {generated_count} реферальных кодов для существующих пользователей')
-    else:
-        print('Все пользователи уже имеют реферальные коды')
-
-def migrate_plain_passwords():
-    """Мигрирует все незахешированные пароли в bcrypt"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT id, username, password FROM users')
-    users = c.fetchall()
-    
-    migrated_count = 0
-    for user in users:
-        user_id, username, password = user
-        if not password.startswith('$2b$') and not password.startswith('$2a$'):
-            hashed = hash_password(password)
-            c.execute('UPDATE users SET password=? WHERE id=?', (hashed, user_id))
-            migrated_count += 1
-            print(f"Мигрирован пароль для пользователя: {username}")
-    
-    conn.commit()
-    conn.close()
-    
-    if migrated_count > 0:
-        print(f"Всего мигрировано паролей: {migrated_count}")
-    else:
-        print("Все пароли уже захешированы")
-
 def send_reset_code(email, code):
 	creds = Credentials(
 		None,
@@ -506,15 +400,80 @@ def send_reset_code(email, code):
 
 @app.on_event('startup')
 def startup():
-    init_db()
-    migrate_plain_passwords()
-    generate_missing_referral_codes()  
+    migrations.migrate_all()
+    for world_id in worlds.world_ids():
+        with database.use_world(world_id):
+            turn_jobs.recover_after_restart()
+
+@app.on_event('startup')
+async def start_background_migrations():
+    # Пароли и реферальные коды - после старта, не задерживая приём запросов
+    background_migrations.start()
+
+@app.on_event('startup')
+async def start_game_clock():
+    game_clock.start()
+
+@app.on_event('startup')
+async def start_chat_writer():
+    chat_writer.start()
+
+@app.on_event('startup')
+async def start_maintenance():
+    maintenance.start()
+
+@app.on_event('startup')
+async def start_backup_schedule():
+    backup.start()
+
+@app.on_event('shutdown')
+async def stop_background_migrations():
+    await background_migrations.stop()
+
+@app.on_event('shutdown')
+async def stop_maintenance():
+    await maintenance.stop()
+
+@app.on_event('shutdown')
+async def stop_backup_schedule():
+    await backup.stop()
+
+@app.on_event('shutdown')
+async def stop_game_clock():
+    await game_clock.stop()
+
+@app.on_event('shutdown')
+async def stop_chat_writer():
+    await chat_writer.stop()
+
+@app.on_event('shutdown')
+def close_database():
+    database.close_all()
+
+@app.on_event('shutdown')
+def stop_password_pool():
+    passwords.shutdown()
+
+def lift_expired_ban(username):
+    """Снимает истёкший бан и возвращает обновлённую строку пользователя"""
+    conn = database.connect()
+    try:
+        conn.execute('UPDATE users SET banned=0, ban_until=NULL WHERE username=?', (username,))
+        conn.commit()
+    finally:
+        conn.close()
+    auth_cache.invalidate(username)
+    return get_user_by_username(username)
 
 @app.post('/login')
 async def login(request: Request):
     data = await request.json()
-    user = get_user_by_username(data['username'])
-    if user and verify_password(data['password'], user[1]):
+    user = await database.run(get_user_by_username, data['username'])
+    if user and await passwords.verify_async(data['password'], user[1]):
+        # Хеш со старой стоимостью bcrypt пересчитывается при входе
+        new_hash = await passwords.rehash_if_needed(data['password'], user[1])
+        if new_hash:
+            await database.execute('UPDATE users SET password=? WHERE id=?', (new_hash, user[10]))
         banned = bool(user[5])
         ban_until = user[7]
         now = datetime.utcnow()
@@ -525,19 +484,14 @@ async def login(request: Request):
                 except Exception:
                     ban_dt = None
                 if ban_dt and now >= ban_dt:
-                    conn = sqlite3.connect(DB_FILE)
-                    c = conn.cursor()
-                    c.execute('UPDATE users SET banned=0, ban_until=NULL WHERE username=?', (user[0],))
-                    conn.commit()
-                    conn.close()
-                    user = get_user_by_username(data['username'])
+                    user = await database.run(lift_expired_ban, user[0])
                     banned = bool(user[5])
             if banned:
                 if ban_until:
                     return JSONResponse({'success': False, 'error': f'Аккаунт забанен до {ban_until}'})
                 else:
                     return JSONResponse({'success': False, 'error': 'Аккаунт забанен'})
-        token = create_jwt(user[0], user[4])
+        token = auth.create_jwt(user[0], user[4])
         return JSONResponse({
             'success': True,
             'username': user[0],
@@ -550,7 +504,7 @@ async def login(request: Request):
 
 @app.get('/user/{username}/avatar')
 async def get_user_avatar(username: str):
-    user = get_user_by_username(username)
+    user = await database.run(get_user_by_username, username)
     if not user:
         return JSONResponse({'success': False, 'error': 'User not found'}, status_code=404)
     
@@ -566,9 +520,9 @@ async def get_user_avatar(username: str):
 @app.post('/register')
 async def register(request: Request):
 	data = await request.json()
-	if get_user_by_username(data['username']):
+	if await database.run(get_user_by_username, data['username']):
 		return JSONResponse({'success': False, 'error': 'Логин уже занят'})
-	if get_user_by_email(data['email']):
+	if await database.run(get_user_by_email, data['email']):
 		return JSONResponse({'success': False, 'error': 'Почта уже используется'})
 	code = ''.join(random.choices(string.digits, k=6))
 	VERIFICATION_CODES[data['email']] = {
@@ -578,7 +532,7 @@ async def register(request: Request):
 		'email': data['email']
 	}
 	try:
-		send_verification_code(data['email'], code)
+		await asyncio.to_thread(send_verification_code, data['email'], code)
 	except Exception:
 		return JSONResponse({'success': False, 'error': 'Ошибка отправки почты'})
 	return JSONResponse({'success': True})
@@ -590,10 +544,11 @@ async def verify(request: Request):
 	if not info:
 		return JSONResponse({'success': False, 'error': 'Нет ожидающей регистрации'})
 	if data['code'] == info['code']:
-		create_user(info['username'], info['password'], info['email'])
+		hashed_password = await passwords.hash_async(info['password'])
+		await database.run(create_user, info['username'], hashed_password, info['email'])
 		VERIFICATION_CODES.pop(info['email'])
-		user = get_user_by_username(info['username'])
-		token = create_jwt(user[0], user[4])
+		user = await database.run(get_user_by_username, info['username'])
+		token = auth.create_jwt(user[0], user[4])
 		return JSONResponse({
 			'success': True,
 			'username': info['username'],
@@ -607,11 +562,11 @@ async def verify(request: Request):
 @app.post('/avatar/upload')
 async def upload_avatar(request: Request, file: UploadFile = File(...)):
     token = request.headers.get('Authorization')
-    payload = decode_jwt(token)
+    payload = auth.decode_jwt(token)
     if not payload:
         return JSONResponse({'success': False, 'error': 'Unauthorized'}, status_code=401)
     
-    user = get_user_by_username(payload['username'])
+    user = await database.run(get_user_by_username, payload['username'])
     if not user:
         return JSONResponse({'success': False, 'error': 'User not found'}, status_code=404)
     
@@ -638,11 +593,7 @@ async def upload_avatar(request: Request, file: UploadFile = File(...)):
         with open(file_path, 'wb') as f:
             f.write(content)
         
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute('UPDATE users SET avatar=? WHERE id=?', (filename, user_id))
-        conn.commit()
-        conn.close()
+        await database.execute('UPDATE users SET avatar=? WHERE id=?', (filename, user_id))
         
         return JSONResponse({
             'success': True,
@@ -653,13 +604,7 @@ async def upload_avatar(request: Request, file: UploadFile = File(...)):
         print(f"Ошибка загрузки аватара: {e}")
         return JSONResponse({'success': False, 'error': 'Ошибка загрузки аватара'}, status_code=500)
 
-@app.post('/avatar/delete')
-async def delete_avatar(request: Request):
-    token = request.headers.get('Authorization')
-    payload = decode_jwt(token)
-    if not payload:
-        return JSONResponse({'success': False, 'error': 'Unauthorized'}, status_code=401)
-    
+def _delete_avatar(payload):
     user = get_user_by_username(payload['username'])
     if not user:
         return JSONResponse({'success': False, 'error': 'User not found'}, status_code=404)
@@ -673,7 +618,7 @@ async def delete_avatar(request: Request):
             if os.path.exists(avatar_path):
                 os.remove(avatar_path)
         
-        conn = sqlite3.connect(DB_FILE)
+        conn = database.connect()
         c = conn.cursor()
         c.execute('UPDATE users SET avatar=NULL WHERE id=?', (user_id,))
         conn.commit()
@@ -685,12 +630,21 @@ async def delete_avatar(request: Request):
         print(f"Ошибка удаления аватара: {e}")
         return JSONResponse({'success': False, 'error': 'Ошибка удаления аватара'}, status_code=500)
 
+@app.post('/avatar/delete')
+async def delete_avatar(request: Request):
+    token = request.headers.get('Authorization')
+    payload = auth.decode_jwt(token)
+    if not payload:
+        return JSONResponse({'success': False, 'error': 'Unauthorized'}, status_code=401)
+    
+    return await database.run(_delete_avatar, payload)
+
 @app.get('/me')
 async def me(request: Request):
     token = request.headers.get('Authorization')
-    payload = decode_jwt(token)
+    payload = auth.decode_jwt(token)
     if payload:
-        user = get_user_by_username(payload['username'])
+        user = await database.run(get_user_by_username, payload['username'])
         if not user:
             return JSONResponse({'logged_in': False})
         
@@ -699,11 +653,10 @@ async def me(request: Request):
             avatar_url = f'/avatars/{user[9]}'
         
         # Получаем secret_coins из базы
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute('SELECT secret_coins FROM users WHERE id=?', (user[10] if len(user) > 10 else user[0],))
-        coins_result = c.fetchone()
-        conn.close()
+        coins_result = await database.fetch_one(
+            'SELECT secret_coins FROM users WHERE id=?',
+            (user[10] if len(user) > 10 else user[0],)
+        )
         secret_coins = coins_result[0] if coins_result and coins_result[0] is not None else 0
         
         return JSONResponse({
@@ -722,14 +675,8 @@ async def me(request: Request):
         })
     return JSONResponse({'logged_in': False})
 
-@app.get('/admin/users')
-async def admin_users(request: Request):
-	token = request.headers.get('Authorization')
-	payload = decode_jwt(token)
-	role = payload.get('role') if payload else None
-	if role != 'admin':
-		return JSONResponse({'detail': 'Forbidden'}, status_code=403)
-	conn = sqlite3.connect(DB_FILE)
+def _admin_users():
+	conn = database.connect()
 	c = conn.cursor()
 	c.execute('SELECT username, password, email, country, role, banned, muted, ban_until, mute_until, avatar, id FROM users')
 	users = [
@@ -750,29 +697,19 @@ async def admin_users(request: Request):
 	conn.close()
 	return JSONResponse({'users': users})
 
+@app.get('/admin/users')
+async def admin_users(admin=Depends(auth.require_admin)):
+	return await database.run(_admin_users)
+
 @app.get('/api/admin/check')
-async def check_admin(request: Request):
+async def check_admin(user=Depends(auth.current_user)):
 	"""Проверка прав администратора"""
-	user = await get_current_user(request)
 	if not user:
 		return JSONResponse({'is_admin': False})
 	return JSONResponse({'is_admin': user.get('role') == 'admin'})
 
-@app.post('/admin/set_status')
-async def admin_set_status(request: Request):
-	token = request.headers.get('Authorization')
-	payload = decode_jwt(token)
-	role = payload.get('role') if payload else None
-	if role != 'admin':
-		return JSONResponse({'detail': 'Forbidden'}, status_code=403)
-	data = await request.json()
-	user_id = data.get('id')
-	action = data.get('action')
-	value = data.get('value')
-	until = data.get('until')
-	if action not in ('ban', 'mute'):
-		return JSONResponse({'success': False, 'error': 'Некорректное действие'})
-	conn = sqlite3.connect(DB_FILE)
+def _admin_set_status(user_id, action, value, until):
+	conn = database.connect()
 	c = conn.cursor()
 	if action == 'ban':
 		c.execute('UPDATE users SET banned=?, ban_until=? WHERE id=?', (1 if value else 0, until, user_id))
@@ -780,27 +717,22 @@ async def admin_set_status(request: Request):
 		c.execute('UPDATE users SET muted=?, mute_until=? WHERE id=?', (1 if value else 0, until, user_id))
 	conn.commit()
 	conn.close()
+	auth_cache.invalidate(user_id=user_id)
 	return JSONResponse({'success': True})
 
-@app.post('/admin/delete-user')
-async def delete_user(request: Request):
-	"""Полное удаление пользователя и всех его данных"""
-	token = request.headers.get('Authorization')
-	payload = decode_jwt(token)
-	if not payload:
-		return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-	
-	admin = get_user_by_username(payload['username'])
-	if not admin or admin[4] != 'admin':
-		return JSONResponse({'success': False, 'error': 'Недостаточно прав'}, status_code=403)
-	
+@app.post('/admin/set_status')
+async def admin_set_status(request: Request, admin=Depends(auth.require_admin)):
 	data = await request.json()
-	user_id = data.get('user_id')
-	
-	if not user_id:
-		return JSONResponse({'success': False, 'error': 'Не указан ID пользователя'}, status_code=400)
-	
-	conn = sqlite3.connect(DB_FILE)
+	user_id = data.get('id')
+	action = data.get('action')
+	value = data.get('value')
+	until = data.get('until')
+	if action not in ('ban', 'mute'):
+		return JSONResponse({'success': False, 'error': 'Некорректное действие'})
+	return await database.run(_admin_set_status, user_id, action, value, until)
+
+def _delete_user(user_id):
+	conn = database.connect()
 	c = conn.cursor()
 	
 	try:
@@ -822,29 +754,12 @@ async def delete_user(request: Request):
 				except Exception as e:
 					print(f"Error deleting avatar: {e}")
 		
-		# Освобождаем страну если была назначена
-		if country:
-			import json
-			countries_path = 'data/countries.json'
-			try:
-				with open(countries_path, 'r', encoding='utf-8') as f:
-					countries = json.load(f)
-				
-				for c_data in countries:
-					if c_data['id'] == country:
-						c_data['available'] = True
-						break
-				
-				with open(countries_path, 'w', encoding='utf-8') as f:
-					json.dump(countries, f, ensure_ascii=False, indent=4)
-			except Exception as e:
-				print(f"Error updating countries.json: {e}")
-		
-		# Удаляем заявки пользователя
+		# Удаляем заявки пользователя во всех мирах
 		c.execute('DELETE FROM player_applications WHERE user_id=?', (user_id,))
 		
 		# Удаляем сообщения в чате
 		c.execute('DELETE FROM messages WHERE username=?', (username,))
+		archive.forget_user(username)
 		
 		# Удаляем персонажа если есть
 		c.execute('DELETE FROM characters WHERE user_id=?', (user_id,))
@@ -856,6 +771,18 @@ async def delete_user(request: Request):
 		c.execute('DELETE FROM users WHERE id=?', (user_id,))
 		
 		conn.commit()
+		auth_cache.invalidate(username, user_id)
+		
+		# Страны пользователя в остальных мирах (после commit: соединение мира запроса
+		# держало блокировку записи своего файла)
+		for world_id in worlds.player_countries(user_id):
+			with database.use_world(world_id):
+				world_conn = database.connect()
+			try:
+				world_conn.execute('DELETE FROM countries WHERE player_id=?', (user_id,))
+				world_conn.commit()
+			finally:
+				world_conn.close()
 		
 		return JSONResponse({
 			'success': True,
@@ -869,68 +796,68 @@ async def delete_user(request: Request):
 	finally:
 		conn.close()
 
-@app.post('/admin/remove-player-country')
-async def remove_player_country(request: Request):
-	"""Снимает игрока со страны и возвращает роль user"""
-	token = request.headers.get('Authorization')
-	payload = decode_jwt(token)
-	role = payload.get('role') if payload else None
-	if role != 'admin':
-		return JSONResponse({'detail': 'Forbidden'}, status_code=403)
-	
+@app.post('/admin/delete-user')
+async def delete_user(request: Request, admin=Depends(auth.require_admin)):
+	"""Полное удаление пользователя и всех его данных"""
 	data = await request.json()
 	user_id = data.get('user_id')
 	
-	conn = sqlite3.connect(DB_FILE)
+	if not user_id:
+		return JSONResponse({'success': False, 'error': 'Не указан ID пользователя'}, status_code=400)
+	
+	return await database.run(_delete_user, user_id)
+
+def _remove_player_country(user_id):
+	conn = database.connect()
 	c = conn.cursor()
 	
 	try:
-		c.execute('SELECT country, role FROM users WHERE id=?', (user_id,))
+		c.execute('SELECT role FROM users WHERE id=?', (user_id,))
 		user = c.fetchone()
 		
 		if not user:
 			return JSONResponse({'success': False, 'error': 'Пользователь не найден'}, status_code=404)
 		
-		current_country = user[0]
-		current_role = user[1]
-		
-		if current_role != 'player':
+		if user[0] != 'player':
 			return JSONResponse({'success': False, 'error': 'Пользователь не является игроком'}, status_code=400)
 		
-		if not current_country:
-			return JSONResponse({'success': False, 'error': 'У пользователя нет назначенной страны'}, status_code=400)
+		# Страна игрока в мире запроса; users.country общий для всех миров
+		c.execute('SELECT id FROM countries WHERE player_id=?', (user_id,))
+		country = c.fetchone()
 		
-		c.execute('UPDATE users SET role=?, country=NULL WHERE id=?', ('user', user_id))
+		if not country:
+			return JSONResponse({'success': False, 'error': 'У пользователя нет страны в этом мире'}, status_code=400)
+		
+		current_country = country[0]
+		world_id = database.current_world()
+		
+		# Страны в других мирах читаются до записи: роль player и users.country
+		# меняются в той же транзакции, что и снятие со страны
+		remaining = {w: cid for w, cid in worlds.player_countries(user_id).items() if w != world_id}
+		
+		c.execute('UPDATE countries SET player_id=NULL WHERE id=?', (current_country,))
 		
 		c.execute('''
 			UPDATE player_applications 
 			SET status='rejected', 
 				rejection_reason='Снят со страны администратором',
 				updated_at=?
-			WHERE user_id=?
-		''', (datetime.now().isoformat(), user_id))
+			WHERE user_id=? AND world_id=?
+		''', (datetime.now().isoformat(), user_id, world_id))
 		
+		# Роль player остаётся, пока у игрока есть страна в другом мире
+		if remaining:
+			c.execute('UPDATE users SET country=? WHERE id=?', (next(iter(remaining.values())), user_id))
+			message = f'Игрок снят со страны "{current_country}".'
+		else:
+			c.execute('UPDATE users SET role=?, country=NULL WHERE id=?', ('user', user_id))
+			message = f'Игрок снят со страны "{current_country}". Роль изменена на "user".'
 		conn.commit()
-		
-		import json
-		countries_path = 'data/countries.json'
-		try:
-			with open(countries_path, 'r', encoding='utf-8') as f:
-				countries = json.load(f)
-			
-			for country in countries:
-				if country['id'] == current_country:
-					country['available'] = True
-					break
-			
-			with open(countries_path, 'w', encoding='utf-8') as f:
-				json.dump(countries, f, ensure_ascii=False, indent=4)
-		except Exception as e:
-			print(f"Error updating countries.json: {e}")
+		auth_cache.invalidate(user_id=user_id)
 		
 		return JSONResponse({
 			'success': True,
-			'message': f'Игрок снят со страны "{current_country}". Роль изменена на "user".'
+			'message': message
 		})
 		
 	except Exception as e:
@@ -939,14 +866,16 @@ async def remove_player_country(request: Request):
 	finally:
 		conn.close()
 
-@app.get('/api/shop/coins')
-async def get_shop_coins(request: Request):
-	"""Получение баланса секретных монет пользователя"""
-	user = await get_current_user(request)
-	if not user:
-		return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
+@app.post('/admin/remove-player-country')
+async def remove_player_country(request: Request, admin=Depends(auth.require_admin)):
+	"""Снимает игрока со страны и возвращает роль user"""
+	data = await request.json()
+	user_id = data.get('user_id')
 	
-	conn = sqlite3.connect(DB_FILE)
+	return await database.run(_remove_player_country, user_id)
+
+def _get_shop_coins(user):
+	conn = database.connect()
 	c = conn.cursor()
 	
 	try:
@@ -969,21 +898,13 @@ async def get_shop_coins(request: Request):
 	finally:
 		conn.close()
 
-@app.post('/api/shop/purchase')
-async def shop_purchase(request: Request):
-	"""Покупка предмета в секретном магазине"""
-	user = await get_current_user(request)
-	if not user:
-		return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-	
-	data = await request.json()
-	item = data.get('item')
-	price = data.get('price')
-	
-	if not item or not price:
-		return JSONResponse({'success': False, 'error': 'Некорректные данные'}, status_code=400)
-	
-	conn = sqlite3.connect(DB_FILE)
+@app.get('/api/shop/coins')
+async def get_shop_coins(user=Depends(auth.require_user)):
+	"""Получение баланса секретных монет пользователя"""
+	return await database.run(_get_shop_coins, user)
+
+def _shop_purchase(user, item, price):
+	conn = database.connect()
 	c = conn.cursor()
 	
 	try:
@@ -1044,3 +965,15 @@ async def shop_purchase(request: Request):
 		return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
 	finally:
 		conn.close()
+
+@app.post('/api/shop/purchase')
+async def shop_purchase(request: Request, user=Depends(auth.require_user)):
+	"""Покупка предмета в секретном магазине"""
+	data = await request.json()
+	item = data.get('item')
+	price = data.get('price')
+	
+	if not item or not price:
+		return JSONResponse({'success': False, 'error': 'Некорректные данные'}, status_code=400)
+	
+	return await database.run(_shop_purchase, user, item, price)
@@ -0,0 +1,328 @@
+"""Архив старых сообщений чата и истории экономики.
+
+Таблицы messages и economy_history только растут, а читаются в основном их
+последние строки. Всё старше горизонта хранения переносится в отдельный файл
+SQLite (ARCHIVE_DB_FILE), где текст сообщения и налоговые настройки хранятся
+сжатыми zlib. Основная БД остаётся маленькой: быстрее резервные копии, снимки
+ходов и VACUUM.
+
+Горизонты:
+    MESSAGES_RETENTION_DAYS         - сообщения старше стольких дней
+    ECONOMY_HISTORY_RETENTION_TURNS - история старше стольких ходов от текущего
+0 отключает перенос.
+
+Перенос идёт пачками по ARCHIVE_BATCH_SIZE строк: пачка записывается в архив
+(INSERT OR REPLACE, коммит архива), потом удаляется из основной БД. Если
+процесс упадёт между этими шагами, следующий прогон перепишет те же строки
+заново, поэтому ничего не теряется и не дублируется.
+
+Перенос выполняется после каждого хода (turn_jobs) или вручную:
+    python -m routers.archive            # перенести всё старше горизонта
+    python -m routers.archive --status   # сколько строк в основной БД и в архиве
+
+Чтение: /api/chat/messages?before= и /api/economic/country/{id}/economy-history
+сначала берут строки из основной БД, а если их не хватило до limit - дочитывают
+более старые из архива.
+
+Чат общий для всех миров, и его архив - всегда ARCHIVE_DB_FILE. История
+экономики остальных миров архивируется в WORLDS_DIR/<мир>.archive.db.
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+from routers import database
+
+ARCHIVE_DB_FILE = os.getenv('ARCHIVE_DB_FILE', 'archive.db')
+
+# Сообщения чата старше стольких дней уходят в архив (0 - не переносить)
+MESSAGES_RETENTION_DAYS = int(os.getenv('MESSAGES_RETENTION_DAYS', '180'))
+
+# История экономики старше стольких ходов уходит в архив (0 - не переносить)
+ECONOMY_HISTORY_RETENTION_TURNS = int(os.getenv('ECONOMY_HISTORY_RETENTION_TURNS', '100'))
+
+# /economy-history/all читает последние 20 ходов только из основной БД,
+# поэтому горизонт истории не бывает короче
+ECONOMY_HISTORY_MIN_TURNS = 20
+
+# Строк за одну транзакцию переноса
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '1000'))
+
+ZLIB_LEVEL = 6
+
+# Два переноса одновременно (после хода и из админки) работали бы с одними строками
+_archive_lock = threading.Lock()
+
+# Файлы архива, схема которых уже создана в этом процессе
+_schema_ready = set()
+
+def add_retention_indexes(cursor):
+    """Индексы для выборки строк старше горизонта (миграция, см. routers/migrations.py)"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_economy_history_turn ON economy_history(turn_number)')
+
+def add_economy_history_turn_index(cursor):
+    """Индекс для переноса истории экономики в файлах миров (в users.db его создаёт версия 9)"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_economy_history_turn ON economy_history(turn_number)')
+
+def _init_archive(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL,
+            role TEXT NOT NULL,
+            text BLOB NOT NULL,
+            timestamp TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS economy_history (
+            id INTEGER PRIMARY KEY,
+            country_id TEXT NOT NULL,
+            turn_number INTEGER NOT NULL,
+            balance_start REAL NOT NULL,
+            balance_end REAL NOT NULL,
+            income REAL NOT NULL,
+            expenses REAL NOT NULL,
+            tax_income REAL NOT NULL,
+            tax_settings BLOB NOT NULL,
+            created_at TEXT NOT NULL,
+            UNIQUE(country_id, turn_number)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_username ON messages(username)')
+    conn.commit()
+
+def archive_file(world_id=None):
+    """Файл архива мира (по умолчанию - текущего)"""
+    world_id = world_id or database.current_world()
+    if world_id == database.DEFAULT_WORLD:
+        return ARCHIVE_DB_FILE
+    return os.path.join(database.WORLDS_DIR, f'{world_id}.archive.db')
+
+def open_archive(create=True, world_id=None):
+    """Соединение с архивом мира; без create возвращает None, если архива ещё нет"""
+    path = archive_file(world_id)
+    if not create and not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(path, timeout=database.DB_BUSY_TIMEOUT)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    if path not in _schema_ready:
+        _init_archive(conn)
+        _schema_ready.add(path)
+    return conn
+
+def _open_messages_archive(create=True):
+    # Чат общий для всех миров - его архив всегда в файле мира по умолчанию
+    return open_archive(create, database.DEFAULT_WORLD)
+
+def _pack(text):
+    return zlib.compress(text.encode('utf-8'), ZLIB_LEVEL)
+
+def _unpack(blob):
+    return zlib.decompress(blob).decode('utf-8')
+
+def messages_cutoff(now=None):
+    """Граница переноса сообщений (timestamp в формате чата) или None, если перенос выключен"""
+    if MESSAGES_RETENTION_DAYS <= 0:
+        return None
+    now = now or datetime.utcnow()
+    return (now - timedelta(days=MESSAGES_RETENTION_DAYS)).isoformat() + 'Z'
+
+def economy_history_cutoff(current_turn):
+    """Первый ход, который остаётся в основной БД, или None, если перенос выключен"""
+    if ECONOMY_HISTORY_RETENTION_TURNS <= 0:
+        return None
+    return current_turn - max(ECONOMY_HISTORY_RETENTION_TURNS, ECONOMY_HISTORY_MIN_TURNS)
+
+def _move_batches(conn, archive_conn, select_sql, select_params, insert_sql, pack_row, delete_sql):
+    """Перенос строк пачками: запись в архив, коммит архива, удаление из основной БД"""
+    moved = 0
+    while True:
+        rows = conn.execute(select_sql, select_params + (ARCHIVE_BATCH_SIZE,)).fetchall()
+        if not rows:
+            return moved
+        archive_conn.executemany(insert_sql, [pack_row(row) for row in rows])
+        archive_conn.commit()
+        conn.executemany(delete_sql, [(row[0],) for row in rows])
+        conn.commit()
+        moved += len(rows)
+
+def archive_messages(conn, archive_conn, cutoff):
+    return _move_batches(
+        conn, archive_conn,
+        'SELECT id, username, role, text, timestamp FROM messages WHERE timestamp < ? ORDER BY timestamp LIMIT ?',
+        (cutoff,),
+        'INSERT OR REPLACE INTO messages (id, username, role, text, timestamp) VALUES (?, ?, ?, ?, ?)',
+        lambda row: (row[0], row[1], row[2], _pack(row[3]), row[4]),
+        'DELETE FROM messages WHERE id = ?'
+    )
+
+def archive_economy_history(conn, archive_conn, before_turn):
+    return _move_batches(
+        conn, archive_conn,
+        '''SELECT id, country_id, turn_number, balance_start, balance_end, income, expenses,
+                  tax_income, tax_settings, created_at
+           FROM economy_history WHERE turn_number < ? ORDER BY turn_number LIMIT ?''',
+        (before_turn,),
+        '''INSERT OR REPLACE INTO economy_history
+           (id, country_id, turn_number, balance_start, balance_end, income, expenses,
+            tax_income, tax_settings, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        lambda row: row[:8] + (_pack(row[8]), row[9]),
+        'DELETE FROM economy_history WHERE id = ?'
+    )
+
+def run_retention(now=None):
+    """Перенос в архив всего, что старше горизонтов
+
+    Returns:
+        dict: сколько строк перенесено (messages, economy_history)
+    """
+    with _archive_lock:
+        conn = database.connect()
+        try:
+            result = {'messages': 0, 'economy_history': 0}
+
+            cutoff = messages_cutoff(now)
+            if cutoff:
+                archive_conn = _open_messages_archive()
+                try:
+                    result['messages'] = archive_messages(conn, archive_conn, cutoff)
+                finally:
+                    archive_conn.close()
+
+            row = conn.execute('SELECT current_turn FROM game_state WHERE id = 1').fetchone()
+            before_turn = economy_history_cutoff(row[0]) if row else None
+            if before_turn is not None and before_turn > 0:
+                archive_conn = open_archive()
+                try:
+                    result['economy_history'] = archive_economy_history(conn, archive_conn, before_turn)
+                finally:
+                    archive_conn.close()
+
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+def archived_messages(before_id, limit):
+    """Сообщения из архива с id < before_id (None - самые новые), от новых к старым
+
+    Returns:
+        list: кортежи (id, username, role, text, timestamp), как в основной БД
+    """
+    archive_conn = _open_messages_archive(create=False)
+    if archive_conn is None:
+        return []
+    try:
+        if before_id is None:
+            rows = archive_conn.execute(
+                'SELECT id, username, role, text, timestamp FROM messages ORDER BY id DESC LIMIT ?',
+                (limit,)
+            ).fetchall()
+        else:
+            rows = archive_conn.execute(
+                'SELECT id, username, role, text, timestamp FROM messages WHERE id < ? ORDER BY id DESC LIMIT ?',
+                (before_id, limit)
+            ).fetchall()
+        return [(row[0], row[1], row[2], _unpack(row[3]), row[4]) for row in rows]
+    finally:
+        archive_conn.close()
+
+def archived_economy_history(country_id, before_turn, limit):
+    """История экономики страны из архива за ходы < before_turn (None - самые поздние), от новых к старым
+
+    Returns:
+        list: dict с теми же полями, что строки economy_history
+    """
+    archive_conn = open_archive(create=False)
+    if archive_conn is None:
+        return []
+    archive_conn.row_factory = sqlite3.Row
+    try:
+        query = '''SELECT turn_number, balance_start, balance_end, income, expenses,
+                          tax_income, tax_settings, created_at
+                   FROM economy_history WHERE country_id = ?'''
+        params = (country_id,)
+        if before_turn is not None:
+            query += ' AND turn_number < ?'
+            params += (before_turn,)
+        rows = archive_conn.execute(query + ' ORDER BY turn_number DESC LIMIT ?', params + (limit,)).fetchall()
+
+        history = []
+        for row in rows:
+            item = dict(row)
+            item['tax_settings'] = _unpack(item['tax_settings'])
+            history.append(item)
+        return history
+    finally:
+        archive_conn.close()
+
+def delete_archived_message(message_id):
+    """Удаление сообщения из архива; True, если оно там было"""
+    archive_conn = _open_messages_archive(create=False)
+    if archive_conn is None:
+        return False
+    try:
+        deleted = archive_conn.execute('DELETE FROM messages WHERE id = ?', (message_id,)).rowcount
+        archive_conn.commit()
+        return deleted > 0
+    finally:
+        archive_conn.close()
+
+def forget_user(username):
+    """Удаление всех сообщений пользователя из архива (при удалении пользователя)"""
+    archive_conn = _open_messages_archive(create=False)
+    if archive_conn is None:
+        return
+    try:
+        archive_conn.execute('DELETE FROM messages WHERE username = ?', (username,))
+        archive_conn.commit()
+    finally:
+        archive_conn.close()
+
+def status():
+    """Число строк в основной БД и в архиве по каждой таблице"""
+    result = {}
+    conn = database.connect()
+    try:
+        for table, open_table_archive in (('messages', _open_messages_archive), ('economy_history', open_archive)):
+            live = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            archive_conn = open_table_archive(create=False)
+            try:
+                archived = archive_conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] if archive_conn else 0
+            finally:
+                if archive_conn:
+                    archive_conn.close()
+            result[table] = {'live': live, 'archived': archived}
+    finally:
+        conn.close()
+    path = archive_file()
+    result['archive_size_bytes'] = os.path.getsize(path) if os.path.exists(path) else 0
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Перенос старых сообщений и истории экономики в архив')
+    parser.add_argument('--status', action='store_true', help='Показать число строк и выйти')
+    parser.add_argument('--world', default=database.DEFAULT_WORLD, help='Мир, историю экономики которого переносить')
+    args = parser.parse_args()
+
+    with database.use_world(args.world):
+        if not args.status:
+            moved = run_retention()
+            print(f"Перенесено в архив: сообщений {moved['messages']}, строк истории экономики {moved['economy_history']}")
+
+        info = status()
+    for table in ('messages', 'economy_history'):
+        print(f"{table:<16} основная БД: {info[table]['live']:>8}  архив: {info[table]['archived']:>8}")
+    print(f"Размер архива: {info['archive_size_bytes']} байт")
+
+if __name__ == '__main__':
+    main()
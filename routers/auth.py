@@ -0,0 +1,162 @@
+"""Авторизация: токены, пользователь запроса и зависимости для обработчиков.
+
+Единственное место, где декодируются JWT и по имени из токена находится
+пользователь. Раньше main.py, routers/chat.py и routers/maps.py держали по
+своей копии decode_jwt и get_user_by_username с зашитым секретом и доступом
+к строке users по номерам столбцов (user[4], user[10]).
+
+Пользователь представлен записью Principal (__slots__): поля id, username,
+email, role, country, banned, muted. Для старого кода поддерживается и
+словарный доступ (user['role'], user.get('role')). Записи кэшируются в
+routers/auth_cache.py; principal(username) - единый путь поиска с кэшем.
+
+current_user(request) определяет пользователя один раз за запрос (результат
+хранится в request.state) и подходит и для прямого вызова, и для Depends.
+Зависимости require_user, require_admin, require_staff и country_owner_or_admin вместо
+возврата None поднимают AuthError; main.py превращает его в обычный ответ
+{'success': False, 'error': ...}.
+"""
+import os
+from datetime import datetime, timedelta
+
+import jwt
+from fastapi import HTTPException, Request
+
+from routers import auth_cache, database
+
+JWT_SECRET = os.getenv('JWT_SECRET', 'supersecretkey')
+JWT_ALGORITHM = 'HS256'
+
+# Срок действия выдаваемых токенов
+JWT_LIFETIME = timedelta(days=int(os.getenv('JWT_LIFETIME_DAYS', '7')))
+
+STAFF_ROLES = ('admin', 'moderator')
+
+# Ключ и параметры проверки готовятся один раз, а не при каждом decode
+_jwt = jwt.PyJWT(options={'require': ['exp', 'username']})
+_jwt_key = JWT_SECRET.encode('utf-8')
+_jwt_algorithms = [JWT_ALGORITHM]
+
+_NOT_RESOLVED = object()
+
+class AuthError(HTTPException):
+    """Нет авторизации или прав; ответ - JSON в формате остальных обработчиков"""
+
+class Principal:
+    """Пользователь запроса (неизменяемый - один объект отдаётся из кэша всем запросам)"""
+
+    __slots__ = ('id', 'username', 'email', 'role', 'country', 'banned', 'muted')
+
+    def __init__(self, id, username, email, role, country, banned, muted):
+        for name, value in zip(self.__slots__, (id, username, email, role, country, bool(banned), bool(muted))):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Principal неизменяем')
+
+    # Словарный доступ для обработчиков, написанных под dict
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def __repr__(self):
+        return f'Principal({self.username!r}, role={self.role!r})'
+
+def create_jwt(username, role):
+    role_str = str(role)
+    if role_str == '1':
+        role_str = 'admin'
+    elif role_str == '0':
+        role_str = 'user'
+    payload = {
+        'username': username,
+        'role': role_str,
+        'exp': datetime.utcnow() + JWT_LIFETIME
+    }
+    return jwt.encode(payload, _jwt_key, algorithm=JWT_ALGORITHM)
+
+def decode_jwt(token):
+    """Содержимое токена или None, если он не подписан нами, истёк или неполон"""
+    if not token:
+        return None
+    if token.startswith('Bearer '):
+        token = token[7:]
+    try:
+        return _jwt.decode(token, _jwt_key, algorithms=_jwt_algorithms)
+    except jwt.InvalidTokenError:
+        return None
+
+def load_principal(username):
+    """Пользователь из БД в обход кэша (выполняется вне event loop)"""
+    conn = database.connect()
+    try:
+        row = conn.execute(
+            'SELECT id, username, email, role, country, banned, muted FROM users WHERE username=?',
+            (username,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    principal = Principal(*row)
+    auth_cache.put(username, principal)
+    return principal
+
+def get_principal(username):
+    """Пользователь по имени: из кэша или из БД (синхронно, для кода вне event loop)"""
+    return auth_cache.get(username) or load_principal(username)
+
+async def principal(username):
+    """Пользователь по имени; при попадании в кэш БД и пул потоков не используются"""
+    return auth_cache.get(username) or await database.run(load_principal, username)
+
+async def principal_for_token(token):
+    payload = decode_jwt(token)
+    if not payload:
+        return None
+    return await principal(payload['username'])
+
+async def current_user(request: Request):
+    """Текущий пользователь из токена или None (один раз за запрос)"""
+    user = getattr(request.state, 'user', _NOT_RESOLVED)
+    if user is _NOT_RESOLVED:
+        user = await principal_for_token(request.headers.get('Authorization'))
+        request.state.user = user
+    return user
+
+async def require_user(request: Request):
+    user = await current_user(request)
+    if not user:
+        raise AuthError(status_code=401, detail='Требуется авторизация')
+    return user
+
+async def require_admin(request: Request):
+    user = await require_user(request)
+    if user.role != 'admin':
+        raise AuthError(status_code=403, detail='Требуются права администратора')
+    return user
+
+async def require_staff(request: Request):
+    """Администратор или модератор"""
+    user = await require_user(request)
+    if user.role not in STAFF_ROLES:
+        raise AuthError(status_code=403, detail='Требуются права администратора')
+    return user
+
+async def country_owner_or_admin(country_id: str, request: Request):
+    """Игрок этой страны, администратор или модератор (country_id - из пути запроса)"""
+    user = await require_user(request)
+    if user.role in STAFF_ROLES:
+        return user
+    country = await database.fetch_one('SELECT player_id FROM countries WHERE id = ?', (country_id,))
+    if not country or country['player_id'] != user.id:
+        raise AuthError(status_code=403, detail='Нет доступа к этой стране')
+    return user
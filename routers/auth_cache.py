@@ -0,0 +1,74 @@
+"""Кэш пользователей для routers/auth.py.
+
+Каждый авторизованный запрос раньше читал строку users по имени из токена.
+Теперь auth.Principal хранится в памяти процесса AUTH_CACHE_TTL секунд, и
+повторный запрос того же пользователя обходится без обращения к БД.
+
+Обработчики, меняющие роль, страну, бан/мут или удаляющие пользователя,
+вызывают invalidate(): следующее обращение снова читает БД. Другие процессы
+uvicorn об этом не узнают - их кэш устаревает не дольше чем через TTL.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Сколько секунд доверять записи кэша (0 - кэш выключен)
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '30'))
+
+# Максимум пользователей в кэше; при переполнении вытесняются давно не запрошенные
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+
+_entries = OrderedDict()
+_username_by_id = {}
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+def get(username):
+    """Пользователь из кэша или None, если записи нет или она устарела"""
+    with _lock:
+        entry = _entries.get(username)
+        if entry is None or entry[1] < time.monotonic():
+            _stats['misses'] += 1
+            return None
+        _entries.move_to_end(username)
+        _stats['hits'] += 1
+        return entry[0]
+
+def put(username, principal):
+    if AUTH_CACHE_TTL <= 0:
+        return
+    with _lock:
+        _entries[username] = (principal, time.monotonic() + AUTH_CACHE_TTL)
+        _entries.move_to_end(username)
+        _username_by_id[principal.id] = username
+        while len(_entries) > AUTH_CACHE_SIZE:
+            evicted, (evicted_principal, _) = _entries.popitem(last=False)
+            _username_by_id.pop(evicted_principal.id, None)
+
+def invalidate(username=None, user_id=None):
+    """Сброс записи пользователя по имени и/или id"""
+    with _lock:
+        if user_id is not None:
+            username = _username_by_id.pop(_normalize_id(user_id), None) or username
+        if username is not None:
+            entry = _entries.pop(username, None)
+            if entry:
+                _username_by_id.pop(entry[0].id, None)
+        _stats['invalidations'] += 1
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _username_by_id.clear()
+
+def _normalize_id(user_id):
+    # id приходит и из JSON запроса (бывает строкой), и из БД (int)
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return user_id
+
+def stats():
+    with _lock:
+        return {'size': len(_entries), 'ttl_seconds': AUTH_CACHE_TTL, **_stats}
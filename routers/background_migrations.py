@@ -0,0 +1,237 @@
+"""Фоновые миграции учётных записей: хеширование старых паролей и реферальные коды.
+
+Раньше startup() до приёма запросов хешировал каждый незахешированный пароль
+по одному и выдавал недостающие реферальные коды generate_referral_code(),
+который на каждый код открывал соединение и перебирал случайные коды
+запросами к БД. На большой таблице users сервер поднимался минутами.
+
+Теперь обе миграции - задача asyncio, запускаемая после старта: сервер сразу
+принимает запросы, а миграции идут пачками по BACKGROUND_MIGRATION_BATCH
+пользователей:
+
+    * пароли хешируются в отдельном пуле из BACKGROUND_HASH_WORKERS потоков
+      (bcrypt отпускает GIL) и записываются одним executemany; запись
+      условная (WHERE password = старое значение), поэтому пароль, сменённый
+      за это время, не перезаписывается;
+    * реферальные коды выбираются в памяти по множеству уже занятых кодов и
+      записываются одним executemany; при конфликте с кодом, выданным
+      параллельно (уникальный индекс), множество перечитывается и пачка
+      повторяется.
+
+Пока пароль не захеширован, вход с ним работает (passwords.verify_password
+сравнивает открытый пароль и пересчитывает хеш при входе). Ход миграций -
+status() и GET /api/admin/game/background-migrations.
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import string
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from routers import database, passwords
+
+# Пользователей в одной пачке
+BACKGROUND_MIGRATION_BATCH = int(os.getenv('BACKGROUND_MIGRATION_BATCH', '200'))
+
+# Потоков для bcrypt миграции; остальные ядра остаются входам пользователей
+BACKGROUND_HASH_WORKERS = int(os.getenv('BACKGROUND_HASH_WORKERS', str(max(1, (os.cpu_count() or 1) // 2))))
+
+# Попыток записать пачку кодов при конфликтах с параллельно выданными
+REFERRAL_BATCH_ATTEMPTS = 5
+
+REFERRAL_CODE_LENGTH = 4
+
+# Условие "пароль ещё не захеширован" для SQL (см. passwords.BCRYPT_PREFIXES)
+PLAIN_PASSWORD_SQL = ' AND '.join(f"password NOT LIKE '{prefix}%'" for prefix in passwords.BCRYPT_PREFIXES)
+
+_task = None
+_state = {}
+
+def _reset_state():
+    for name in ('passwords', 'referral_codes'):
+        _state[name] = {'status': 'pending', 'total': None, 'done': 0,
+                        'started_at': None, 'finished_at': None, 'seconds': None, 'error': None}
+
+_reset_state()
+
+def _accounts_db():
+    # users - в users.db, то есть в файле мира по умолчанию
+    with database.use_world(database.DEFAULT_WORLD):
+        return database.get_db()
+
+def count_plain_passwords():
+    conn = _accounts_db()
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM users WHERE {PLAIN_PASSWORD_SQL}').fetchone()[0]
+    finally:
+        conn.close()
+
+def plain_passwords_batch(after_id):
+    conn = _accounts_db()
+    try:
+        return conn.execute(
+            f'SELECT id, password FROM users WHERE id > ? AND {PLAIN_PASSWORD_SQL} ORDER BY id LIMIT ?',
+            (after_id, BACKGROUND_MIGRATION_BATCH)
+        ).fetchall()
+    finally:
+        conn.close()
+
+def save_password_hashes(updates):
+    """updates: [(хеш, id, старый пароль)]; возвращает число записанных"""
+    conn = _accounts_db()
+    try:
+        before = conn.total_changes
+        conn.executemany('UPDATE users SET password = ? WHERE id = ? AND password = ?', updates)
+        conn.commit()
+        return conn.total_changes - before
+    finally:
+        conn.close()
+
+async def migrate_plain_passwords():
+    """Хеширование незахешированных паролей пачками"""
+    state = _state['passwords']
+    state['total'] = await database.run(count_plain_passwords)
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=BACKGROUND_HASH_WORKERS, thread_name_prefix='bcrypt-migration')
+    try:
+        after_id = 0
+        while True:
+            rows = await database.run(plain_passwords_batch, after_id)
+            if not rows:
+                break
+            hashes = await asyncio.gather(*(
+                loop.run_in_executor(pool, passwords.hash_password, password) for _, password in rows
+            ))
+            updates = [(hashed, user_id, password) for (user_id, password), hashed in zip(rows, hashes)]
+            await database.run(save_password_hashes, updates)
+            state['done'] += len(rows)
+            after_id = rows[-1][0]
+    finally:
+        # При остановке не ждём хеширования оставшейся пачки
+        pool.shutdown(wait=False, cancel_futures=True)
+    if state['total']:
+        print(f"Захешировано паролей: {state['done']}")
+
+def random_referral_code():
+    return ''.join(random.choices(string.ascii_uppercase, k=REFERRAL_CODE_LENGTH))
+
+def allocate_referral_codes(taken, count):
+    """count новых кодов, которых нет в taken (taken дополняется)"""
+    codes = []
+    while len(codes) < count:
+        code = random_referral_code()
+        if code not in taken:
+            taken.add(code)
+            codes.append(code)
+    return codes
+
+def assign_referral_codes_batch(taken):
+    """Коды для очередной пачки пользователей без кода; возвращает число обработанных"""
+    conn = _accounts_db()
+    try:
+        user_ids = [row[0] for row in conn.execute(
+            'SELECT id FROM users WHERE referral_code IS NULL ORDER BY id LIMIT ?',
+            (BACKGROUND_MIGRATION_BATCH,)
+        )]
+        if not user_ids:
+            return 0
+        for attempt in range(REFERRAL_BATCH_ATTEMPTS):
+            codes = allocate_referral_codes(taken, len(user_ids))
+            try:
+                conn.executemany('UPDATE users SET referral_code = ? WHERE id = ? AND referral_code IS NULL',
+                                 zip(codes, user_ids))
+                conn.commit()
+                return len(user_ids)
+            except sqlite3.IntegrityError:
+                # Код успел выдать другой процесс или регистрация - перечитываем занятые
+                conn.rollback()
+                taken.clear()
+                taken.update(load_referral_codes(conn))
+        raise RuntimeError('Не удалось подобрать свободные реферальные коды')
+    finally:
+        conn.close()
+
+def load_referral_codes(conn=None):
+    own = conn is None
+    conn = conn or _accounts_db()
+    try:
+        return {row[0] for row in conn.execute('SELECT referral_code FROM users WHERE referral_code IS NOT NULL')}
+    finally:
+        if own:
+            conn.close()
+
+def count_missing_referral_codes():
+    conn = _accounts_db()
+    try:
+        return conn.execute('SELECT COUNT(*) FROM users WHERE referral_code IS NULL').fetchone()[0]
+    finally:
+        conn.close()
+
+async def generate_missing_referral_codes():
+    """Реферальные коды для пользователей без кода, пачками"""
+    state = _state['referral_codes']
+    state['total'] = await database.run(count_missing_referral_codes)
+    if not state['total']:
+        return
+    taken = await database.run(load_referral_codes)
+    while True:
+        assigned = await database.run(assign_referral_codes_batch, taken)
+        if not assigned:
+            break
+        state['done'] += assigned
+    print(f"Сгенерировано реферальных кодов: {state['done']}")
+
+async def _run_step(name, step):
+    state = _state[name]
+    state['status'] = 'running'
+    state['started_at'] = datetime.now().isoformat()
+    started = time.monotonic()
+    try:
+        await step()
+        state['status'] = 'completed'
+    except asyncio.CancelledError:
+        state['status'] = 'cancelled'
+        raise
+    except Exception as e:
+        state['status'] = 'failed'
+        state['error'] = str(e)
+        print(f"Error in background migration {name}: {e}")
+    finally:
+        state['finished_at'] = datetime.now().isoformat()
+        state['seconds'] = round(time.monotonic() - started, 2)
+
+async def run_all():
+    # Шаги меняют разные столбцы users и идут одновременно
+    await asyncio.gather(
+        _run_step('passwords', migrate_plain_passwords),
+        _run_step('referral_codes', generate_missing_referral_codes)
+    )
+
+def status():
+    """Ход фоновых миграций; completed - все шаги завершены успешно"""
+    return {
+        'completed': all(step['status'] == 'completed' for step in _state.values()),
+        **{name: dict(step) for name, step in _state.items()}
+    }
+
+def start():
+    """Запуск миграций в текущем event loop (вызывается при старте приложения)"""
+    global _task
+    if _task is not None and not _task.done():
+        return
+    _reset_state()
+    _task = asyncio.get_running_loop().create_task(run_all())
+
+async def stop():
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
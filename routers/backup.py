@@ -0,0 +1,587 @@
+"""Горячие резервные копии users.db, файлов миров и архивов и восстановление из них.
+
+Копия снимается online backup API SQLite небольшими шагами по
+BACKUP_PAGES_PER_STEP страниц, пока приложение работает. Исходное соединение
+держит одну читающую транзакцию на всё время копирования: в режиме WAL она не
+мешает писателям, а копия получается согласованной на момент начала и не
+перезапускается из-за записей других соединений (без транзакции каждая запись
+в БД начинает backup заново, и под нагрузкой он может не закончиться никогда).
+
+В одну копию (набор) входят users.db (учётные таблицы и мир по умолчанию),
+файлы остальных миров WORLDS_DIR/<мир>.db, их архивы WORLDS_DIR/<мир>.archive.db
+и архив мира по умолчанию (archive.ARCHIVE_DB_FILE). Каждый файл копируется так
+же, проверяется PRAGMA integrity_check и сжимается gzip: users.db - в
+users_<время>_<суффикс>.db.gz, остальные - рядом, в
+users_<время>_<суффикс>+<ключ>.db.gz (ключи: archive, world+<мир>,
+world+<мир>+archive). Общий манифест .sha256 в формате sha256sum перечисляет
+все файлы набора. Основной архив появляется последним, когда набор уже
+записан целиком. Хранятся последние BACKUP_RETENTION наборов.
+
+Расписание запускается в каждом процессе uvicorn, поэтому снятие копии
+занимает блокировку файла BACKUP_DIR/.backup.lock (flock): пока копию снимает
+один процесс, остальные пропускают запуск, а получив блокировку, заново
+проверяют, не снята ли уже копия. Временные файлы и имя архива создаются
+через tempfile.mkstemp и не совпадают даже у копий, снятых в одну секунду.
+
+Пока идёт копирование, отдельное соединение раз в BACKUP_PROBE_INTERVAL_MS
+берёт и сразу отпускает блокировку записи (BEGIN IMMEDIATE / ROLLBACK): самое
+долгое ожидание попадает в отчёт как longest_writer_stall_ms.
+
+Копии снимаются по расписанию (BACKUP_INTERVAL_HOURS, 0 - только вручную),
+из админки (POST /api/admin/game/backups) или из командной строки:
+    python -m routers.backup create
+    python -m routers.backup list
+    python -m routers.backup verify backups/users_20260101_120000.db.gz
+    python -m routers.backup restore backups/users_20260101_120000.db.gz
+
+Восстановление выполняется при остановленном приложении: проверяются
+контрольные суммы всего набора, каждая распакованная копия проходит
+integrity_check и только после этого файлы заменяются (прежние сохраняются
+рядом). С --target восстанавливается только users.db в указанный файл.
+"""
+import argparse
+import asyncio
+import contextlib
+import fcntl
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from routers import archive, database
+
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+
+# Страниц за один шаг backup
+BACKUP_PAGES_PER_STEP = int(os.getenv('BACKUP_PAGES_PER_STEP', '256'))
+
+# Пауза между шагами, мс: отдаёт диск и GIL обработчикам запросов
+BACKUP_STEP_PAUSE_MS = float(os.getenv('BACKUP_STEP_PAUSE_MS', '1'))
+
+# Сколько последних копий хранить (0 - не удалять)
+BACKUP_RETENTION = int(os.getenv('BACKUP_RETENTION', '7'))
+
+# Интервал копий по расписанию, часов (0 - расписание в этом процессе выключено)
+BACKUP_INTERVAL_HOURS = float(os.getenv('BACKUP_INTERVAL_HOURS', '24'))
+
+# Как часто замерять ожидание блокировки записи во время копирования
+BACKUP_PROBE_INTERVAL_MS = float(os.getenv('BACKUP_PROBE_INTERVAL_MS', '20'))
+
+# Как часто планировщик проверяет, не пора ли снять копию
+BACKUP_POLL_SECONDS = 60
+
+CHUNK_SIZE = 1024 * 1024
+
+_BACKUP_NAME = re.compile(r'^users_(\d{8}_\d{6})(?:_\w+)?\.db\.gz$')
+
+# Ключ файла набора: archive, world+<мир> или world+<мир>+archive
+_MEMBER_KEY = re.compile(r'^(archive|world\+[a-z0-9_-]+(?:\+archive)?)$')
+
+MAIN_SUFFIX = '.db.gz'
+
+LOCK_FILE = '.backup.lock'
+
+_backup_lock = threading.Lock()
+_backup_task = None
+_state = {'last_backup': None, 'last_error': None}
+
+class BackupInProgress(RuntimeError):
+    """Копию уже снимает другой процесс"""
+
+@contextlib.contextmanager
+def _claim_run():
+    """Блокировка запуска между потоками и процессами (flock на BACKUP_DIR/.backup.lock)"""
+    with _backup_lock:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        fd = os.open(os.path.join(BACKUP_DIR, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise BackupInProgress('Резервную копию уже снимает другой процесс') from None
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+def _temp_path(prefix, suffix):
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=suffix, dir=BACKUP_DIR)
+    os.close(fd)
+    return path
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _checksum_path(path):
+    return path + '.sha256'
+
+def _write_manifest(path, members):
+    """Манифест набора: основной архив и файлы members; возвращает sha256 основного"""
+    checksum = _sha256_file(path)
+    with open(_checksum_path(path), 'w', encoding='utf-8') as f:
+        f.write(f'{checksum}  {os.path.basename(path)}\n')
+        for member in members:
+            f.write(f'{_sha256_file(member)}  {os.path.basename(member)}\n')
+    return checksum
+
+def _read_manifest(path):
+    """[(sha256, имя файла)] из манифеста набора"""
+    with open(_checksum_path(path), 'r', encoding='utf-8') as f:
+        return [tuple(line.split(None, 1)) for line in f.read().splitlines() if line.strip()]
+
+def _member_path(path, key):
+    return path[:-len(MAIN_SUFFIX)] + f'+{key}' + MAIN_SUFFIX
+
+def _member_key(path, name):
+    """Ключ файла набора по его имени (None для основного архива)"""
+    prefix = os.path.basename(path)[:-len(MAIN_SUFFIX)] + '+'
+    if name == os.path.basename(path):
+        return None
+    if not name.startswith(prefix) or not name.endswith(MAIN_SUFFIX):
+        raise RuntimeError(f'Файл {name} не относится к копии {os.path.basename(path)}')
+    key = name[len(prefix):-len(MAIN_SUFFIX)]
+    if not _MEMBER_KEY.match(key):
+        raise RuntimeError(f'Неизвестный файл в копии: {name}')
+    return key
+
+def _member_sources():
+    """Файлы БД, которые копируются вместе с users.db: [(ключ, путь)]"""
+    sources = []
+    if os.path.exists(archive.ARCHIVE_DB_FILE):
+        sources.append(('archive', archive.ARCHIVE_DB_FILE))
+    if os.path.isdir(database.WORLDS_DIR):
+        for name in sorted(os.listdir(database.WORLDS_DIR)):
+            if name.endswith('.archive.db'):
+                world_id, suffix = name[:-len('.archive.db')], '+archive'
+            elif name.endswith('.db'):
+                world_id, suffix = name[:-len('.db')], ''
+            else:
+                continue
+            # Мир по умолчанию хранится в users.db и его архиве, а не в WORLDS_DIR
+            key = f'world+{world_id}{suffix}'
+            if world_id != database.DEFAULT_WORLD and _MEMBER_KEY.match(key):
+                sources.append((key, os.path.join(database.WORLDS_DIR, name)))
+    return sources
+
+def _member_target(key):
+    """Куда восстанавливается файл набора с ключом key"""
+    if key == 'archive':
+        return archive.ARCHIVE_DB_FILE
+    _, world_id, *rest = key.split('+')
+    return archive.archive_file(world_id) if rest else database.world_file(world_id)
+
+def verify_checksum(path):
+    """Сверка архива и остальных файлов набора с манифестом .sha256
+
+    Returns:
+        (True, None) или (False, текст ошибки)
+    """
+    checksum_file = _checksum_path(path)
+    if not os.path.exists(checksum_file):
+        return False, f'Нет файла контрольной суммы {checksum_file}'
+    directory = os.path.dirname(path)
+    for expected, name in _read_manifest(path):
+        member = os.path.join(directory, name)
+        if not os.path.exists(member):
+            return False, f'Нет файла {name} из набора'
+        if _sha256_file(member) != expected:
+            return False, f'Контрольная сумма {name} не совпадает: архив повреждён'
+    return True, None
+
+def integrity_check(db_path):
+    """PRAGMA integrity_check; возвращает список ошибок (пустой - файл цел)"""
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute('PRAGMA integrity_check').fetchall()
+    finally:
+        conn.close()
+    return [row[0] for row in rows if row[0] != 'ok']
+
+class WriterProbe(threading.Thread):
+    """Замер ожидания блокировки записи, пока идёт копирование"""
+
+    def __init__(self):
+        super().__init__(name='backup-probe', daemon=True)
+        self.longest_stall = 0.0
+        self.probes = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        conn = database.open_connection(database.DEFAULT_WORLD)
+        conn.isolation_level = None
+        try:
+            while not self._stop_event.wait(BACKUP_PROBE_INTERVAL_MS / 1000):
+                started = time.monotonic()
+                try:
+                    conn.execute('BEGIN IMMEDIATE')
+                    conn.execute('ROLLBACK')
+                except sqlite3.OperationalError:
+                    # Блокировка не получена за busy timeout - это тоже ожидание
+                    pass
+                self.longest_stall = max(self.longest_stall, time.monotonic() - started)
+                self.probes += 1
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def _copy_database(target_path, source_path=None):
+    """Постраничная копия users.db (или файла source_path) в target_path; возвращает (шагов, страниц)"""
+    if source_path is None:
+        source = database.open_connection(database.DEFAULT_WORLD)
+    else:
+        source = sqlite3.connect(source_path, timeout=database.DB_BUSY_TIMEOUT)
+    source.isolation_level = None
+    target = sqlite3.connect(target_path)
+    steps = 0
+    pause = BACKUP_STEP_PAUSE_MS / 1000
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        if remaining and pause:
+            time.sleep(pause)
+
+    try:
+        # Читающая транзакция фиксирует снимок, который увидит backup
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        page_count = source.execute('PRAGMA page_count').fetchone()[0]
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+        source.execute('COMMIT')
+    finally:
+        target.close()
+        source.close()
+    return steps, page_count
+
+def _copy_verified(target_gz, source_path=None):
+    """Копия, integrity_check и gzip в target_gz; возвращает (шагов, страниц, размер БД)"""
+    raw_path = _temp_path('.copy_', '.db.tmp')
+    try:
+        steps, page_count = _copy_database(raw_path, source_path)
+        errors = integrity_check(raw_path)
+        if errors:
+            name = source_path or database.DB_FILE
+            raise RuntimeError(f'Копия {name} не прошла integrity_check: {"; ".join(errors[:5])}')
+        _compress(raw_path, target_gz)
+        return steps, page_count, os.path.getsize(raw_path)
+    finally:
+        os.remove(raw_path)
+
+def _compress(src_path, dst_path):
+    with open(src_path, 'rb') as src, gzip.open(dst_path, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+def create_backup(only_if_due=False):
+    """Горячая копия users.db, файлов миров и архивов: backup, integrity_check, gzip, sha256
+
+    Args:
+        only_if_due: снять копию, только если по расписанию пора (проверяется
+            под блокировкой, чтобы копию не сняли два процесса подряд)
+
+    Returns:
+        dict: отчёт (файл, размеры, пропускная способность, самое долгое ожидание писателя)
+        или None, если only_if_due и копия ещё не нужна
+    """
+    with _claim_run():
+        if only_if_due and seconds_until_next_backup() > 0:
+            return None
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        # Имя набора берётся у временного файла mkstemp и не совпадёт с копией той же секунды
+        gz_tmp_path = _temp_path(f'.users_{stamp}_', MAIN_SUFFIX + '.tmp')
+        path = os.path.join(BACKUP_DIR, os.path.basename(gz_tmp_path)[1:-len('.tmp')])
+        written = []
+
+        probe = WriterProbe()
+        started = time.monotonic()
+        try:
+            probe.start()
+            try:
+                steps, page_count, raw_size = _copy_verified(gz_tmp_path)
+            finally:
+                probe.stop()
+            copy_seconds = time.monotonic() - started
+
+            members = []
+            for key, source_path in _member_sources():
+                member_path = _member_path(path, key)
+                written.append(member_path)
+                _, _, member_size = _copy_verified(member_path, source_path)
+                members.append({
+                    'file': os.path.basename(member_path),
+                    'source': source_path,
+                    'db_size_bytes': member_size,
+                    'compressed_size_bytes': os.path.getsize(member_path)
+                })
+
+            # Манифест и основной архив - последними: набор виден, только когда записан целиком
+            os.replace(gz_tmp_path, path)
+            written.append(path)
+            checksum = _write_manifest(path, written[:-1])
+        except BaseException:
+            for leftover in written + [gz_tmp_path, _checksum_path(path)]:
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            raise
+
+        total_seconds = time.monotonic() - started
+        compressed_size = os.path.getsize(path)
+        report = {
+            'file': os.path.basename(path),
+            'sha256': checksum,
+            'created_at': datetime.now().isoformat(),
+            'pages': page_count,
+            'steps': steps,
+            'db_size_bytes': raw_size,
+            'compressed_size_bytes': compressed_size,
+            'compression_ratio': round(compressed_size / raw_size, 4) if raw_size else 0,
+            'copy_seconds': round(copy_seconds, 3),
+            'total_seconds': round(total_seconds, 3),
+            'throughput_mib_s': round(raw_size / (1024 * 1024) / copy_seconds, 2) if copy_seconds else 0,
+            'longest_writer_stall_ms': round(probe.longest_stall * 1000, 1),
+            'writer_probes': probe.probes,
+            'members': members
+        }
+        _state['last_backup'] = report
+        prune_backups()
+        return report
+
+def list_backups():
+    """Список копий, от новых к старым"""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    backups = []
+    for name in sorted(os.listdir(BACKUP_DIR), reverse=True):
+        match = _BACKUP_NAME.match(name)
+        if not match:
+            continue
+        path = os.path.join(BACKUP_DIR, name)
+        members = _member_files(path)
+        backups.append({
+            'file': name,
+            'size_bytes': os.path.getsize(path) + sum(os.path.getsize(member) for member in members),
+            'members': len(members),
+            'created_at': datetime.strptime(match.group(1), '%Y%m%d_%H%M%S').isoformat(),
+            'has_checksum': os.path.exists(_checksum_path(path))
+        })
+    return backups
+
+def _member_files(path):
+    """Файлы набора, кроме основного архива"""
+    prefix = os.path.basename(path)[:-len(MAIN_SUFFIX)] + '+'
+    directory = os.path.dirname(path)
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.startswith(prefix) and name.endswith(MAIN_SUFFIX)]
+
+def prune_backups():
+    """Удаление наборов сверх BACKUP_RETENTION последних"""
+    if not BACKUP_RETENTION:
+        return
+    for backup in list_backups()[BACKUP_RETENTION:]:
+        path = os.path.join(BACKUP_DIR, backup['file'])
+        for member in _member_files(path):
+            os.remove(member)
+        os.remove(path)
+        if os.path.exists(_checksum_path(path)):
+            os.remove(_checksum_path(path))
+
+def _unpack_verified(path, dst_path):
+    """Распаковка файла набора и integrity_check; возвращает текст ошибки или None"""
+    with gzip.open(path, 'rb') as src, open(dst_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    errors = integrity_check(dst_path)
+    if errors:
+        return f'Копия {os.path.basename(path)} не прошла integrity_check: {"; ".join(errors[:5])}'
+    return None
+
+def _set_files(path):
+    """Файлы набора из манифеста: [(путь, ключ)], ключ None - users.db"""
+    directory = os.path.dirname(path)
+    return [(os.path.join(directory, name), _member_key(path, name)) for _, name in _read_manifest(path)]
+
+def verify_backup(path):
+    """Полная проверка набора без восстановления; возвращает текст ошибки или None"""
+    ok, error = verify_checksum(path)
+    if not ok:
+        return error
+    for member, _ in _set_files(path):
+        tmp_path = member + '.verify.tmp'
+        try:
+            error = _unpack_verified(member, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if error:
+            return error
+    return None
+
+def restore_backup(path, target=None):
+    """Восстановление из набора (приложение должно быть остановлено)
+
+    Без target восстанавливаются users.db, файлы миров и архивы; с target -
+    только users.db в файл target.
+
+    Returns:
+        [(файл БД, куда сохранён прежний файл или None)]
+    """
+    ok, error = verify_checksum(path)
+    if not ok:
+        raise RuntimeError(error)
+
+    targets = []
+    for member, key in _set_files(path):
+        if key is None:
+            targets.append((member, target or database.DB_FILE))
+        elif target is None:
+            targets.append((member, _member_target(key)))
+
+    # Сначала распаковываются и проверяются все файлы, затем заменяются
+    unpacked = []
+    try:
+        for member, db_file in targets:
+            os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+            tmp_path = db_file + '.restore.tmp'
+            unpacked.append(tmp_path)
+            error = _unpack_verified(member, tmp_path)
+            if error:
+                raise RuntimeError(error)
+
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        restored = []
+        for (_, db_file), tmp_path in zip(targets, unpacked):
+            restored.append((db_file, _replace_database(db_file, tmp_path, stamp)))
+    finally:
+        for tmp_path in unpacked:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    for db_file, _ in restored:
+        errors = integrity_check(db_file)
+        if errors:
+            raise RuntimeError(f'Восстановленная БД {db_file} не прошла integrity_check: {"; ".join(errors[:5])}')
+    return restored
+
+def _replace_database(target, tmp_path, stamp):
+    """Замена файла БД распакованной копией; возвращает путь прежнего файла или None"""
+    previous = None
+    if os.path.exists(target):
+        previous = f'{target}.before-restore-{stamp}'
+        # Последние транзакции могли остаться в WAL - переносим их в файл перед заменой
+        conn = sqlite3.connect(target)
+        try:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            conn.close()
+        os.replace(target, previous)
+    # Журнал старой БД нельзя применять к восстановленной
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    os.replace(tmp_path, target)
+    return previous
+
+def seconds_until_next_backup(now=None):
+    """Сколько ждать до копии по расписанию (отсчёт от последней копии на диске)"""
+    backups = list_backups()
+    if not backups:
+        return 0
+    last = datetime.fromisoformat(backups[0]['created_at'])
+    elapsed = ((now or datetime.now()) - last).total_seconds()
+    return max(0.0, BACKUP_INTERVAL_HOURS * 3600 - elapsed)
+
+async def run_scheduler():
+    """Копии по расписанию; копирование выполняется в пуле потоков БД"""
+    while True:
+        try:
+            if await database.run(seconds_until_next_backup) <= 0:
+                report = await database.run(create_backup, True)
+                if report:
+                    print(f"Резервная копия {report['file']}: {report['throughput_mib_s']} МиБ/с, "
+                          f"ожидание писателя до {report['longest_writer_stall_ms']} мс")
+        except BackupInProgress:
+            # Копию снимает другой процесс uvicorn
+            pass
+        except Exception as e:
+            _state['last_error'] = {'at': datetime.now().isoformat(), 'error': str(e)}
+            print(f"Error creating backup: {e}")
+        await asyncio.sleep(BACKUP_POLL_SECONDS)
+
+def status():
+    return {
+        'interval_hours': BACKUP_INTERVAL_HOURS,
+        'retention': BACKUP_RETENTION,
+        **_state,
+        'backups': list_backups()
+    }
+
+def start():
+    """Запуск расписания в текущем event loop (вызывается при старте приложения)"""
+    global _backup_task
+    if not BACKUP_INTERVAL_HOURS or _backup_task is not None:
+        return
+    _backup_task = asyncio.get_running_loop().create_task(run_scheduler())
+
+async def stop():
+    global _backup_task
+    if _backup_task is None:
+        return
+    _backup_task.cancel()
+    try:
+        await _backup_task
+    except asyncio.CancelledError:
+        pass
+    _backup_task = None
+
+def main():
+    parser = argparse.ArgumentParser(description='Резервные копии users.db, файлов миров и архивов')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('create', help='Снять копию')
+    commands.add_parser('list', help='Список копий')
+    verify_parser = commands.add_parser('verify', help='Проверить копию (sha256 и integrity_check)')
+    verify_parser.add_argument('file')
+    restore_parser = commands.add_parser('restore', help='Восстановить БД из копии (приложение остановлено)')
+    restore_parser.add_argument('file')
+    restore_parser.add_argument('--target', help='Восстановить только users.db в этот файл')
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        report = create_backup()
+        for key, value in report.items():
+            print(f'{key:<24} {value}')
+    elif args.command == 'list':
+        for backup in list_backups():
+            mark = '' if backup['has_checksum'] else '  (нет .sha256)'
+            print(f"{backup['file']}  {backup['size_bytes']:>12}  {backup['created_at']}  файлов: {backup['members'] + 1}{mark}")
+    elif args.command == 'verify':
+        error = verify_backup(args.file)
+        if error:
+            print(error)
+            raise SystemExit(1)
+        print('Копия цела: контрольная сумма и integrity_check в порядке')
+    elif args.command == 'restore':
+        try:
+            restored = restore_backup(args.file, args.target)
+        except RuntimeError as e:
+            print(e)
+            raise SystemExit(1)
+        for db_file, previous in restored:
+            print(f'БД {db_file} восстановлена из {args.file}, integrity_check: ok')
+            if previous:
+                print(f'Прежний файл сохранён как {previous}')
+
+if __name__ == '__main__':
+    main()
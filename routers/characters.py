@@ -1,25 +1,21 @@
-from fastapi import APIRouter, Request, HTTPException
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional, List
 import sqlite3
-import sys
 from datetime import datetime
 
-router = APIRouter(prefix="/api/characters")
+from routers import auth, database
 
-DB_FILE = 'users.db'
+router = APIRouter(prefix="/api/characters")
 
 def get_db():
-    conn = sqlite3.connect(DB_FILE)
+    conn = database.connect()
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_characters_db():
-    """Инициализация таблицы персонажей"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
+def init_characters_db(cursor):
+    """Инициализация таблицы персонажей (миграция, см. routers/migrations.py)"""
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS characters (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -49,17 +45,11 @@ def init_characters_db():
     columns = [column[1] for column in cursor.fetchall()]
     
     if 'skill_points' not in columns:
-        try:
-            cursor.execute('ALTER TABLE characters ADD COLUMN skill_points INTEGER DEFAULT 0')
-            conn.commit()
-            print("Added skill_points column to characters table")
-        except Exception as e:
-            print(f"Error adding skill_points column: {e}")
+        cursor.execute('ALTER TABLE characters ADD COLUMN skill_points INTEGER DEFAULT 0')
+        print("Added skill_points column to characters table")
     
-    conn.commit()
-    conn.close()
-
-init_characters_db()
+    # Персонаж игрока ищется по user_id при каждом открытии профиля
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_characters_user_id ON characters(user_id)')
 
 class CharacterData(BaseModel):
     first_name: str
@@ -84,22 +74,7 @@ def calculate_birth_year(age: int) -> int:
     game_start_year = 1516
     return game_start_year - age
 
-@router.get("/admin/all")
-async def get_all_characters(request: Request):
-    """Получение всех персонажей (только для админов)"""
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
-    if user.get('role') != 'admin':
-        raise HTTPException(status_code=403, detail="Access denied")
-    
+def _get_all_characters():
     conn = get_db()
     cursor = conn.cursor()
     
@@ -133,22 +108,12 @@ async def get_all_characters(request: Request):
     finally:
         conn.close()
 
-@router.post("/admin/add")
-async def add_character(data: CharacterData, request: Request):
-    """Добавление нового персонажа (только для админов)"""
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
-    if user.get('role') != 'admin':
-        raise HTTPException(status_code=403, detail="Access denied")
-    
+@router.get("/admin/all")
+async def get_all_characters(user=Depends(auth.require_admin)):
+    """Получение всех персонажей (только для админов)"""
+    return await database.run(_get_all_characters)
+
+def _add_character(data):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -200,25 +165,12 @@ async def add_character(data: CharacterData, request: Request):
     finally:
         conn.close()
 
-@router.post("/admin/update")
-async def update_character(request: Request):
-    """Обновление персонажа (только для админов)"""
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
-    if user.get('role') != 'admin':
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    data = await request.json()
-    character_id = data.get('id')
-    
+@router.post("/admin/add")
+async def add_character(data: CharacterData, user=Depends(auth.require_admin)):
+    """Добавление нового персонажа (только для админов)"""
+    return await database.run(_add_character, data)
+
+def _update_character(data, character_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -282,25 +234,15 @@ async def update_character(request: Request):
     finally:
         conn.close()
 
-@router.post("/admin/delete")
-async def delete_character(request: Request):
-    """Удаление персонажа (только для админов)"""
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
-    if user.get('role') != 'admin':
-        raise HTTPException(status_code=403, detail="Access denied")
-    
+@router.post("/admin/update")
+async def update_character(request: Request, user=Depends(auth.require_admin)):
+    """Обновление персонажа (только для админов)"""
     data = await request.json()
     character_id = data.get('id')
     
+    return await database.run(_update_character, data, character_id)
+
+def _delete_character(character_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -322,19 +264,15 @@ async def delete_character(request: Request):
     finally:
         conn.close()
 
-@router.get("/my")
-async def get_my_character(request: Request):
-    """Получение персонажа текущего игрока"""
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
+@router.post("/admin/delete")
+async def delete_character(request: Request, user=Depends(auth.require_admin)):
+    """Удаление персонажа (только для админов)"""
+    data = await request.json()
+    character_id = data.get('id')
     
+    return await database.run(_delete_character, character_id)
+
+def _get_my_character(user):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -374,29 +312,12 @@ async def get_my_character(request: Request):
     finally:
         conn.close()
 
-@router.post("/upgrade-skill")
-async def upgrade_skill(request: Request):
-    """Прокачка навыка персонажа"""
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
-    data = await request.json()
-    skill = data.get('skill')
-    
-    valid_skills = ['military', 'administration', 'diplomacy', 'intrigue', 'knowledge']
-    if skill not in valid_skills:
-        return JSONResponse({
-            "success": False,
-            "error": "Неверный навык"
-        }, status_code=400)
-    
+@router.get("/my")
+async def get_my_character(user=Depends(auth.require_user)):
+    """Получение персонажа текущего игрока"""
+    return await database.run(_get_my_character, user)
+
+def _upgrade_skill(user, skill):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -456,27 +377,24 @@ async def upgrade_skill(request: Request):
         }, status_code=500)
     finally:
         conn.close()
-        
-@router.get("/admin/{character_id}")
-async def get_character_by_id(character_id: int, request: Request):
-    """Получить персонажа по ID (только для админов)"""
-    sys.path.append('..')
-    from main import get_current_user
+
+@router.post("/upgrade-skill")
+async def upgrade_skill(request: Request, user=Depends(auth.require_user)):
+    """Прокачка навыка персонажа"""
+    data = await request.json()
+    skill = data.get('skill')
     
-    try:
-        user = await get_current_user(request)
-        if not user:
-            return JSONResponse({
-                "success": False,
-                "error": "Не авторизован"
-            }, status_code=401)
-        
-        if user.get('role') != 'admin':
-            return JSONResponse({
-                "success": False,
-                "error": "Доступ запрещен"
-            }, status_code=403)
+    valid_skills = ['military', 'administration', 'diplomacy', 'intrigue', 'knowledge']
+    if skill not in valid_skills:
+        return JSONResponse({
+            "success": False,
+            "error": "Неверный навык"
+        }, status_code=400)
+    
+    return await database.run(_upgrade_skill, user, skill)
         
+def _get_character_by_id(character_id):
+    try:
         conn = get_db()
         cursor = conn.cursor()
         
@@ -513,44 +431,14 @@ async def get_character_by_id(character_id: int, request: Request):
     finally:
         conn.close()
 
-@router.post("/admin/upgrade-skill")
-async def admin_upgrade_skill(request: Request):
-    """Прокачка навыка персонажа админом"""
-    sys.path.append('..')
-    from main import get_current_user
-    
+@router.get("/admin/{character_id}")
+async def get_character_by_id(character_id: int, user=Depends(auth.require_admin)):
+    """Получить персонажа по ID (только для админов)"""
+    return await database.run(_get_character_by_id, character_id)
+
+def _admin_upgrade_skill(character_id, skill):
     conn = get_db()
     try:
-        user = await get_current_user(request)
-        if not user:
-            return JSONResponse({
-                "success": False,
-                "error": "Не авторизован"
-            }, status_code=401)
-        
-        if user.get('role') != 'admin':
-            return JSONResponse({
-                "success": False,
-                "error": "Доступ запрещен"
-            }, status_code=403)
-        
-        body = await request.json()
-        skill = body.get('skill')
-        character_id = body.get('character_id')
-        
-        if not skill or not character_id:
-            return JSONResponse({
-                "success": False,
-                "error": "Не указан навык или ID персонажа"
-            }, status_code=400)
-        
-        valid_skills = ['military', 'administration', 'diplomacy', 'intrigue', 'knowledge']
-        if skill not in valid_skills:
-            return JSONResponse({
-                "success": False,
-                "error": "Неверный навык"
-            }, status_code=400)
-        
         cursor = conn.cursor()
         
         cursor.execute('SELECT * FROM characters WHERE id = ?', (character_id,))
@@ -612,4 +500,26 @@ async def admin_upgrade_skill(request: Request):
             "error": str(e)
         }, status_code=500)
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+@router.post("/admin/upgrade-skill")
+async def admin_upgrade_skill(request: Request, user=Depends(auth.require_admin)):
+    """Прокачка навыка персонажа админом"""
+    body = await request.json()
+    skill = body.get('skill')
+    character_id = body.get('character_id')
+    
+    if not skill or not character_id:
+        return JSONResponse({
+            "success": False,
+            "error": "Не указан навык или ID персонажа"
+        }, status_code=400)
+    
+    valid_skills = ['military', 'administration', 'diplomacy', 'intrigue', 'knowledge']
+    if skill not in valid_skills:
+        return JSONResponse({
+            "success": False,
+            "error": "Неверный навык"
+        }, status_code=400)
+    
+    return await database.run(_admin_upgrade_skill, character_id, skill)
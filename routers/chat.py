@@ -1,35 +1,15 @@
 from fastapi import APIRouter, Request, UploadFile, File, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
-import sqlite3
 import uuid
 import os
 from datetime import datetime
 
+from routers import archive, auth, chat_writer, database
+
 router = APIRouter(prefix='/api/chat', tags=['chat'])
 
-DB_FILE = 'users.db'
 UPLOAD_DIR = 'uploads'
 
-def decode_jwt(token):
-    import jwt
-    JWT_SECRET = 'supersecretkey'
-    JWT_ALGORITHM = 'HS256'
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
-    except jwt.ExpiredSignatureError:
-        return None
-    except jwt.InvalidTokenError:
-        return None
-
-def get_user_by_username(username):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT username, password, email, country, role, banned, muted, ban_until, mute_until, avatar, id FROM users WHERE username=?', (username,))
-    user = c.fetchone()
-    conn.close()
-    return user
-
 class ConnectionManager:
     def __init__(self):
         self.active_connections: list[WebSocket] = []
@@ -71,16 +51,20 @@ manager = ConnectionManager()
 
 @router.get('/messages')
 async def get_chat_messages(before: int = None, limit: int = 50):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
     if before:
-        c.execute('SELECT id, username, role, text, timestamp FROM messages WHERE id < ? ORDER BY id DESC LIMIT ?', (before, limit))
+        rows = await database.fetch_all(
+            'SELECT id, username, role, text, timestamp FROM messages WHERE id < ? ORDER BY id DESC LIMIT ?',
+            (before, limit), row_factory=None
+        )
     else:
-        c.execute('SELECT id, username, role, text, timestamp FROM messages ORDER BY id DESC LIMIT ?', (limit,))
-    
-    rows = c.fetchall()
-    conn.close()
+        rows = await database.fetch_all(
+            'SELECT id, username, role, text, timestamp FROM messages ORDER BY id DESC LIMIT ?',
+            (limit,), row_factory=None
+        )
+    if len(rows) < limit:
+        # Более старые сообщения перенесены в архив (routers/archive.py)
+        oldest_id = rows[-1][0] if rows else before
+        rows += await database.run(archive.archived_messages, oldest_id, limit - len(rows))
     
     import json
     messages = []
@@ -122,16 +106,16 @@ async def get_chat_messages(before: int = None, limit: int = 50):
 async def send_chat_message(request: Request):
     data = await request.json()
     token = request.headers.get('Authorization')
-    payload = decode_jwt(token)
+    payload = auth.decode_jwt(token)
     if not payload:
         return JSONResponse({'success': False, 'error': 'Unauthorized'}, status_code=401)
     
-    user = get_user_by_username(payload['username'])
+    user = await auth.principal(payload['username'])
     if not user:
         return JSONResponse({'success': False, 'error': 'User not found'}, status_code=404)
-    if user[5]:
+    if user.banned:
         return JSONResponse({'success': False, 'error': 'User banned'}, status_code=403)
-    if user[6]:
+    if user.muted:
         return JSONResponse({'success': False, 'error': 'User muted'}, status_code=403)
     
     text = data.get('text', '').strip()
@@ -148,19 +132,14 @@ async def send_chat_message(request: Request):
     message_json = json.dumps(message_data, ensure_ascii=False)
     
     timestamp = datetime.utcnow().isoformat() + 'Z'
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('INSERT INTO messages (username, role, text, timestamp) VALUES (?, ?, ?, ?)',
-              (user[0], user[4], message_json, timestamp))
-    conn.commit()
-    conn.close()
+    await chat_writer.save_message(user.username, user.role, message_json, timestamp)
     
     return JSONResponse({'success': True})
 
 @router.post('/upload')
 async def chat_upload(request: Request, file: UploadFile = File(...)):
     token = request.headers.get('Authorization')
-    payload = decode_jwt(token)
+    payload = auth.decode_jwt(token)
     if not payload:
         return JSONResponse({'success': False, 'error': 'Unauthorized'}, status_code=401)
     
@@ -180,11 +159,11 @@ async def chat_upload(request: Request, file: UploadFile = File(...)):
 async def delete_message(request: Request):
     data = await request.json()
     token = request.headers.get('Authorization')
-    payload = decode_jwt(token)
+    payload = auth.decode_jwt(token)
     if not payload:
         return JSONResponse({'success': False, 'error': 'Unauthorized'}, status_code=401)
     
-    user = get_user_by_username(payload['username'])
+    user = await auth.principal(payload['username'])
     if not user:
         return JSONResponse({'success': False, 'error': 'User not found'}, status_code=404)
     
@@ -192,7 +171,23 @@ async def delete_message(request: Request):
     if not message_id:
         return JSONResponse({'success': False, 'error': 'Message id required'}, status_code=400)
     
-    conn = sqlite3.connect(DB_FILE)
+    row = await database.fetch_one('SELECT username FROM messages WHERE id=?', (message_id,))
+    
+    if not row:
+        # Старое сообщение может лежать в архиве; удалять оттуда может только админ
+        if user.role == 'admin' and await database.run(archive.delete_archived_message, message_id):
+            return JSONResponse({'success': True})
+        return JSONResponse({'success': False, 'error': 'Message not found'}, status_code=404)
+    
+    if row[0] != user.username and user.role != 'admin':
+        return JSONResponse({'success': False, 'error': 'Forbidden'}, status_code=403)
+    
+    await database.execute('DELETE FROM messages WHERE id=?', (message_id,))
+    
+    return JSONResponse({'success': True})
+
+def _edit_message(user, message_id, new_text):
+    conn = database.connect()
     c = conn.cursor()
     c.execute('SELECT username FROM messages WHERE id=?', (message_id,))
     row = c.fetchone()
@@ -201,11 +196,11 @@ async def delete_message(request: Request):
         conn.close()
         return JSONResponse({'success': False, 'error': 'Message not found'}, status_code=404)
     
-    if row[0] != user[0] and user[4] != 'admin':
+    if row[0] != user.username and user.role != 'admin':
         conn.close()
         return JSONResponse({'success': False, 'error': 'Forbidden'}, status_code=403)
     
-    c.execute('DELETE FROM messages WHERE id=?', (message_id,))
+    c.execute('UPDATE messages SET text=? WHERE id=?', (new_text, message_id))
     conn.commit()
     conn.close()
     
@@ -215,11 +210,11 @@ async def delete_message(request: Request):
 async def edit_message(request: Request):
     data = await request.json()
     token = request.headers.get('Authorization')
-    payload = decode_jwt(token)
+    payload = auth.decode_jwt(token)
     if not payload:
         return JSONResponse({'success': False, 'error': 'Unauthorized'}, status_code=401)
     
-    user = get_user_by_username(payload['username'])
+    user = await auth.principal(payload['username'])
     if not user:
         return JSONResponse({'success': False, 'error': 'User not found'}, status_code=404)
     
@@ -229,21 +224,4 @@ async def edit_message(request: Request):
     if not message_id or not new_text:
         return JSONResponse({'success': False, 'error': 'Message id and text required'}, status_code=400)
     
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT username FROM messages WHERE id=?', (message_id,))
-    row = c.fetchone()
-    
-    if not row:
-        conn.close()
-        return JSONResponse({'success': False, 'error': 'Message not found'}, status_code=404)
-    
-    if row[0] != user[0] and user[4] != 'admin':
-        conn.close()
-        return JSONResponse({'success': False, 'error': 'Forbidden'}, status_code=403)
-    
-    c.execute('UPDATE messages SET text=? WHERE id=?', (new_text, message_id))
-    conn.commit()
-    conn.close()
-    
-    return JSONResponse({'success': True})
\ No newline at end of file
+    return await database.run(_edit_message, user, message_id, new_text)
\ No newline at end of file
@@ -0,0 +1,153 @@
+"""Групповая запись сообщений чата.
+
+Раньше каждое сообщение записывалось отдельной транзакцией со своим fsync.
+Теперь обработчики (WebSocket /ws/chat и /api/chat/send) кладут сообщение в
+очередь, а одна задача asyncio собирает сообщения всех соединений и пишет их
+одной транзакцией: как только набралось CHAT_BATCH_SIZE сообщений или прошло
+CHAT_BATCH_DELAY_MS с первого в пачке. Пока пачка записывается, новые
+сообщения копятся для следующей. Отправитель получает id своего сообщения
+после коммита пачки, то есть до рассылки сообщение уже сохранено.
+
+Надёжность задаётся CHAT_SYNCHRONOUS (PRAGMA synchronous соединения записи):
+NORMAL (по умолчанию, как у остальных соединений в режиме WAL) - сообщение
+переживает падение процесса, FULL - и отключение питания, OFF - без fsync.
+"""
+import asyncio
+import os
+
+from routers import database
+
+# Максимум сообщений в одной транзакции
+CHAT_BATCH_SIZE = int(os.getenv('CHAT_BATCH_SIZE', '100'))
+
+# Сколько ждать следующих сообщений после первого в пачке, мс (0 - писать сразу)
+CHAT_BATCH_DELAY_MS = float(os.getenv('CHAT_BATCH_DELAY_MS', '5'))
+
+CHAT_SYNCHRONOUS = os.getenv('CHAT_SYNCHRONOUS', 'NORMAL').upper()
+if CHAT_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    print(f"Неизвестный CHAT_SYNCHRONOUS={CHAT_SYNCHRONOUS}, используется NORMAL")
+    CHAT_SYNCHRONOUS = 'NORMAL'
+
+INSERT_MESSAGE_SQL = 'INSERT INTO messages (username, role, text, timestamp) VALUES (?, ?, ?, ?)'
+
+_queue = None
+_writer_task = None
+_conn = None
+_stats = {'messages': 0, 'batches': 0, 'largest_batch': 0}
+
+def write_batch(conn, rows):
+    """Запись пачки сообщений одной транзакцией
+
+    Returns:
+        id сообщений в порядке rows
+    """
+    cursor = conn.cursor()
+    ids = []
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        for row in rows:
+            cursor.execute(INSERT_MESSAGE_SQL, row)
+            ids.append(cursor.lastrowid)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return ids
+
+async def _flush(batch):
+    rows = [row for row, _ in batch]
+    try:
+        ids = await database.run(write_batch, _conn, rows)
+    except Exception as e:
+        print(f"Error writing chat messages: {e}")
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+
+    for (_, future), message_id in zip(batch, ids):
+        if not future.done():
+            future.set_result(message_id)
+    _stats['messages'] += len(batch)
+    _stats['batches'] += 1
+    _stats['largest_batch'] = max(_stats['largest_batch'], len(batch))
+
+async def run_writer():
+    """Цикл записи; None в очереди - сигнал остановки"""
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await _queue.get()
+        if item is None:
+            return
+        batch = [item]
+        stopping = False
+        deadline = loop.time() + CHAT_BATCH_DELAY_MS / 1000
+
+        while len(batch) < CHAT_BATCH_SIZE:
+            if not _queue.empty():
+                item = _queue.get_nowait()
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+
+        await _flush(batch)
+        if stopping:
+            return
+
+async def save_message(username, role, text, timestamp):
+    """Сохранение сообщения чата
+
+    Returns:
+        id сообщения (уже закоммиченного)
+    """
+    row = (username, role, text, timestamp)
+    if _writer_task is None or _writer_task.done():
+        # Запись без очереди: приложение не запущено (скрипты) или уже остановлено
+        return await database.insert(INSERT_MESSAGE_SQL, row)
+
+    future = asyncio.get_running_loop().create_future()
+    _queue.put_nowait((row, future))
+    return await future
+
+def start():
+    """Запуск задачи записи в текущем event loop (вызывается при старте приложения)"""
+    global _queue, _writer_task, _conn
+    if _writer_task is not None:
+        return
+    # Чат общий для всех миров и хранится в users.db
+    _conn = database.open_connection(database.DEFAULT_WORLD)
+    _conn.execute(f'PRAGMA synchronous = {CHAT_SYNCHRONOUS}')
+    _queue = asyncio.Queue()
+    _writer_task = asyncio.get_running_loop().create_task(run_writer())
+
+async def stop():
+    """Запись оставшихся сообщений и остановка задачи"""
+    global _queue, _writer_task, _conn
+    if _writer_task is None:
+        return
+    _queue.put_nowait(None)
+    await _writer_task
+
+    # Сообщения, попавшие в очередь после сигнала остановки
+    pending = []
+    while not _queue.empty():
+        item = _queue.get_nowait()
+        if item is not None:
+            pending.append(item)
+    if pending:
+        await _flush(pending)
+
+    _conn.close()
+    _queue, _writer_task, _conn = None, None, None
+
+def stats():
+    return {'running': _writer_task is not None, **_stats}
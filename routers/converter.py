@@ -4,6 +4,8 @@ from pydantic import BaseModel
 import json
 import os
 
+from routers import auth, database, turn_engine
+
 router = APIRouter(prefix='/api/converter', tags=['converter'])
 
 DATA_FILE = 'data/converter_data.json'
@@ -47,17 +49,27 @@ def save_data(data):
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
+def invalidate_turn_deltas(currency_code):
+    """Курс валюты входит в содержание построек - дельты хода стран с этой валютой устаревают"""
+    conn = database.connect()
+    try:
+        turn_engine.mark_currency_dirty(conn.cursor(), currency_code)
+        conn.commit()
+    except Exception as e:
+        print(f"Ошибка сброса кэша хода: {e}")
+    finally:
+        conn.close()
+
+
 def verify_admin(token):
     """Проверка прав администратора"""
     try:
-        from main import decode_jwt, get_user_by_username
-        
-        payload = decode_jwt(token)
+        payload = auth.decode_jwt(token)
         if not payload:
             return False
         
-        user = get_user_by_username(payload['username'])
-        if not user or user[4] != 'admin':
+        user = auth.get_principal(payload['username'])
+        if not user or user.role != 'admin':
             return False
         
         return True
@@ -306,6 +318,7 @@ async def add_currency(request: Request):
     }
     
     save_data(data)
+    invalidate_turn_deltas(code)
     
     return JSONResponse({
         'success': True,
@@ -355,6 +368,7 @@ async def update_currency(request: Request):
             }, status_code=400)
     
     save_data(data)
+    invalidate_turn_deltas(code)
     
     return JSONResponse({
         'success': True,
@@ -394,6 +408,7 @@ async def delete_currency(request: Request):
     
     del data['currencies'][code]
     save_data(data)
+    invalidate_turn_deltas(code)
     
     return JSONResponse({
         'success': True,
@@ -0,0 +1,259 @@
+"""Общий слой подключения к SQLite.
+
+Все роутеры берут соединения отсюда. Соединения переиспользуются через пул:
+PRAGMA (WAL, synchronous=NORMAL, mmap, busy timeout) применяются один раз при
+создании соединения, а conn.close() возвращает его в пул вместо закрытия.
+
+В пуле хранится не больше DB_POOL_SIZE простаивающих соединений. Если все они
+заняты, выдаётся временное соединение, которое закрывается по-настоящему:
+обработчики вызывают get_db() прямо в event loop, и ожидание свободного
+соединения остановило бы весь сервер.
+
+Асинхронные обработчики выполняют запросы через run(), fetch_one(), fetch_all()
+и execute(): работа с SQLite уходит в отдельный пул из DB_THREADS потоков, и
+event loop продолжает обслуживать другие запросы, пока идёт запрос или ход.
+
+Миры (кампании). Учётные данные (пользователи, чат, карты, персонажи, заявки)
+общие и лежат в users.db. Игровые таблицы каждого мира - в своём файле
+WORLDS_DIR/<id>.db; мир по умолчанию (DEFAULT_WORLD) - это сам users.db.
+Текущий мир хранится в contextvar (его выставляет middleware по запросу, см.
+routers/worlds.py), и connect()/get_db() выдают соединение с файлом этого мира,
+к которому users.db подключён как accounts: запросы вида
+countries JOIN users работают без изменений. У каждого мира свой пул
+соединений, поэтому блокировка записи в одном мире не задерживает другие.
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DB_FILE = 'users.db'
+
+# Каталог файлов миров
+WORLDS_DIR = os.getenv('WORLDS_DIR', 'worlds')
+
+# Мир, игровые таблицы которого лежат в самом users.db
+DEFAULT_WORLD = 'main'
+
+# Имя, под которым users.db подключается к файлу мира
+ACCOUNTS_SCHEMA = 'accounts'
+
+# Сколько простаивающих соединений держать открытыми
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+
+# Сколько ждать снятия блокировки записи другим соединением, секунд
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '10'))
+
+# Отображение файла БД в память (байт); 0 - выключено
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+
+# Кэш страниц на соединение (КиБ)
+DB_CACHE_KIB = int(os.getenv('DB_CACHE_KIB', str(16 * 1024)))
+
+# Потоки для запросов из асинхронных обработчиков
+DB_THREADS = int(os.getenv('DB_THREADS', str(DB_POOL_SIZE)))
+
+class PooledConnection(sqlite3.Connection):
+    """Соединение, которое при close() возвращается в пул"""
+
+    def close(self):
+        self._pool.release(self)
+
+    def close_forever(self):
+        super().close()
+
+class ConnectionPool:
+    def __init__(self, world_id, size):
+        self.world_id = world_id
+        self.db_file = world_file(world_id)
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._stats = {'created': 0, 'reused': 0, 'discarded': 0}
+
+    def _create(self):
+        conn = sqlite3.connect(self.db_file, timeout=DB_BUSY_TIMEOUT, check_same_thread=False,
+                               factory=PooledConnection)
+        apply_pragmas(conn)
+        attach_accounts(conn, self.world_id)
+        conn._pool = self
+        conn._checked_out = True
+        with self._lock:
+            self._stats['created'] += 1
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                self._stats['reused'] += 1
+                conn = self._idle.pop()
+                conn._checked_out = True
+                return conn
+        return self._create()
+
+    def release(self, conn):
+        # Повторный close() того же соединения ничего не делает
+        if not conn._checked_out:
+            return
+        conn._checked_out = False
+        try:
+            # Незакоммиченные изменения не должны достаться следующему владельцу
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+        except sqlite3.ProgrammingError:
+            return
+
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self._stats['discarded'] += 1
+        conn.close_forever()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close_forever()
+
+    def stats(self):
+        with self._lock:
+            return {'size': self.size, 'idle': len(self._idle), **self._stats}
+
+def apply_pragmas(conn):
+    """Настройки соединения: WAL, synchronous=NORMAL, mmap и кэш страниц"""
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)}')
+    conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+    conn.execute(f'PRAGMA cache_size = -{DB_CACHE_KIB}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+
+_current_world = contextvars.ContextVar('world', default=DEFAULT_WORLD)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def current_world():
+    """Мир текущего запроса или задачи"""
+    return _current_world.get()
+
+@contextlib.contextmanager
+def use_world(world_id):
+    """Выполнение блока в контексте мира world_id"""
+    token = _current_world.set(world_id)
+    try:
+        yield
+    finally:
+        _current_world.reset(token)
+
+def world_file(world_id=None):
+    """Файл с игровыми таблицами мира"""
+    world_id = world_id or current_world()
+    if world_id == DEFAULT_WORLD:
+        return DB_FILE
+    return os.path.join(WORLDS_DIR, f'{world_id}.db')
+
+def attach_accounts(conn, world_id):
+    """Подключение users.db к соединению с файлом мира (у мира по умолчанию они в одном файле)"""
+    if world_id != DEFAULT_WORLD:
+        conn.execute(f'ATTACH DATABASE ? AS {ACCOUNTS_SCHEMA}', (DB_FILE,))
+
+def _get_pool(world_id=None):
+    world_id = world_id or current_world()
+    pool = _pools.get(world_id)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(world_id, ConnectionPool(world_id, DB_POOL_SIZE))
+    return pool
+
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='sqlite')
+
+def connect():
+    """Соединение из пула текущего мира (строки - кортежи, как у sqlite3.connect)"""
+    return _get_pool().acquire()
+
+def get_db():
+    """Соединение из пула текущего мира со строками sqlite3.Row"""
+    conn = _get_pool().acquire()
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def open_connection(world_id=None, with_accounts=True):
+    """Отдельное соединение вне пула с теми же настройками
+
+    Для долгих операций, меняющих состояние соединения (ATTACH, backup):
+    закрывается по-настоящему и в пул не попадает. Без with_accounts
+    users.db к файлу мира не подключается (миграции файла мира).
+    """
+    world_id = world_id or current_world()
+    conn = sqlite3.connect(world_file(world_id), timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+    apply_pragmas(conn)
+    if with_accounts:
+        attach_accounts(conn, world_id)
+    return conn
+
+def close_all():
+    """Закрытие простаивающих соединений всех миров (при остановке приложения)"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+def pool_stats(world_id=None):
+    return _get_pool(world_id).stats()
+
+def all_pool_stats():
+    """Статистика пулов по мирам"""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {world_id: pool.stats() for world_id, pool in pools.items()}
+
+async def run(fn, *args, **kwargs):
+    """Выполнение блокирующей функции работы с БД в пуле потоков БД
+
+    Функция сама берёт соединение через connect()/get_db() и закрывает его.
+    Выполняется в контексте вызывающего (в том числе в его мире).
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, fn, *args, **kwargs))
+
+def _fetch(sql, params, one, row_factory):
+    conn = _get_pool().acquire()
+    conn.row_factory = row_factory
+    try:
+        cursor = conn.execute(sql, params)
+        return cursor.fetchone() if one else cursor.fetchall()
+    finally:
+        conn.close()
+
+def _execute(sql, params, want_rowid):
+    conn = _get_pool().acquire()
+    try:
+        cursor = conn.execute(sql, params)
+        conn.commit()
+        return cursor.lastrowid if want_rowid else cursor.rowcount
+    finally:
+        conn.close()
+
+async def fetch_one(sql, params=(), row_factory=sqlite3.Row):
+    """Первая строка результата запроса или None"""
+    return await run(_fetch, sql, params, True, row_factory)
+
+async def fetch_all(sql, params=(), row_factory=sqlite3.Row):
+    """Все строки результата запроса"""
+    return await run(_fetch, sql, params, False, row_factory)
+
+async def execute(sql, params=()):
+    """Запрос на изменение в отдельной транзакции; возвращает число изменённых строк"""
+    return await run(_execute, sql, params, False)
+
+async def insert(sql, params=()):
+    """INSERT в отдельной транзакции; возвращает id новой строки"""
+    return await run(_execute, sql, params, True)
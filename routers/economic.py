@@ -1,18 +1,21 @@
-from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 from typing import Optional
 import sqlite3
-import sys
 import json
 import math
 from datetime import datetime
 
+from routers import archive, auth, database, economy_kernel, turn_engine
+
 router = APIRouter(prefix="/api/economic")
 
+# Максимум ходов на одной странице истории экономики
+ECONOMY_HISTORY_PAGE_MAX = 500
+
 def get_tech_name(tech_id: str) -> str:
     """Получить название технологии по её ID"""
-    sys.path.append('..')
     from routers.tech import LAND_FORCES_TECH, NAVY_TECH, EDUCATION_TECH, ECONOMY_TECH, INDUSTRY_TECH, INFRASTRUCTURE_TECH
     
     all_trees = [LAND_FORCES_TECH, NAVY_TECH, EDUCATION_TECH, ECONOMY_TECH, INDUSTRY_TECH, INFRASTRUCTURE_TECH]
@@ -27,21 +30,12 @@ def get_tech_name(tech_id: str) -> str:
 
 def get_db():
 
-    conn = sqlite3.connect('users.db')
+    conn = database.connect()
     conn.row_factory = sqlite3.Row
     return conn
 
-async def get_current_user(request: Request):
-    """Получение текущего пользователя из токена"""
-    sys.path.append('..')
-    from main import get_current_user as main_get_current_user
-    return await main_get_current_user(request)
-
-def init_db():
-    """Инициализация таблицы стран"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
+def init_db(cursor):
+    """Инициализация таблицы стран (миграция, см. routers/migrations.py)"""
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS countries (
             id TEXT PRIMARY KEY,
@@ -71,6 +65,9 @@ def init_db():
         cursor.execute('ALTER TABLE countries ADD COLUMN balance REAL DEFAULT 1000.0')
         cursor.execute('UPDATE countries SET balance = 1000.0 WHERE balance IS NULL')
     
+    # Страны с основной валютой - при изменении курса (turn_engine.mark_currency_dirty)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_countries_main_currency ON countries(main_currency)')
+    
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS country_resources (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -179,10 +176,26 @@ def init_db():
         )
     ''')
     
-    conn.commit()
-    conn.close()
-
-init_db()
+    # Кэш изменений страны за ход; dirty = 1 - входные данные изменились, нужен пересчёт
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS country_turn_deltas (
+            country_id TEXT PRIMARY KEY,
+            income REAL NOT NULL,
+            expenses REAL NOT NULL,
+            tax_income REAL NOT NULL,
+            research_gain INTEGER NOT NULL,
+            tax_settings TEXT NOT NULL,
+            production TEXT NOT NULL DEFAULT '{}',
+            dirty INTEGER NOT NULL DEFAULT 1,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (country_id) REFERENCES countries (id) ON DELETE CASCADE
+        )
+    ''')
+    
+    cursor.execute("PRAGMA table_info(country_turn_deltas)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'production' not in columns:
+        cursor.execute("ALTER TABLE country_turn_deltas ADD COLUMN production TEXT NOT NULL DEFAULT '{}'")
 
 def migrate_existing_players():
     """Создаёт страны для всех одобренных заявок, у которых ещё нет записи в countries"""
@@ -201,8 +214,8 @@ def migrate_existing_players():
                 u.username
             FROM player_applications pa
             JOIN users u ON pa.user_id = u.id
-            WHERE pa.status = 'approved'
-        ''')
+            WHERE pa.status = 'approved' AND pa.world_id = ?
+        ''', (database.current_world(),))
         
         approved_apps = cursor.fetchall()
         countries_created = 0
@@ -256,13 +269,6 @@ def migrate_existing_players():
     finally:
         conn.close()
 
-async def check_admin(request: Request):
-    """Проверка прав администратора"""
-    user = await get_current_user(request)
-    if not user or user.get('role') != 'admin':
-        return None
-    return user
-
 def create_country(country_id: str, player_id: int, ruler_first_name: str, ruler_last_name: str, country_name: str, currency: str = 'Золото', conn=None, cursor=None):
     """Создание новой страны в БД
     
@@ -304,6 +310,9 @@ def create_country(country_id: str, player_id: int, ruler_first_name: str, ruler
             now
         ))
         
+        # Страна могла существовать раньше с тем же ID - старая дельта хода недействительна
+        turn_engine.mark_dirty(cursor, country_id)
+        
         if own_connection:
             conn.commit()
         return True
@@ -321,13 +330,7 @@ def create_country(country_id: str, player_id: int, ruler_first_name: str, ruler
         if own_connection:
             conn.close()
 
-@router.get("/countries")
-async def get_all_countries(request: Request):
-    """Получение списка стран (для админов - все страны, для игроков - только своя)"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
+def _get_all_countries(user):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -392,13 +395,12 @@ async def get_all_countries(request: Request):
     finally:
         conn.close()
 
-@router.get("/country/{country_id}")
-async def get_country(country_id: str, request: Request):
-    """Получение информации о стране"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
+@router.get("/countries")
+async def get_all_countries(user=Depends(auth.require_user)):
+    """Получение списка стран (для админов - все страны, для игроков - только своя)"""
+    return await database.run(_get_all_countries, user)
+
+def _get_country(country_id, user):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -445,17 +447,16 @@ async def get_country(country_id: str, request: Request):
     finally:
         conn.close()
 
+@router.get("/country/{country_id}")
+async def get_country(country_id: str, user=Depends(auth.require_user)):
+    """Получение информации о стране"""
+    return await database.run(_get_country, country_id, user)
+
 class UpdateCountryData(BaseModel):
     currency: Optional[str] = None
     secret_coins: Optional[int] = None
 
-@router.post("/country/{country_id}/update")
-async def update_country(country_id: str, data: UpdateCountryData, request: Request):
-    """Обновление данных страны (только админ)"""
-    user = await check_admin(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Нет доступа'}, status_code=403)
-    
+def _update_country(country_id, data):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -499,13 +500,12 @@ async def update_country(country_id: str, data: UpdateCountryData, request: Requ
     finally:
         conn.close()
 
-@router.post("/country/{country_id}/add-coins")
-async def add_secret_coins(country_id: str, amount: int, request: Request):
-    """Добавление секретных монет стране (только админ)"""
-    user = await check_admin(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Нет доступа'}, status_code=403)
-    
+@router.post("/country/{country_id}/update")
+async def update_country(country_id: str, data: UpdateCountryData, user=Depends(auth.require_admin)):
+    """Обновление данных страны (только админ)"""
+    return await database.run(_update_country, country_id, data)
+
+def _add_secret_coins(country_id, amount):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -532,13 +532,12 @@ async def add_secret_coins(country_id: str, amount: int, request: Request):
     finally:
         conn.close()
 
-@router.delete("/country/{country_id}")
-async def delete_country(country_id: str, request: Request):
-    """Удаление страны (только админ)"""
-    user = await check_admin(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Нет доступа'}, status_code=403)
-    
+@router.post("/country/{country_id}/add-coins")
+async def add_secret_coins(country_id: str, amount: int, user=Depends(auth.require_admin)):
+    """Добавление секретных монет стране (только админ)"""
+    return await database.run(_add_secret_coins, country_id, amount)
+
+def _delete_country(country_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -558,14 +557,15 @@ async def delete_country(country_id: str, request: Request):
     finally:
         conn.close()
 
+@router.delete("/country/{country_id}")
+async def delete_country(country_id: str, user=Depends(auth.require_admin)):
+    """Удаление страны (только админ)"""
+    return await database.run(_delete_country, country_id)
+
 @router.post("/migrate-existing-players")
-async def migrate_existing_players_endpoint(request: Request):
+async def migrate_existing_players_endpoint(user=Depends(auth.require_admin)):
     """Мигрировать существующих игроков"""
-    user = await check_admin(request)
-    if not user:
-        return JSONResponse({'success': False, 'message': 'Доступ запрещён'}, status_code=403)
-    
-    count = migrate_existing_players()
+    count = await database.run(migrate_existing_players)
     return JSONResponse({'success': True, 'message': f'Создано стран: {count}'})
 
 @router.get("/available-currencies")
@@ -579,9 +579,8 @@ async def get_available_currencies():
     except Exception as e:
         return JSONResponse({'success': False, 'message': str(e)}, status_code=500)
 
-@router.get("/available-military-equipment")
-async def get_available_military_equipment():
-    """Получение списка доступных типов военного снаряжения"""
+def get_military_equipment_types():
+    """Справочник типов военного снаряжения: цена, размер партии, ресурсы и технология"""
     equipment_types = {
         # Пехотное вооружение (на 100 ед.)
         'arquebuses': {'name': 'Аркебузы', 'icon': 'fa-gun', 'price': 1, 'batch_size': 100, 'resources': {'wood': 2, 'iron': 2}, 'required_tech': 'arquebus', 'required_tech_name': get_tech_name('arquebus')},
@@ -616,7 +615,12 @@ async def get_available_military_equipment():
         'cruisers': {'name': 'Крейсера', 'icon': 'fa-ship', 'price': 4000, 'batch_size': 1, 'resources': {'wood': 8, 'iron': 140, 'bronze': 18}, 'required_tech': 'cruiser', 'required_tech_name': get_tech_name('cruiser')},
         'submarines': {'name': 'Подводные лодки', 'icon': 'fa-ship', 'price': 2500, 'batch_size': 1, 'resources': {'wood': 2, 'iron': 80, 'bronze': 10, 'cuprum': 5}, 'required_tech': 'submarine', 'required_tech_name': get_tech_name('submarine')}
     }
-    return JSONResponse({'success': True, 'equipment': equipment_types})
+    return equipment_types
+
+@router.get("/available-military-equipment")
+async def get_available_military_equipment():
+    """Получение списка доступных типов военного снаряжения"""
+    return JSONResponse({'success': True, 'equipment': get_military_equipment_types()})
 
 @router.get("/available-resources")
 async def get_available_resources():
@@ -629,9 +633,7 @@ async def get_available_resources():
     except Exception as e:
         return JSONResponse({'success': False, 'message': str(e)}, status_code=500)
 
-@router.get("/country/{country_id}/resources")
-async def get_country_resources(country_id: str, request: Request):
-    """Получить все ресурсы страны"""
+def _get_country_resources(country_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -664,19 +666,12 @@ async def get_country_resources(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.post("/country/{country_id}/update-main-currency")
-async def update_main_currency(country_id: str, request: Request):
-    """Обновить основную валюту страны (только админ)"""
-    user = await check_admin(request)
-    if not user:
-        return JSONResponse({'success': False, 'message': 'Доступ запрещён'}, status_code=403)
-    
-    data = await request.json()
-    new_currency = data.get('main_currency')
-    
-    if not new_currency:
-        return JSONResponse({'success': False, 'message': 'Не указана валюта'}, status_code=400)
-    
+@router.get("/country/{country_id}/resources")
+async def get_country_resources(country_id: str, request: Request):
+    """Получить все ресурсы страны"""
+    return await database.run(_get_country_resources, country_id)
+
+def _update_main_currency(country_id, new_currency):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -690,25 +685,24 @@ async def update_main_currency(country_id: str, request: Request):
         if cursor.rowcount == 0:
             return JSONResponse({'success': False, 'message': 'Страна не найдена'}, status_code=404)
         
+        turn_engine.mark_dirty(cursor, country_id)
         conn.commit()
         return JSONResponse({'success': True, 'message': 'Валюта обновлена'})
     finally:
         conn.close()
 
-@router.post("/country/{country_id}/update-resource")
-async def update_country_resource(country_id: str, request: Request):
-    """Обновить количество ресурса страны (только админ)"""
-    user = await check_admin(request)
-    if not user:
-        return JSONResponse({'success': False, 'message': 'Доступ запрещён'}, status_code=403)
-    
+@router.post("/country/{country_id}/update-main-currency")
+async def update_main_currency(country_id: str, request: Request, user=Depends(auth.require_admin)):
+    """Обновить основную валюту страны (только админ)"""
     data = await request.json()
-    resource_code = data.get('resource_code')
-    amount = data.get('amount', 0)
+    new_currency = data.get('main_currency')
     
-    if not resource_code:
-        return JSONResponse({'success': False, 'message': 'Не указан код ресурса'}, status_code=400)
+    if not new_currency:
+        return JSONResponse({'success': False, 'message': 'Не указана валюта'}, status_code=400)
     
+    return await database.run(_update_main_currency, country_id, new_currency)
+
+def _update_country_resource(country_id, resource_code, amount):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -729,13 +723,19 @@ async def update_country_resource(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.get("/country/{country_id}/military-equipment")
-async def get_country_military_equipment(country_id: str, request: Request):
-    """Получение военного снаряжения страны"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
+@router.post("/country/{country_id}/update-resource")
+async def update_country_resource(country_id: str, request: Request, user=Depends(auth.require_admin)):
+    """Обновить количество ресурса страны (только админ)"""
+    data = await request.json()
+    resource_code = data.get('resource_code')
+    amount = data.get('amount', 0)
+    
+    if not resource_code:
+        return JSONResponse({'success': False, 'message': 'Не указан код ресурса'}, status_code=400)
     
+    return await database.run(_update_country_resource, country_id, resource_code, amount)
+
+def _get_country_military_equipment(country_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -747,10 +747,6 @@ async def get_country_military_equipment(country_id: str, request: Request):
             return JSONResponse({'success': False, 'error': 'Страна не найдена'}, status_code=404)
         
         # Админы и модераторы могут смотреть любую страну
-        if user['role'] not in ['admin', 'moderator']:
-            if country['player_id'] != user['id']:
-                return JSONResponse({'success': False, 'error': 'Нет доступа к этой стране'}, status_code=403)
-        
         # Получаем всё снаряжение
         cursor.execute('''
             SELECT equipment_code, amount, ever_had
@@ -773,20 +769,12 @@ async def get_country_military_equipment(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.post("/country/{country_id}/update-military-equipment")
-async def update_country_military_equipment(country_id: str, request: Request):
-    """Обновление военного снаряжения (только админ)"""
-    user = await check_admin(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация администратора'}, status_code=403)
-    
-    data = await request.json()
-    equipment_code = data.get('equipment_code')
-    amount = data.get('amount', 0)
-    
-    if not equipment_code:
-        return JSONResponse({'success': False, 'error': 'Не указан код снаряжения'}, status_code=400)
-    
+@router.get("/country/{country_id}/military-equipment")
+async def get_country_military_equipment(country_id: str, user=Depends(auth.country_owner_or_admin)):
+    """Получение военного снаряжения страны"""
+    return await database.run(_get_country_military_equipment, country_id)
+
+def _update_country_military_equipment(country_id, equipment_code, amount):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -815,20 +803,19 @@ async def update_country_military_equipment(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.post("/country/{country_id}/update-currency")
-async def update_country_currency(country_id: str, request: Request):
-    """Обновление количества валюты у страны"""
-    user = await get_current_user(request)
-    if not user or user['role'] != 'admin':
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
+@router.post("/country/{country_id}/update-military-equipment")
+async def update_country_military_equipment(country_id: str, request: Request, user=Depends(auth.require_admin)):
+    """Обновление военного снаряжения (только админ)"""
     data = await request.json()
-    currency_code = data.get('currency_code')
+    equipment_code = data.get('equipment_code')
     amount = data.get('amount', 0)
     
-    if not currency_code:
-        return JSONResponse({'success': False, 'error': 'Не указан код валюты'}, status_code=400)
+    if not equipment_code:
+        return JSONResponse({'success': False, 'error': 'Не указан код снаряжения'}, status_code=400)
     
+    return await database.run(_update_country_military_equipment, country_id, equipment_code, amount)
+
+def _update_country_currency(country_id, currency_code, amount):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -853,15 +840,30 @@ async def update_country_currency(country_id: str, request: Request):
     finally:
         conn.close()
 
+@router.post("/country/{country_id}/update-currency")
+async def update_country_currency(country_id: str, request: Request, user=Depends(auth.require_admin)):
+    """Обновление количества валюты у страны"""
+    data = await request.json()
+    currency_code = data.get('currency_code')
+    amount = data.get('amount', 0)
+    
+    if not currency_code:
+        return JSONResponse({'success': False, 'error': 'Не указан код валюты'}, status_code=400)
+    
+    return await database.run(_update_country_currency, country_id, currency_code, amount)
+
 # ========== НАЛОГИ И БАЛАНС ==========
 
-@router.get("/country/{country_id}/tax-settings")
-async def get_tax_settings(country_id: str, request: Request):
-    """Получение настроек налогов для страны"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
+def with_default_tax_rates(tax_settings):
+    """Значения по умолчанию для слоев, если не установлены"""
+    tax_settings = dict(tax_settings)
+    default_layers = ['Элита', 'Высший класс', 'Средний класс', 'Низший класс']
+    for layer in default_layers:
+        if layer not in tax_settings:
+            tax_settings[layer] = 10.0  # 10% по умолчанию
+    return tax_settings
+
+def _get_tax_settings(country_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -872,10 +874,6 @@ async def get_tax_settings(country_id: str, request: Request):
         if not country:
             return JSONResponse({'success': False, 'error': 'Страна не найдена'}, status_code=404)
         
-        if user['role'] not in ['admin', 'moderator']:
-            if country['player_id'] != user['id']:
-                return JSONResponse({'success': False, 'error': 'Доступ запрещён'}, status_code=403)
-        
         cursor.execute(
             'SELECT social_layer, tax_rate FROM country_tax_settings WHERE country_id = ?',
             (country_id,)
@@ -885,15 +883,9 @@ async def get_tax_settings(country_id: str, request: Request):
         for row in cursor.fetchall():
             tax_settings[row['social_layer']] = row['tax_rate']
         
-        # Установить значения по умолчанию для слоев, если не установлены
-        default_layers = ['Элита', 'Высший класс', 'Средний класс', 'Низший класс']
-        for layer in default_layers:
-            if layer not in tax_settings:
-                tax_settings[layer] = 10.0  # 10% по умолчанию
-        
         return JSONResponse({
             'success': True,
-            'tax_settings': tax_settings
+            'tax_settings': with_default_tax_rates(tax_settings)
         })
         
     except Exception as e:
@@ -902,16 +894,12 @@ async def get_tax_settings(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.post("/country/{country_id}/tax-settings")
-async def update_tax_settings(country_id: str, request: Request):
-    """Обновление настроек налогов для страны (игроки могут менять налоги своей страны)"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
-    data = await request.json()
-    tax_settings = data.get('tax_settings', {})
-    
+@router.get("/country/{country_id}/tax-settings")
+async def get_tax_settings(country_id: str, user=Depends(auth.country_owner_or_admin)):
+    """Получение настроек налогов для страны"""
+    return await database.run(_get_tax_settings, country_id)
+
+def _update_tax_settings(country_id, tax_settings):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -923,10 +911,6 @@ async def update_tax_settings(country_id: str, request: Request):
             return JSONResponse({'success': False, 'error': 'Страна не найдена'}, status_code=404)
         
         # Игрок может менять налоги только своей страны, админ - любой
-        if user['role'] not in ['admin', 'moderator']:
-            if country['player_id'] != user['id']:
-                return JSONResponse({'success': False, 'error': 'Доступ запрещён'}, status_code=403)
-        
         # Валидация налоговых ставок (максимум 50%)
         for social_layer, tax_rate in tax_settings.items():
             if social_layer == 'Маргиналы':
@@ -951,6 +935,7 @@ async def update_tax_settings(country_id: str, request: Request):
                 (country_id, social_layer, tax_rate, now, now, tax_rate, now)
             )
         
+        turn_engine.mark_dirty(cursor, country_id)
         conn.commit()
         return JSONResponse({'success': True, 'message': 'Налоговые ставки обновлены'})
         
@@ -961,175 +946,204 @@ async def update_tax_settings(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.get("/country/{country_id}/balance-forecast")
-async def get_balance_forecast(country_id: str, request: Request):
-    """Получение баланса и прогноза доходов/расходов"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
+@router.post("/country/{country_id}/tax-settings")
+async def update_tax_settings(country_id: str, request: Request, user=Depends(auth.country_owner_or_admin)):
+    """Обновление настроек налогов для страны (игроки могут менять налоги своей страны)"""
+    data = await request.json()
+    tax_settings = data.get('tax_settings', {})
     
+    return await database.run(_update_tax_settings, country_id, tax_settings)
+
+def compute_balance_forecast(country_id):
+    """Прогноз доходов/расходов страны на следующий ход (выполняется вне event loop)"""
     conn = get_db()
     cursor = conn.cursor()
     
     try:
-        cursor.execute('SELECT player_id, main_currency FROM countries WHERE id = ?', (country_id,))
-        country = cursor.fetchone()
+        # Входные данные страны и налоги считаются общим экономическим ядром
+        world = turn_engine.load_world(cursor, [country_id])
+    finally:
+        conn.close()
+    
+    return forecast_from_world(world, country_id)
+
+def forecast_from_world(world, country_id):
+    """Прогноз по входным данным страны из turn_engine.load_world"""
+    inputs = economy_kernel.build_inputs(world)
+    tax = economy_kernel.compute_tax(inputs)
+    tax_income = float(tax['tax_income'][0])
+    tax_breakdown = economy_kernel.tax_breakdown(inputs, tax, 0)
+    
+    # Содержание построек и производство - тот же расчёт, что и при переходе хода
+    turn_result = turn_engine.compute_turn(world)[country_id]
+    buildings_maintenance = turn_result['expenses']
+    buildings_count = len(world[country_id]['buildings'])
+    
+    # Общие расходы = содержание зданий
+    total_expenses = buildings_maintenance
+    
+    total_income = tax_income
+    net_change = total_income - total_expenses
+    
+    return {
+        'balance': round(world[country_id]['balance'], 2),
+        'forecast': {
+            'income': round(total_income, 2),
+            'expenses': round(total_expenses, 2),
+            'net_change': round(net_change, 2),
+            'tax_breakdown': tax_breakdown,
+            'expenses_breakdown': {
+                'buildings_maintenance': round(buildings_maintenance, 2),
+                'buildings_count': buildings_count
+            },
+            'production': turn_result['production']
+        }
+    }
+
+@router.get("/country/{country_id}/balance-forecast")
+async def get_balance_forecast(country_id: str, user=Depends(auth.country_owner_or_admin)):
+    """Получение баланса и прогноза доходов/расходов"""
+    try:
+        country = await database.fetch_one('SELECT player_id, main_currency FROM countries WHERE id = ?', (country_id,))
         
         if not country:
             return JSONResponse({'success': False, 'error': 'Страна не найдена'}, status_code=404)
         
-        if user['role'] not in ['admin', 'moderator']:
-            if country['player_id'] != user['id']:
-                return JSONResponse({'success': False, 'error': 'Доступ запрещён'}, status_code=403)
+        forecast = await database.run(compute_balance_forecast, country_id)
         
-        # Получаем баланс основной валюты из country_currencies
-        cursor.execute(
-            'SELECT amount FROM country_currencies WHERE country_id = ? AND currency_code = ?',
-            (country_id, country['main_currency'])
-        )
-        balance_row = cursor.fetchone()
-        balance = float(balance_row['amount']) if balance_row else 0.0
+        return JSONResponse({
+            'success': True,
+            'balance': forecast['balance'],
+            'currency': country['main_currency'],
+            'forecast': forecast['forecast']
+        })
         
-        # Получаем статистику населения (в миллионах: 0.77 = 770 тыс., 41.23 = 41.23 млн)
-        cursor.execute('SELECT population FROM country_stats WHERE country_id = ?', (country_id,))
-        stats = cursor.fetchone()
-        population = (stats['population'] * 1_000_000) if stats else 0.0
+    except Exception as e:
+        print(f"Error calculating balance forecast: {e}")
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+# Разделы сводки страны; каждый совпадает с ответом отдельного эндпоинта
+DASHBOARD_FIELDS = (
+    'available_currencies',          # /available-currencies
+    'available_resources',           # /available-resources
+    'available_military_equipment',  # /available-military-equipment
+    'resources',                     # /country/{id}/resources
+    'military_equipment',            # /country/{id}/military-equipment
+    'balance_forecast',              # /country/{id}/balance-forecast
+    'tax_settings',                  # /country/{id}/tax-settings
+    'income_settings'                # /country/{id}/income-settings
+)
+
+def build_dashboard(country_id, user, fields):
+    """Сводка страны для страницы экономики (выполняется вне event loop)
+
+    Все разделы читаются через одно соединение фиксированным числом запросов,
+    не зависящим от размера данных: прогноз, налоги и заработок берутся из
+    одного turn_engine.load_world.
+
+    Returns:
+        (сводка, None) или (None, код ошибки 404/403)
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('SELECT player_id, main_currency FROM countries WHERE id = ?', (country_id,))
+        country = cursor.fetchone()
+        if not country:
+            return None, 404
         
-        # Получаем социальные слои
-        cursor.execute(
-            'SELECT layer_name, percentage FROM country_social_layers WHERE country_id = ?',
-            (country_id,)
-        )
-        social_layers = {}
-        for row in cursor.fetchall():
-            social_layers[row['layer_name']] = row['percentage']
+        if user['role'] not in ['admin', 'moderator']:
+            if country['player_id'] != user['id']:
+                return None, 403
         
-        # Получаем настройки налогов
-        cursor.execute(
-            'SELECT social_layer, tax_rate FROM country_tax_settings WHERE country_id = ?',
-            (country_id,)
-        )
-        tax_settings = {}
-        for row in cursor.fetchall():
-            tax_settings[row['social_layer']] = row['tax_rate']
+        dashboard = {}
         
-        # Получаем настройки среднего заработка
-        cursor.execute(
-            'SELECT social_layer, avg_income FROM country_income_settings WHERE country_id = ?',
-            (country_id,)
-        )
-        income_settings = {}
-        for row in cursor.fetchall():
-            income_settings[row['social_layer']] = row['avg_income']
+        if {'available_currencies', 'available_resources'} & fields:
+            with open('data/converter_data.json', 'r', encoding='utf-8') as f:
+                converter_data = json.load(f)
+            if 'available_currencies' in fields:
+                dashboard['available_currencies'] = converter_data.get('currencies', {})
+            if 'available_resources' in fields:
+                dashboard['available_resources'] = converter_data.get('resources', {})
         
-        # Расчет налоговых доходов
-        tax_income = 0.0
-        tax_breakdown = {}
+        if 'available_military_equipment' in fields:
+            dashboard['available_military_equipment'] = get_military_equipment_types()
         
-        for layer_name, percentage in social_layers.items():
-            if layer_name == 'Маргиналы':
-                continue  # Маргиналы не платят налоги
-            
-            # Рассчитываем количество людей в этом слое
-            layer_population = population * (percentage / 100.0)
-            
-            # Получаем ставку налога для этого слоя (если не задана, пропускаем)
-            tax_rate = tax_settings.get(layer_name)
-            if tax_rate is None:
-                continue
-            
-            # Получаем средний заработок для этого слоя (если не задан, пропускаем)
-            base_income = income_settings.get(layer_name)
-            if base_income is None:
-                continue
-            
-            # Налог = население_слоя × средний_заработок × (налоговая_ставка / 100)
-            # Например: 500,000 чел × 100 монет × 10% = 5,000,000 монет
-            layer_tax = layer_population * base_income * (tax_rate / 100.0)
-            tax_income += layer_tax
-            
-            tax_breakdown[layer_name] = {
-                'population': round(layer_population, 2),
-                'tax_rate': tax_rate,
-                'avg_income': base_income,
-                'income': round(layer_tax, 2)
+        if 'resources' in fields:
+            cursor.execute('''
+                SELECT 'resource' AS kind, resource_code AS code, amount FROM country_resources WHERE country_id = ?
+                UNION ALL
+                SELECT 'currency', currency_code, amount FROM country_currencies WHERE country_id = ?
+            ''', (country_id, country_id))
+            resources, currencies = {}, {}
+            for row in cursor.fetchall():
+                (resources if row['kind'] == 'resource' else currencies)[row['code']] = row['amount']
+            dashboard['resources'] = {
+                'main_currency': country['main_currency'],
+                'resources': resources,
+                'currencies': currencies
             }
         
-        # Расчет расходов на содержание зданий
-        # Импортируем BUILDING_TYPES из provinces.py
-        sys.path.append('..')
-        from routers.provinces import BUILDING_TYPES
-        
-        cursor.execute('''
-            SELECT b.building_type_name
-            FROM buildings b
-            JOIN provinces p ON b.province_id = p.id
-            WHERE p.country_id = ?
-        ''', (country_id,))
+        if 'military_equipment' in fields:
+            cursor.execute(
+                'SELECT equipment_code, amount, ever_had FROM country_military_equipment WHERE country_id = ?',
+                (country_id,)
+            )
+            dashboard['military_equipment'] = {
+                row['equipment_code']: {'amount': row['amount'], 'ever_had': row['ever_had']}
+                for row in cursor.fetchall()
+            }
         
-        buildings_maintenance = 0.0
-        buildings_count = 0
-        for row in cursor.fetchall():
-            building_name = row['building_type_name']
-            
-            # Получаем данные постройки из константы
-            if building_name not in BUILDING_TYPES:
-                continue  # Пропускаем удаленные типы построек
-            
-            # maintenance_cost хранится в золоте, нужно конвертировать в валюту страны
-            maintenance_in_gold = BUILDING_TYPES[building_name]['maintenance_cost']
-            
-            # Получаем курс основной валюты
-            try:
-                converter_data_file = 'data/converter_data.json'
-                with open(converter_data_file, 'r', encoding='utf-8') as f:
-                    converter_data = json.load(f)
-                    currency_rate = converter_data.get('currencies', {}).get(country['main_currency'], {}).get('rate', 1)
-            except:
-                currency_rate = 1
-            
-            # Конвертируем и округляем до десятков вверх
-            maintenance_in_currency = maintenance_in_gold * currency_rate
-            maintenance_in_currency = math.ceil(maintenance_in_currency / 10) * 10
-            
-            buildings_maintenance += maintenance_in_currency
-            buildings_count += 1
+        if {'balance_forecast', 'tax_settings', 'income_settings'} & fields:
+            world = turn_engine.load_world(cursor, [country_id])
+            if 'balance_forecast' in fields:
+                dashboard['balance_forecast'] = {
+                    'currency': country['main_currency'],
+                    **forecast_from_world(world, country_id)
+                }
+            if 'tax_settings' in fields:
+                dashboard['tax_settings'] = with_default_tax_rates(world[country_id]['tax_settings'])
+            if 'income_settings' in fields:
+                dashboard['income_settings'] = world[country_id]['income_settings']
         
-        # Общие расходы = содержание зданий
-        total_expenses = buildings_maintenance
+        return dashboard, None
+    finally:
+        conn.close()
+
+@router.get("/country/{country_id}/dashboard")
+async def get_country_dashboard(country_id: str, fields: str = None, user=Depends(auth.require_user)):
+    """Все данные страницы экономики одним запросом
+
+    fields - необязательный список разделов через запятую (см. DASHBOARD_FIELDS);
+    по умолчанию возвращаются все.
+    """
+    selected = set(DASHBOARD_FIELDS)
+    if fields:
+        selected = {field.strip() for field in fields.split(',') if field.strip()}
+        unknown = selected - set(DASHBOARD_FIELDS)
+        if unknown:
+            return JSONResponse({
+                'success': False,
+                'error': f'Неизвестные разделы: {", ".join(sorted(unknown))}',
+                'available_fields': list(DASHBOARD_FIELDS)
+            }, status_code=400)
+    
+    try:
+        dashboard, error = await database.run(build_dashboard, country_id, user, selected)
         
-        total_income = tax_income
-        net_change = total_income - total_expenses
+        if error == 404:
+            return JSONResponse({'success': False, 'error': 'Страна не найдена'}, status_code=404)
+        if error == 403:
+            return JSONResponse({'success': False, 'error': 'Доступ запрещён'}, status_code=403)
         
-        return JSONResponse({
-            'success': True,
-            'balance': round(balance, 2),
-            'currency': country['main_currency'],
-            'forecast': {
-                'income': round(total_income, 2),
-                'expenses': round(total_expenses, 2),
-                'net_change': round(net_change, 2),
-                'tax_breakdown': tax_breakdown,
-                'expenses_breakdown': {
-                    'buildings_maintenance': round(buildings_maintenance, 2),
-                    'buildings_count': buildings_count
-                }
-            }
-        })
+        return JSONResponse({'success': True, 'country_id': country_id, **dashboard})
         
     except Exception as e:
-        print(f"Error calculating balance forecast: {e}")
+        print(f"Error building country dashboard: {e}")
         return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
-    finally:
-        conn.close()
 
-@router.get("/country/{country_id}/education-science")
-async def get_education_science(country_id: str, request: Request):
-    """Получение параметров образования и науки для страны"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
+def _get_education_science(country_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -1141,10 +1155,6 @@ async def get_education_science(country_id: str, request: Request):
         if not country:
             return JSONResponse({'success': False, 'error': 'Страна не найдена'}, status_code=404)
         
-        if user['role'] not in ['admin', 'moderator']:
-            if country['player_id'] != user['id']:
-                return JSONResponse({'success': False, 'error': 'Доступ запрещён'}, status_code=403)
-        
         # Получаем данные образования и науки
         cursor.execute(
             'SELECT education_level, science_level FROM country_education_science WHERE country_id = ?',
@@ -1167,6 +1177,7 @@ async def get_education_science(country_id: str, request: Request):
                    VALUES (?, 0.0, 0.0, ?, ?)''',
                 (country_id, now, now)
             )
+            turn_engine.mark_dirty(cursor, country_id)
             conn.commit()
             return JSONResponse({
                 'success': True,
@@ -1180,26 +1191,12 @@ async def get_education_science(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.post("/country/{country_id}/education-science")
-async def update_education_science(country_id: str, request: Request):
-    """Обновление параметров образования и науки (только для админа)"""
-    user = await get_current_user(request)
-    if not user or user['role'] != 'admin':
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
-    data = await request.json()
-    education_level = data.get('education_level')
-    science_level = data.get('science_level')
-    
-    if education_level is None or science_level is None:
-        return JSONResponse({'success': False, 'error': 'Отсутствуют обязательные параметры'}, status_code=400)
-    
-    # Валидация диапазона 0-100
-    if education_level < 0 or education_level > 100:
-        return JSONResponse({'success': False, 'error': 'Образованность должна быть от 0 до 100'}, status_code=400)
-    if science_level < 0 or science_level > 100:
-        return JSONResponse({'success': False, 'error': 'Уровень науки должен быть от 0 до 100'}, status_code=400)
-    
+@router.get("/country/{country_id}/education-science")
+async def get_education_science(country_id: str, user=Depends(auth.country_owner_or_admin)):
+    """Получение параметров образования и науки для страны"""
+    return await database.run(_get_education_science, country_id)
+
+def _update_education_science(country_id, education_level, science_level):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -1219,6 +1216,7 @@ async def update_education_science(country_id: str, request: Request):
             (country_id, education_level, science_level, now, now, 
              education_level, science_level, now)
         )
+        turn_engine.mark_dirty(cursor, country_id)
         conn.commit()
         
         return JSONResponse({
@@ -1234,29 +1232,57 @@ async def update_education_science(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.get("/country/{country_id}/economy-history")
-async def get_economy_history(country_id: str, request: Request):
-    """Получение истории экономики страны (только для админа)"""
-    user = await get_current_user(request)
-    if not user or user['role'] not in ['admin', 'moderator']:
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
+@router.post("/country/{country_id}/education-science")
+async def update_education_science(country_id: str, request: Request, user=Depends(auth.require_admin)):
+    """Обновление параметров образования и науки (только для админа)"""
+    data = await request.json()
+    education_level = data.get('education_level')
+    science_level = data.get('science_level')
     
+    if education_level is None or science_level is None:
+        return JSONResponse({'success': False, 'error': 'Отсутствуют обязательные параметры'}, status_code=400)
+    
+    # Валидация диапазона 0-100
+    if education_level < 0 or education_level > 100:
+        return JSONResponse({'success': False, 'error': 'Образованность должна быть от 0 до 100'}, status_code=400)
+    if science_level < 0 or science_level > 100:
+        return JSONResponse({'success': False, 'error': 'Уровень науки должен быть от 0 до 100'}, status_code=400)
+    
+    return await database.run(_update_education_science, country_id, education_level, science_level)
+
+def _get_economy_history(country_id, before_turn, limit):
     conn = get_db()
     cursor = conn.cursor()
     
     try:
-        cursor.execute(
-            '''SELECT turn_number, balance_start, balance_end, income, expenses, 
-                      tax_income, tax_settings, created_at
-               FROM economy_history 
-               WHERE country_id = ?
-               ORDER BY turn_number DESC
-               LIMIT 50''',
-            (country_id,)
-        )
+        if before_turn is None:
+            cursor.execute(
+                '''SELECT turn_number, balance_start, balance_end, income, expenses, 
+                          tax_income, tax_settings, created_at
+                   FROM economy_history 
+                   WHERE country_id = ?
+                   ORDER BY turn_number DESC
+                   LIMIT ?''',
+                (country_id, limit)
+            )
+        else:
+            cursor.execute(
+                '''SELECT turn_number, balance_start, balance_end, income, expenses, 
+                          tax_income, tax_settings, created_at
+                   FROM economy_history 
+                   WHERE country_id = ? AND turn_number < ?
+                   ORDER BY turn_number DESC
+                   LIMIT ?''',
+                (country_id, before_turn, limit)
+            )
+        rows = cursor.fetchall()
+        
+        if len(rows) < limit:
+            oldest_turn = rows[-1]['turn_number'] if rows else before_turn
+            rows += archive.archived_economy_history(country_id, oldest_turn, limit - len(rows))
         
         history = []
-        for row in cursor.fetchall():
+        for row in rows:
             import json
             history.append({
                 'turn': row['turn_number'],
@@ -1280,73 +1306,70 @@ async def get_economy_history(country_id: str, request: Request):
     finally:
         conn.close()
 
+@router.get("/country/{country_id}/economy-history")
+async def get_economy_history(country_id: str, before_turn: int = None, limit: int = 50, user=Depends(auth.require_staff)):
+    """Получение истории экономики страны (только для админа)
+
+    before_turn - вернуть ходы раньше указанного (постраничный просмотр);
+    ходы старше горизонта хранения дочитываются из архива (routers/archive.py)
+    """
+    limit = max(1, min(limit, ECONOMY_HISTORY_PAGE_MAX))
+    return await database.run(_get_economy_history, country_id, before_turn, limit)
+
+def load_all_economy_history():
+    """История экономики всех стран за последние 20 ходов - готовый JSON-объект (строка)
+
+    Объект собирают JSON-функции SQLite: модуль sqlite3 отпускает GIL на время
+    запроса, и event loop не простаивает, пока строится ответ на весь мир
+    (выполняется вне event loop)
+    """
+    conn = database.connect()
+    
+    try:
+        row = conn.execute('''
+            SELECT json_group_object(c.id, json_object(
+                'country_name', c.country_name,
+                'history', (
+                    SELECT json_group_array(json_object(
+                        'turn', h.turn_number,
+                        'balance_start', h.balance_start,
+                        'balance_end', h.balance_end,
+                        'income', h.income,
+                        'expenses', h.expenses,
+                        'tax_income', h.tax_income,
+                        'tax_settings', json(h.tax_settings),
+                        'date', h.created_at
+                    ))
+                    FROM (
+                        SELECT * FROM economy_history
+                        WHERE country_id = c.id
+                        ORDER BY turn_number DESC
+                        LIMIT 20
+                    ) h
+                )
+            ))
+            FROM (SELECT id, country_name FROM countries ORDER BY country_name) c
+        ''').fetchone()
+        return row[0]
+    finally:
+        conn.close()
+
+def _get_all_economy_history():
+    return Response(
+        '{"success":true,"countries":' + load_all_economy_history() + '}',
+        media_type='application/json'
+    )
+
 @router.get("/economy-history/all")
-async def get_all_economy_history(request: Request):
+async def get_all_economy_history(user=Depends(auth.require_staff)):
     """Получение истории экономики всех стран (только для админа)"""
-    user = await get_current_user(request)
-    if not user or user['role'] not in ['admin', 'moderator']:
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    
     try:
-        # Получаем список всех стран
-        cursor.execute('SELECT id, country_name FROM countries ORDER BY country_name')
-        countries = cursor.fetchall()
-        
-        result = {}
-        for country in countries:
-            country_id = country['id']
-            country_name = country['country_name']
-            
-            cursor.execute(
-                '''SELECT turn_number, balance_start, balance_end, income, expenses, 
-                          tax_income, tax_settings, created_at
-                   FROM economy_history 
-                   WHERE country_id = ?
-                   ORDER BY turn_number DESC
-                   LIMIT 20''',
-                (country_id,)
-            )
-            
-            history = []
-            import json
-            for row in cursor.fetchall():
-                history.append({
-                    'turn': row['turn_number'],
-                    'balance_start': row['balance_start'],
-                    'balance_end': row['balance_end'],
-                    'income': row['income'],
-                    'expenses': row['expenses'],
-                    'tax_income': row['tax_income'],
-                    'tax_settings': json.loads(row['tax_settings']),
-                    'date': row['created_at']
-                })
-            
-            result[country_id] = {
-                'country_name': country_name,
-                'history': history
-            }
-        
-        return JSONResponse({
-            'success': True,
-            'countries': result
-        })
-        
+        return await database.run(_get_all_economy_history)
     except Exception as e:
         print(f"Error getting all economy history: {e}")
         return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
-    finally:
-        conn.close()
 
-@router.get("/country/{country_id}/income-settings")
-async def get_income_settings(country_id: str, request: Request):
-    """Получение настроек среднего заработка для страны"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
+def _get_income_settings(country_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -1358,10 +1381,6 @@ async def get_income_settings(country_id: str, request: Request):
             return JSONResponse({'success': False, 'error': 'Страна не найдена'}, status_code=404)
         
         # Проверяем доступ (игрок может видеть свою страну, админ - любую)
-        if user['role'] not in ['admin', 'moderator']:
-            if country['player_id'] != user['id']:
-                return JSONResponse({'success': False, 'error': 'Доступ запрещён'}, status_code=403)
-        
         cursor.execute(
             'SELECT social_layer, avg_income FROM country_income_settings WHERE country_id = ?',
             (country_id,)
@@ -1382,16 +1401,12 @@ async def get_income_settings(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.post("/country/{country_id}/income-settings")
-async def update_income_settings(country_id: str, request: Request):
-    """Обновление настроек среднего заработка для страны (только админ)"""
-    user = await get_current_user(request)
-    if not user or user['role'] not in ['admin', 'moderator']:
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
-    data = await request.json()
-    income_settings = data.get('income_settings', {})
-    
+@router.get("/country/{country_id}/income-settings")
+async def get_income_settings(country_id: str, user=Depends(auth.country_owner_or_admin)):
+    """Получение настроек среднего заработка для страны"""
+    return await database.run(_get_income_settings, country_id)
+
+def _update_income_settings(country_id, income_settings):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -1414,6 +1429,7 @@ async def update_income_settings(country_id: str, request: Request):
                 (country_id, social_layer, avg_income, now, now, avg_income, now)
             )
         
+        turn_engine.mark_dirty(cursor, country_id)
         conn.commit()
         return JSONResponse({'success': True, 'message': 'Настройки дохода обновлены'})
         
@@ -1424,114 +1440,10 @@ async def update_income_settings(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.get("/country/{country_id}/education-science")
-async def get_education_science(country_id: str, request: Request):
-    """Получение параметров образования и науки для страны"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    try:
-        # Проверка доступа: админ или игрок своей страны
-        cursor.execute('SELECT player_id FROM countries WHERE id = ?', (country_id,))
-        country = cursor.fetchone()
-        
-        if not country:
-            return JSONResponse({'success': False, 'error': 'Страна не найдена'}, status_code=404)
-        
-        if user['role'] not in ['admin', 'moderator']:
-            if country['player_id'] != user['id']:
-                return JSONResponse({'success': False, 'error': 'Доступ запрещён'}, status_code=403)
-        
-        # Получаем данные образования и науки
-        cursor.execute(
-            'SELECT education_level, science_level FROM country_education_science WHERE country_id = ?',
-            (country_id,)
-        )
-        data = cursor.fetchone()
-        
-        if data:
-            return JSONResponse({
-                'success': True,
-                'education_level': data['education_level'],
-                'science_level': data['science_level']
-            })
-        else:
-            # Если нет данных, создаём с нулевыми значениями
-            now = datetime.now().isoformat()
-            cursor.execute(
-                '''INSERT INTO country_education_science 
-                   (country_id, education_level, science_level, created_at, updated_at)
-                   VALUES (?, 0.0, 0.0, ?, ?)''',
-                (country_id, now, now)
-            )
-            conn.commit()
-            return JSONResponse({
-                'success': True,
-                'education_level': 0.0,
-                'science_level': 0.0
-            })
-    
-    except Exception as e:
-        print(f"Error getting education/science data: {e}")
-        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
-    finally:
-        conn.close()
-
-@router.post("/country/{country_id}/education-science")
-async def update_education_science(country_id: str, request: Request):
-    """Обновление параметров образования и науки (только для админа)"""
-    user = await get_current_user(request)
-    if not user or user['role'] != 'admin':
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
+@router.post("/country/{country_id}/income-settings")
+async def update_income_settings(country_id: str, request: Request, user=Depends(auth.require_staff)):
+    """Обновление настроек среднего заработка для страны (только админ)"""
     data = await request.json()
-    education_level = data.get('education_level')
-    science_level = data.get('science_level')
-    
-    if education_level is None or science_level is None:
-        return JSONResponse({'success': False, 'error': 'Отсутствуют обязательные параметры'}, status_code=400)
-    
-    # Валидация диапазона 0-100
-    if education_level < 0 or education_level > 100:
-        return JSONResponse({'success': False, 'error': 'Образованность должна быть от 0 до 100'}, status_code=400)
-    if science_level < 0 or science_level > 100:
-        return JSONResponse({'success': False, 'error': 'Уровень науки должен быть от 0 до 100'}, status_code=400)
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    try:
-        # Проверка существования страны
-        cursor.execute('SELECT id FROM countries WHERE id = ?', (country_id,))
-        if not cursor.fetchone():
-            return JSONResponse({'success': False, 'error': 'Страна не найдена'}, status_code=404)
-        
-        now = datetime.now().isoformat()
-        cursor.execute(
-            '''INSERT INTO country_education_science 
-               (country_id, education_level, science_level, created_at, updated_at)
-               VALUES (?, ?, ?, ?, ?)
-               ON CONFLICT(country_id) 
-               DO UPDATE SET education_level = ?, science_level = ?, updated_at = ?''',
-            (country_id, education_level, science_level, now, now, 
-             education_level, science_level, now)
-        )
-        conn.commit()
-        
-        return JSONResponse({
-            'success': True,
-            'education_level': education_level,
-            'science_level': science_level
-        })
+    income_settings = data.get('income_settings', {})
     
-    except Exception as e:
-        print(f"Error updating education/science: {e}")
-        conn.rollback()
-        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
-    finally:
-        conn.close()
-
+    return await database.run(_update_income_settings, country_id, income_settings)
@@ -0,0 +1,169 @@
+"""Векторизованное экономическое ядро.
+
+Единая реализация формул налогов, очков исследований, содержания зданий и
+производства снаряжения для
+прогноза баланса и движка хода. Данные многих стран передаются массивами NumPy:
+строка - страна, столбец - социальный слой.
+"""
+import numpy as np
+
+# Маргиналы не платят налоги
+TAX_EXEMPT_LAYER = 'Маргиналы'
+
+def build_inputs(world):
+    """Сборка массивов ядра из входных данных стран (см. turn_engine.load_world)
+
+    Слои упорядочены так же, как UNIQUE-индекс (country_id, слой) в SQLite, поэтому
+    порядок суммирования совпадает с построчным расчётом.
+
+    Returns:
+        dict: country_ids, layers и матрицы страна × слой (NaN - значение не задано)
+    """
+    country_ids = list(world)
+    layers = sorted({layer for inputs in world.values() for layer in inputs['social_layers']})
+    layer_index = {layer: j for j, layer in enumerate(layers)}
+
+    shape = (len(country_ids), len(layers))
+    percentage = np.full(shape, np.nan)
+    tax_rate = np.full(shape, np.nan)
+    avg_income = np.full(shape, np.nan)
+    population = np.full(len(country_ids), np.nan)
+    education = np.full(len(country_ids), np.nan)
+    science = np.full(len(country_ids), np.nan)
+
+    for i, country_id in enumerate(country_ids):
+        inputs = world[country_id]
+        if inputs['population'] is not None:
+            population[i] = inputs['population']
+        if inputs['education_science']:
+            education[i], science[i] = inputs['education_science']
+        for layer, value in inputs['social_layers'].items():
+            j = layer_index[layer]
+            percentage[i, j] = value
+            # Ставки и заработок нужны только для слоёв, которые есть у страны
+            if layer in inputs['tax_settings']:
+                tax_rate[i, j] = inputs['tax_settings'][layer]
+            if layer in inputs['income_settings']:
+                avg_income[i, j] = inputs['income_settings'][layer]
+
+    return {
+        'country_ids': country_ids,
+        'layers': layers,
+        'population': population,
+        'percentage': percentage,
+        'tax_rate': tax_rate,
+        'avg_income': avg_income,
+        'education': education,
+        'science': science
+    }
+
+def compute_tax(inputs):
+    """Налоговые доходы: население_слоя × средний_заработок × (ставка / 100)
+
+    Слой учитывается, только если для него заданы процент, ставка и заработок.
+
+    Returns:
+        dict: tax_income (по странам), layer_tax и layer_population (страна × слой),
+              taxed (маска учтённых слоёв)
+    """
+    population = np.nan_to_num(inputs['population'], nan=0.0) * 1_000_000
+    layer_population = population[:, None] * (inputs['percentage'] / 100.0)
+    layer_tax = layer_population * inputs['avg_income'] * (inputs['tax_rate'] / 100.0)
+
+    taxed = ~np.isnan(layer_tax)
+    for j, layer in enumerate(inputs['layers']):
+        if layer == TAX_EXEMPT_LAYER:
+            taxed[:, j] = False
+    layer_tax = np.where(taxed, layer_tax, 0.0)
+
+    # Суммируем по столбцам последовательно: одна векторная операция на слой для всех
+    # стран и тот же порядок сложения, что и в построчном расчёте
+    tax_income = np.zeros(len(population))
+    for j in range(layer_tax.shape[1]):
+        tax_income += layer_tax[:, j]
+
+    return {
+        'tax_income': tax_income,
+        'layer_tax': layer_tax,
+        'layer_population': layer_population,
+        'taxed': taxed
+    }
+
+def compute_research(inputs):
+    """Прирост очков исследований: (P × E × 4) + (S × 35), округлённый до целого
+
+    Начисляется только странам, у которых есть и статистика населения,
+    и параметры образования/науки; остальным - 0.
+    """
+    gain = (inputs['population'] * inputs['education'] * 4) + (inputs['science'] * 35)
+    eligible = ~np.isnan(inputs['population']) & ~np.isnan(inputs['education'])
+    return np.where(eligible, np.round(np.where(eligible, gain, 0.0)), 0).astype(np.int64)
+
+def compute_maintenance(building_country_index, maintenance_gold, currency_rates):
+    """Содержание зданий в валюте страны
+
+    Стоимость каждого здания конвертируется по курсу страны и округляется до
+    десятков вверх, затем суммируется по странам.
+
+    Args:
+        building_country_index: Индекс страны для каждого здания
+        maintenance_gold: Содержание каждого здания в золоте
+        currency_rates: Курс основной валюты для каждой страны
+
+    Returns:
+        (maintenance, buildings_count): массивы по странам
+    """
+    building_country_index = np.asarray(building_country_index, dtype=np.int64)
+    currency_rates = np.asarray(currency_rates, dtype=float)
+    n_countries = len(currency_rates)
+
+    cost = np.asarray(maintenance_gold, dtype=float) * currency_rates[building_country_index]
+    cost = np.ceil(cost / 10) * 10
+
+    maintenance = np.bincount(building_country_index, weights=cost, minlength=n_countries)
+    buildings_count = np.bincount(building_country_index, minlength=n_countries)
+    return maintenance, buildings_count
+
+def compute_production(base_maintenance, batch_size, price, efficiency):
+    """Выпуск снаряжения за ход для каждого производящего здания
+
+    Мощность здания считается по базовому содержанию: стоимость единицы партии
+    (содержание / размер партии) должна покрывать цену снаряжения. Выпуск равен
+    партии × (стоимость единицы / цена) × эффективность финансирования и
+    округляется вниз; меньше одной единицы - ничего.
+
+    Args:
+        base_maintenance: Базовое содержание здания в золоте
+        batch_size: Размер партии снаряжения
+        price: Цена единицы снаряжения
+        efficiency: Эффективность производства в процентах (см. calculate_funding_efficiency)
+
+    Returns:
+        Массив int64 с числом произведённых единиц
+    """
+    base_maintenance = np.asarray(base_maintenance, dtype=float)
+    batch_size = np.asarray(batch_size, dtype=float)
+    price = np.asarray(price, dtype=float)
+    efficiency = np.asarray(efficiency, dtype=float)
+
+    safe_batch = np.where(batch_size > 0, batch_size, 1.0)
+    safe_price = np.where(price > 0, price, 1.0)
+    cost_per_unit = np.where(batch_size > 0, base_maintenance / safe_batch, 0.0)
+    can_produce = (batch_size > 0) & (price > 0) & (cost_per_unit >= price)
+
+    produced = batch_size * (cost_per_unit / safe_price) * (efficiency / 100)
+    return np.where(can_produce & (produced >= 1), np.floor(produced), 0).astype(np.int64)
+
+def tax_breakdown(inputs, tax, i):
+    """Разбивка налогов по слоям для страны с индексом i"""
+    breakdown = {}
+    for j, layer in enumerate(inputs['layers']):
+        if not tax['taxed'][i, j]:
+            continue
+        breakdown[layer] = {
+            'population': round(float(tax['layer_population'][i, j]), 2),
+            'tax_rate': float(inputs['tax_rate'][i, j]),
+            'avg_income': float(inputs['avg_income'][i, j]),
+            'income': round(float(tax['layer_tax'][i, j]), 2)
+        }
+    return breakdown
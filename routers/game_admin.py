@@ -1,35 +1,16 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import JSONResponse
 import sqlite3
-import sys
-sys.path.append('..')
+from routers import auth, background_migrations, backup, database, game_clock, maintenance, passwords, turn_engine, turn_jobs, turn_snapshots, worlds
 
 router = APIRouter(prefix="/api/admin/game")
 
 def get_db():
-    conn = sqlite3.connect('users.db')
+    conn = database.connect()
     conn.row_factory = sqlite3.Row
     return conn
 
-async def get_current_user(request: Request):
-    """Получение текущего пользователя из токена"""
-    from main import get_current_user as main_get_current_user
-    return await main_get_current_user(request)
-
-async def check_admin(request: Request):
-    """Проверка прав администратора"""
-    user = await get_current_user(request)
-    if not user or user.get('role') != 'admin':
-        return None
-    return user
-
-@router.get("/countries/research-points")
-async def get_all_research_points(request: Request):
-    """Получение списка всех стран с их очками исследований (только для админа)"""
-    admin = await check_admin(request)
-    if not admin:
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
+def _get_all_research_points():
     conn = get_db()
     cursor = conn.cursor()
     
@@ -68,19 +49,12 @@ async def get_all_research_points(request: Request):
     finally:
         conn.close()
 
-@router.post("/countries/{country_id}/research-points")
-async def update_research_points(country_id: str, request: Request):
-    """Обновление количества очков исследований для страны (только для админа)"""
-    admin = await check_admin(request)
-    if not admin:
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
-    data = await request.json()
-    new_points = data.get('research_points')
-    
-    if new_points is None or new_points < 0:
-        return JSONResponse({'success': False, 'error': 'Некорректное значение очков исследований'}, status_code=400)
-    
+@router.get("/countries/research-points")
+async def get_all_research_points(admin=Depends(auth.require_admin)):
+    """Получение списка всех стран с их очками исследований (только для админа)"""
+    return await database.run(_get_all_research_points)
+
+def _update_research_points(country_id, new_points):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -108,192 +82,218 @@ async def update_research_points(country_id: str, request: Request):
     finally:
         conn.close()
 
+@router.post("/countries/{country_id}/research-points")
+async def update_research_points(country_id: str, request: Request, admin=Depends(auth.require_admin)):
+    """Обновление количества очков исследований для страны (только для админа)"""
+    data = await request.json()
+    new_points = data.get('research_points')
+    
+    if new_points is None or new_points < 0:
+        return JSONResponse({'success': False, 'error': 'Некорректное значение очков исследований'}, status_code=400)
+    
+    return await database.run(_update_research_points, country_id, new_points)
+
 @router.post("/next-turn")
-async def next_turn(request: Request):
-    """Переход к следующему ходу (только для админа)"""
-    admin = await check_admin(request)
-    if not admin:
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
+async def next_turn(workers: int = None, admin=Depends(auth.require_admin)):
+    """Запуск перехода к следующему ходу в фоне (только для админа)
+    
+    workers - число процессов для шардированного расчёта (по умолчанию TURN_ENGINE_WORKERS)
+    """
+    try:
+        job_id, error = await database.run(turn_jobs.start_turn_job, admin['username'], workers)
+        
+        if error:
+            return JSONResponse({'success': False, 'error': error}, status_code=409)
+        
+        return JSONResponse({
+            'success': True,
+            'job_id': job_id,
+            'job': await database.run(turn_jobs.get_job, job_id),
+            'message': 'Обработка хода запущена'
+        }, status_code=202)
     
+    except Exception as e:
+        print(f"Error starting turn job: {e}")
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+def build_turn_preview(workers=None):
+    """Пробный расчёт следующего хода для всех стран (выполняется вне event loop)"""
     conn = get_db()
     cursor = conn.cursor()
     
     try:
-        from datetime import datetime
-        import json
-        
         cursor.execute('SELECT current_turn FROM game_state WHERE id = 1')
         state = cursor.fetchone()
-        
         if not state:
-            return JSONResponse({'success': False, 'error': 'Состояние игры не найдено'}, status_code=404)
+            return None
         
-        current_turn = state['current_turn']
-        new_turn = current_turn + 1
+        results = turn_engine.preview_turn(cursor, turn_jobs.resolve_workers(workers))
         
-        # Обрабатываем экономику для всех стран
-        cursor.execute('SELECT id FROM countries')
-        countries = cursor.fetchall()
+        countries = []
+        totals = {'income': 0.0, 'expenses': 0.0, 'net_change': 0.0, 'research_gain': 0}
+        for country_id, result in results.items():
+            net_change = result['income'] - result['expenses']
+            countries.append({
+                'country_id': country_id,
+                'country_name': result['country_name'],
+                'currency': result['main_currency'],
+                'balance': round(result['balance_start'], 2),
+                'income': round(result['income'], 2),
+                'expenses': round(result['expenses'], 2),
+                'net_change': round(net_change, 2),
+                'balance_after': round(result['balance_end'], 2),
+                'research_gain': result['research_gain'],
+                'production': result['production']
+            })
+            totals['income'] += result['income']
+            totals['expenses'] += result['expenses']
+            totals['net_change'] += net_change
+            totals['research_gain'] += result['research_gain']
         
-        for country in countries:
-            country_id = country['id']
-            
-            # Получаем основную валюту
-            cursor.execute('SELECT main_currency FROM countries WHERE id = ?', (country_id,))
-            country_data = cursor.fetchone()
-            main_currency = country_data['main_currency']
-            
-            # Получаем текущий баланс из country_currencies
-            cursor.execute(
-                'SELECT amount FROM country_currencies WHERE country_id = ? AND currency_code = ?',
-                (country_id, main_currency)
-            )
-            balance_row = cursor.fetchone()
-            balance_start = float(balance_row['amount']) if balance_row else 0.0
-            
-            # Получаем статистику населения (в миллионах: 0.77 = 770 тыс., 41.23 = 41.23 млн)
-            cursor.execute('SELECT population FROM country_stats WHERE country_id = ?', (country_id,))
-            stats = cursor.fetchone()
-            population = (stats['population'] * 1_000_000) if stats else 0.0
-            
-            # Получаем социальные слои
-            cursor.execute(
-                'SELECT layer_name, percentage FROM country_social_layers WHERE country_id = ?',
-                (country_id,)
-            )
-            social_layers = {}
-            for row in cursor.fetchall():
-                social_layers[row['layer_name']] = row['percentage']
-            
-            # Получаем настройки налогов
-            cursor.execute(
-                'SELECT social_layer, tax_rate FROM country_tax_settings WHERE country_id = ?',
-                (country_id,)
-            )
-            tax_settings = {}
-            for row in cursor.fetchall():
-                tax_settings[row['social_layer']] = row['tax_rate']
-            
-            # Получаем настройки среднего заработка
-            cursor.execute(
-                'SELECT social_layer, avg_income FROM country_income_settings WHERE country_id = ?',
-                (country_id,)
-            )
-            income_settings = {}
-            for row in cursor.fetchall():
-                income_settings[row['social_layer']] = row['avg_income']
-            
-            # Расчет налоговых доходов
-            tax_income = 0.0
-            
-            for layer_name, percentage in social_layers.items():
-                if layer_name == 'Маргиналы':
-                    continue
-                
-                # Рассчитываем количество людей в этом слое
-                layer_population = population * (percentage / 100.0)
-                
-                # Получаем ставку налога для этого слоя (если не задана, пропускаем)
-                tax_rate = tax_settings.get(layer_name)
-                if tax_rate is None:
-                    continue
-                
-                # Получаем средний заработок для этого слоя (если не задан, пропускаем)
-                base_income = income_settings.get(layer_name)
-                if base_income is None:
-                    continue
-                
-                # Налог = население_слоя × средний_заработок × (налоговая_ставка / 100)
-                # Например: 500,000 чел × 100 монет × 10% = 5,000,000 монет
-                layer_tax = layer_population * base_income * (tax_rate / 100.0)
-                tax_income += layer_tax
-            
-            # Расходы пока не учитываются
-            total_expenses = 0.0
-            
-            total_income = tax_income
-            balance_end = balance_start + total_income - total_expenses
-            
-            # Обновляем баланс в country_currencies
-            now_update = datetime.now().isoformat()
-            cursor.execute(
-                '''INSERT INTO country_currencies (country_id, currency_code, amount, created_at, updated_at)
-                   VALUES (?, ?, ?, ?, ?)
-                   ON CONFLICT(country_id, currency_code) 
-                   DO UPDATE SET amount = ?, updated_at = ?''',
-                (country_id, main_currency, balance_end, now_update, now_update, balance_end, now_update)
-            )
-            
-            # Сохраняем историю
-            now = datetime.now().isoformat()
-            cursor.execute(
-                '''INSERT INTO economy_history 
-                   (country_id, turn_number, balance_start, balance_end, income, expenses, 
-                    tax_income, tax_settings, created_at)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                   ON CONFLICT(country_id, turn_number) 
-                   DO UPDATE SET balance_end = ?, income = ?, expenses = ?, tax_income = ?''',
-                (country_id, current_turn, balance_start, balance_end, total_income, 
-                 total_expenses, tax_income, json.dumps(tax_settings), now,
-                 balance_end, total_income, total_expenses, tax_income)
-            )
-            
-            # Начисление очков исследований (ОИ) на основе образования и науки
-            cursor.execute(
-                'SELECT education_level, science_level FROM country_education_science WHERE country_id = ?',
-                (country_id,)
-            )
-            edu_sci = cursor.fetchone()
-            
-            if edu_sci and stats:
-                education = edu_sci['education_level']  # E (0-100)
-                science = edu_sci['science_level']  # S (0-100)
-                population_millions = stats['population']  # P (в миллионах)
-                
-                # Формула: (P × E × 4) + (S × 35)
-                research_gain = (population_millions * education * 4) + (science * 35)
-                research_gain = int(round(research_gain))
-                
-                if research_gain > 0:
-                    cursor.execute(
-                        'UPDATE countries SET research_points = research_points + ? WHERE id = ?',
-                        (research_gain, country_id)
-                    )
+        countries.sort(key=lambda c: c['country_name'] or '')
         
-        # Обновляем номер хода
-        now = datetime.now().isoformat()
-        cursor.execute(
-            'UPDATE game_state SET current_turn = ?, updated_at = ? WHERE id = 1',
-            (new_turn, now)
-        )
-        conn.commit()
+        return {
+            'current_turn': state['current_turn'],
+            'next_turn': state['current_turn'] + 1,
+            'countries': countries,
+            'totals': {key: round(value, 2) for key, value in totals.items()}
+        }
+    finally:
+        conn.close()
+
+@router.get("/next-turn/preview")
+async def preview_next_turn(workers: int = None, admin=Depends(auth.require_admin)):
+    """Прогноз изменений всех стран за следующий ход без сохранения (только для админа)"""
+    try:
+        preview = await database.run(build_turn_preview, workers)
         
+        if preview is None:
+            return JSONResponse({'success': False, 'error': 'Состояние игры не найдено'}, status_code=404)
+        
+        return JSONResponse({'success': True, **preview})
+    
+    except Exception as e:
+        print(f"Error previewing turn: {e}")
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+@router.get("/turn-jobs/{job_id}")
+async def get_turn_job(job_id: str, admin=Depends(auth.require_admin)):
+    """Прогресс фоновой обработки хода (только для админа)"""
+    job = await database.run(turn_jobs.get_job, job_id)
+    if not job:
+        return JSONResponse({'success': False, 'error': 'Задача не найдена'}, status_code=404)
+    
+    return JSONResponse({'success': True, 'job': job})
+
+@router.get("/snapshots")
+async def get_turn_snapshots(admin=Depends(auth.require_admin)):
+    """Список снимков игрового состояния перед ходами (только для админа)"""
+    try:
+        snapshots = await database.run(turn_snapshots.list_snapshots)
         return JSONResponse({
             'success': True,
-            'current_turn': new_turn,
-            'message': f'Ход успешно изменён на {new_turn}. Экономика всех стран пересчитана.'
+            'snapshots': snapshots,
+            'retention': turn_snapshots.TURN_SNAPSHOT_RETENTION
         })
-    
+
     except Exception as e:
-        print(f"Error advancing turn: {e}")
-        conn.rollback()
+        print(f"Error listing snapshots: {e}")
         return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
-    finally:
-        conn.close()
 
-@router.post("/set-turn")
-async def set_turn(request: Request):
-    """Установить конкретный ход (только для админа)"""
-    admin = await check_admin(request)
-    if not admin:
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
+@router.post("/snapshots/{turn_number}/restore")
+async def restore_turn_snapshot(turn_number: int, admin=Depends(auth.require_admin)):
+    """Откат игровых таблиц к состоянию перед ходом turn_number (только для админа)"""
+    try:
+        snapshots = await database.run(turn_snapshots.list_snapshots)
+        if not any(s['turn'] == turn_number for s in snapshots):
+            return JSONResponse({'success': False, 'error': 'Снимок для этого хода не найден'}, status_code=404)
+
+        restored_turn, error = await database.run(turn_snapshots.restore_snapshot, turn_number)
+
+        if error:
+            return JSONResponse({'success': False, 'error': error}, status_code=409)
+
+        return JSONResponse({
+            'success': True,
+            'current_turn': restored_turn,
+            'message': f'Игра откачена к началу хода {restored_turn}'
+        })
+
+    except Exception as e:
+        print(f"Error restoring snapshot: {e}")
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+@router.get("/maintenance")
+async def get_maintenance_stats(admin=Depends(auth.require_admin)):
+    """Последнее обслуживание БД, страницы и свободные страницы файла (только для админа)"""
+    try:
+        stats = await database.run(maintenance.stats)
+        return JSONResponse({'success': True, 'maintenance': stats})
+
+    except Exception as e:
+        print(f"Error getting maintenance stats: {e}")
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+@router.post("/maintenance/run")
+async def run_maintenance_now(admin=Depends(auth.require_admin)):
+    """Обслуживание БД вне расписания (только для админа)"""
+    try:
+        result = await database.run(maintenance.run_maintenance)
+        return JSONResponse({'success': True, 'result': result})
+
+    except Exception as e:
+        print(f"Error running maintenance: {e}")
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+@router.get("/passwords")
+async def get_password_pool_stats(admin=Depends(auth.require_admin)):
+    """Очередь и время bcrypt в пуле паролей (только для админа)"""
+    return JSONResponse({'success': True, 'passwords': passwords.stats()})
+
+@router.get("/background-migrations")
+async def get_background_migrations_status(admin=Depends(auth.require_admin)):
+    """Ход фоновых миграций учётных записей после старта (только для админа)"""
+    return JSONResponse({'success': True, 'migrations': background_migrations.status()})
+
+@router.get("/backups")
+async def get_backups(admin=Depends(auth.require_admin)):
+    """Список резервных копий БД и отчёт о последней (только для админа)"""
+    try:
+        status = await database.run(backup.status)
+        return JSONResponse({'success': True, **status})
+
+    except Exception as e:
+        print(f"Error listing backups: {e}")
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+@router.post("/backups")
+async def create_backup(admin=Depends(auth.require_admin)):
+    """Горячая резервная копия БД (только для админа)"""
+    try:
+        report = await database.run(backup.create_backup)
+        return JSONResponse({'success': True, 'backup': report})
+
+    except backup.BackupInProgress as e:
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=409)
+    except Exception as e:
+        print(f"Error creating backup: {e}")
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+@router.post("/worlds")
+async def create_world(request: Request, admin=Depends(auth.require_admin)):
+    """Создание нового мира (кампании) со своим файлом БД (только для админа)"""
     data = await request.json()
-    turn_number = data.get('turn')
-    
-    if turn_number is None or turn_number < 1:
-        return JSONResponse({'success': False, 'error': 'Некорректный номер хода'}, status_code=400)
-    
+    try:
+        world, error = await database.run(worlds.create_world, data.get('id'), data.get('name'))
+        if error:
+            return JSONResponse({'success': False, 'error': error}, status_code=400)
+        return JSONResponse({'success': True, 'world': world})
+
+    except Exception as e:
+        print(f"Error creating world: {e}")
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+def _set_turn(turn_number):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -302,9 +302,11 @@ async def set_turn(request: Request):
         now = datetime.now().isoformat()
         
         cursor.execute(
-            'UPDATE game_state SET current_turn = ?, updated_at = ? WHERE id = 1',
+            'UPDATE game_state SET current_turn = ?, updated_at = ? WHERE id = 1 AND turn_processing = 0',
             (turn_number, now)
         )
+        if cursor.rowcount == 0:
+            return JSONResponse({'success': False, 'error': 'Ход сейчас обрабатывается'}, status_code=409)
         conn.commit()
         
         return JSONResponse({
@@ -320,32 +322,40 @@ async def set_turn(request: Request):
     finally:
         conn.close()
 
-@router.post("/toggle-pause")
-async def toggle_pause(request: Request):
-    """Приостановить/возобновить игру (только для админа)"""
-    admin = await check_admin(request)
-    if not admin:
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
+@router.post("/set-turn")
+async def set_turn(request: Request, admin=Depends(auth.require_admin)):
+    """Установить конкретный ход (только для админа)"""
+    data = await request.json()
+    turn_number = data.get('turn')
+    
+    if turn_number is None or turn_number < 1:
+        return JSONResponse({'success': False, 'error': 'Некорректный номер хода'}, status_code=400)
     
+    return await database.run(_set_turn, turn_number)
+
+def _toggle_pause():
     conn = get_db()
     cursor = conn.cursor()
     
     try:
         from datetime import datetime
         
-        cursor.execute('SELECT is_paused FROM game_state WHERE id = 1')
+        cursor.execute('SELECT is_paused, auto_turn_interval FROM game_state WHERE id = 1')
         state = cursor.fetchone()
         
         if not state:
             return JSONResponse({'success': False, 'error': 'Состояние игры не найдено'}, status_code=404)
         
         new_paused = 0 if state['is_paused'] else 1
-        now = datetime.now().isoformat()
+        now = datetime.now()
         
         cursor.execute(
             'UPDATE game_state SET is_paused = ?, updated_at = ? WHERE id = 1',
-            (new_paused, now)
+            (new_paused, now.isoformat())
         )
+        # После паузы автоматический ход отсчитывается заново, без мгновенного срабатывания
+        if not new_paused and state['auto_turn_interval']:
+            game_clock.schedule_next_turn(cursor, state['auto_turn_interval'], now)
         conn.commit()
         
         return JSONResponse({
@@ -359,4 +369,42 @@ async def toggle_pause(request: Request):
         conn.rollback()
         return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+@router.post("/toggle-pause")
+async def toggle_pause(admin=Depends(auth.require_admin)):
+    """Приостановить/возобновить игру (только для админа)"""
+    return await database.run(_toggle_pause)
+
+def _set_auto_turn(interval):
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    try:
+        next_turn_at = game_clock.schedule_next_turn(cursor, interval)
+        conn.commit()
+        
+        return JSONResponse({
+            'success': True,
+            'auto_turn_interval': interval,
+            'next_turn_at': next_turn_at,
+            'message': f'Автоматический ход каждые {interval} с' if interval else 'Автоматические ходы выключены'
+        })
+    
+    except Exception as e:
+        print(f"Error setting auto turn: {e}")
+        conn.rollback()
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+    finally:
+        conn.close()
+
+@router.post("/auto-turn")
+async def set_auto_turn(request: Request, admin=Depends(auth.require_admin)):
+    """Интервал автоматических ходов в секундах, 0 - выключить (только для админа)"""
+    data = await request.json()
+    interval = data.get('interval_seconds')
+    
+    if not isinstance(interval, int) or isinstance(interval, bool) or interval < 0:
+        return JSONResponse({'success': False, 'error': 'Некорректный интервал'}, status_code=400)
+    
+    return await database.run(_set_auto_turn, interval)
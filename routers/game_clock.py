@@ -0,0 +1,127 @@
+"""Игровые часы: автоматический переход хода по расписанию.
+
+Задача asyncio, запускаемая при старте приложения, раз в GAME_CLOCK_POLL_SECONDS
+проверяет game_state.next_turn_at и, если игра не на паузе и время пришло,
+запускает ту же фоновую задачу хода, что и кнопка администратора.
+
+Время следующего хода хранится в БД, поэтому расписание переживает перезапуск.
+У каждого мира своё расписание: часы проверяют все миры по очереди.
+Проверка и захват хода выполняются в одной транзакции BEGIN IMMEDIATE: при
+нескольких процессах uvicorn ход запустит ровно один из них.
+"""
+import asyncio
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from routers import database, turn_jobs, worlds
+
+# Как часто часы проверяют расписание
+GAME_CLOCK_POLL_SECONDS = float(os.getenv('GAME_CLOCK_POLL_SECONDS', '5'))
+
+# 0 - часы в этом процессе не запускаются (например, для отдельных воркеров)
+GAME_CLOCK_ENABLED = os.getenv('GAME_CLOCK_ENABLED', '1') != '0'
+
+_clock_task = None
+
+def get_db():
+    return database.get_db()
+
+def schedule_next_turn(cursor, interval_seconds, now=None):
+    """Назначает следующий автоматический ход через interval_seconds (0 - выключить)"""
+    now = now or datetime.now()
+    next_turn_at = (now + timedelta(seconds=interval_seconds)).isoformat() if interval_seconds else None
+    cursor.execute(
+        'UPDATE game_state SET auto_turn_interval = ?, next_turn_at = ? WHERE id = 1',
+        (interval_seconds, next_turn_at)
+    )
+    return next_turn_at
+
+def tick(now=None):
+    """Одна проверка расписания
+
+    Returns:
+        id запущенной задачи хода или None
+    """
+    now = now or datetime.now()
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT current_turn, is_paused, auto_turn_interval, next_turn_at
+            FROM game_state WHERE id = 1
+        ''')
+        state = cursor.fetchone()
+        if not state or not state['auto_turn_interval'] or state['is_paused']:
+            conn.rollback()
+            return None
+
+        interval = timedelta(seconds=state['auto_turn_interval'])
+        if not state['next_turn_at']:
+            schedule_next_turn(cursor, state['auto_turn_interval'], now)
+            conn.commit()
+            return None
+
+        due = datetime.fromisoformat(state['next_turn_at'])
+        if now < due:
+            conn.rollback()
+            return None
+
+        # Пропущенные за время простоя ходы не догоняются: один ход и новый интервал
+        next_due = due + interval
+        if next_due <= now:
+            next_due = now + interval
+
+        # Занятый ход пропускаем; брошенный захват claim_turn_processing перехватит
+        job_id = turn_jobs.new_job_id()
+        if not turn_jobs.claim_turn_processing(cursor, job_id):
+            conn.rollback()
+            return None
+        cursor.execute('UPDATE game_state SET next_turn_at = ? WHERE id = 1', (next_due.isoformat(),))
+        conn.commit()
+        current_turn = state['current_turn']
+    except sqlite3.OperationalError as e:
+        # БД занята другим процессом - проверим на следующем такте
+        print(f"Game clock tick skipped: {e}")
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+    print(f"Автоматический ход {current_turn} → {current_turn + 1}")
+    return turn_jobs.launch_turn_job(job_id, current_turn, started_by='game_clock')
+
+async def run_clock():
+    """Цикл часов; работа с БД выполняется в пуле потоков БД"""
+    while True:
+        try:
+            world_ids = await database.run(worlds.world_ids)
+        except Exception as e:
+            print(f"Error listing worlds for game clock: {e}")
+            world_ids = [database.DEFAULT_WORLD]
+        for world_id in world_ids:
+            try:
+                with database.use_world(world_id):
+                    await database.run(tick)
+            except Exception as e:
+                print(f"Error in game clock [{world_id}]: {e}")
+        await asyncio.sleep(GAME_CLOCK_POLL_SECONDS)
+
+def start():
+    """Запуск часов в текущем event loop (вызывается при старте приложения)"""
+    global _clock_task
+    if not GAME_CLOCK_ENABLED or _clock_task is not None:
+        return
+    _clock_task = asyncio.get_running_loop().create_task(run_clock())
+
+async def stop():
+    global _clock_task
+    if _clock_task is None:
+        return
+    _clock_task.cancel()
+    try:
+        await _clock_task
+    except asyncio.CancelledError:
+        pass
+    _clock_task = None
@@ -1,21 +1,18 @@
-from fastapi import APIRouter, Request, HTTPException
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import JSONResponse
 import sqlite3
-import sys
-sys.path.append('..')
+
+from routers import auth, database
 
 router = APIRouter(prefix="/api/game")
 
 def get_db():
-    conn = sqlite3.connect('users.db')
+    conn = database.connect()
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_game_state():
-    """Инициализация таблицы глобального состояния игры"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
+def init_game_state(cursor):
+    """Инициализация таблицы глобального состояния игры (миграция, см. routers/migrations.py)"""
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS game_state (
             id INTEGER PRIMARY KEY CHECK (id = 1),
@@ -26,6 +23,16 @@ def init_game_state():
         )
     ''')
     
+    cursor.execute("PRAGMA table_info(game_state)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'turn_processing' not in columns:
+        cursor.execute('ALTER TABLE game_state ADD COLUMN turn_processing INTEGER DEFAULT 0')
+    # Автоматические ходы: интервал в секундах (0 - выключены) и время следующего хода
+    if 'auto_turn_interval' not in columns:
+        cursor.execute('ALTER TABLE game_state ADD COLUMN auto_turn_interval INTEGER DEFAULT 0')
+    if 'next_turn_at' not in columns:
+        cursor.execute('ALTER TABLE game_state ADD COLUMN next_turn_at TEXT')
+    
     cursor.execute('SELECT id FROM game_state WHERE id = 1')
     if not cursor.fetchone():
         from datetime import datetime
@@ -34,24 +41,8 @@ def init_game_state():
             INSERT INTO game_state (id, current_turn, game_date, is_paused, updated_at)
             VALUES (1, 1, '1 января 1516 г.', 0, ?)
         ''', (now,))
-        conn.commit()
-    
-    conn.close()
-
-init_game_state()
-
-async def get_current_user(request: Request):
-    """Получение текущего пользователя из токена"""
-    from main import get_current_user as main_get_current_user
-    return await main_get_current_user(request)
 
-@router.get("/research-points/{country_id}")
-async def get_research_points(country_id: str, request: Request):
-    """Получение количества очков исследований для страны"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
+def _get_research_points(country_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -62,10 +53,6 @@ async def get_research_points(country_id: str, request: Request):
         if not country:
             return JSONResponse({'success': False, 'error': 'Страна не найдена'}, status_code=404)
         
-        if user['role'] not in ['admin', 'moderator']:
-            if country['player_id'] != user['id']:
-                return JSONResponse({'success': False, 'error': 'Доступ запрещён'}, status_code=403)
-        
         return JSONResponse({
             'success': True,
             'research_points': country['research_points']
@@ -77,20 +64,12 @@ async def get_research_points(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.post("/research-points/deduct")
-async def deduct_research_points(request: Request):
-    """Списание очков исследований при изучении технологии"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
-    data = await request.json()
-    country_id = data.get('country_id')
-    cost = data.get('cost', 0)
-    
-    if not country_id or cost <= 0:
-        return JSONResponse({'success': False, 'error': 'Некорректные данные'}, status_code=400)
-    
+@router.get("/research-points/{country_id}")
+async def get_research_points(country_id: str, user=Depends(auth.country_owner_or_admin)):
+    """Получение количества очков исследований для страны"""
+    return await database.run(_get_research_points, country_id)
+
+def _deduct_research_points(user, country_id, cost):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -132,16 +111,27 @@ async def deduct_research_points(request: Request):
     finally:
         conn.close()
 
+@router.post("/research-points/deduct")
+async def deduct_research_points(request: Request, user=Depends(auth.require_user)):
+    """Списание очков исследований при изучении технологии"""
+    data = await request.json()
+    country_id = data.get('country_id')
+    cost = data.get('cost', 0)
+    
+    if not country_id or cost <= 0:
+        return JSONResponse({'success': False, 'error': 'Некорректные данные'}, status_code=400)
+    
+    return await database.run(_deduct_research_points, user, country_id, cost)
+
 @router.get("/turn")
 async def get_game_turn():
     """Получение текущего хода игры (доступно всем)"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute('SELECT current_turn, game_date, is_paused FROM game_state WHERE id = 1')
-        state = cursor.fetchone()
-        
+        state = await database.fetch_one('''
+            SELECT current_turn, game_date, is_paused, turn_processing, auto_turn_interval, next_turn_at
+            FROM game_state WHERE id = 1
+        ''')
+
         if not state:
             return JSONResponse({'success': False, 'error': 'Состояние игры не найдено'}, status_code=404)
         
@@ -149,11 +139,12 @@ async def get_game_turn():
             'success': True,
             'current_turn': state['current_turn'],
             'game_date': state['game_date'],
-            'is_paused': bool(state['is_paused'])
+            'is_paused': bool(state['is_paused']),
+            'turn_processing': bool(state['turn_processing']),
+            'auto_turn_interval': state['auto_turn_interval'],
+            'next_turn_at': state['next_turn_at'] if state['auto_turn_interval'] and not state['is_paused'] else None
         })
     
     except Exception as e:
         print(f"Error getting game turn: {e}")
-        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
-    finally:
-        conn.close()
\ No newline at end of file
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
\ No newline at end of file
@@ -0,0 +1,300 @@
+"""Фоновое обслуживание БД: статистика планировщика, incremental vacuum, checkpoint WAL.
+
+Удаление пользователей и стран, снос построек и перезапись религий/культур
+(DELETE + INSERT) оставляют в файле свободные страницы, а у планировщика
+запросов нет статистики по индексам. Задача asyncio раз в
+MAINTENANCE_POLL_SECONDS смотрит, простаивает ли БД, и если с прошлого
+обслуживания прошло MAINTENANCE_INTERVAL секунд, выполняет:
+
+    1. статистику планировщика: PRAGMA optimize (SQLite 3.46+) или ANALYZE с
+       PRAGMA analysis_limit - в старых версиях optimize анализирует только
+       таблицы, к которым обращалось то же соединение;
+    2. PRAGMA incremental_vacuum - возврат не больше MAINTENANCE_VACUUM_PAGES
+       свободных страниц (auto_vacuum = INCREMENTAL включается миграцией);
+    3. PRAGMA wal_checkpoint(MAINTENANCE_CHECKPOINT_MODE) - перенос WAL в
+       основной файл.
+
+БД считается простаивающей, если ни в одном мире не обрабатывается ход и за
+последний опрос из пулов соединений взято не больше MAINTENANCE_IDLE_QUERIES
+соединений.
+
+Обслуживаются файлы всех миров (worlds.world_ids()): users.db с учётными
+таблицами и миром по умолчанию и WORLDS_DIR/<id>.db остальных миров. users.db
+подключают соединения всех миров, поэтому простой считается по пулам всех миров.
+
+Вручную:
+    python -m routers.maintenance            # обслуживание сейчас
+    python -m routers.maintenance --stats    # страницы и свободные страницы по мирам
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from routers import database, worlds
+
+# Как часто проверять, простаивает ли БД
+MAINTENANCE_POLL_SECONDS = float(os.getenv('MAINTENANCE_POLL_SECONDS', '30'))
+
+# Минимальный промежуток между обслуживаниями
+MAINTENANCE_INTERVAL = float(os.getenv('MAINTENANCE_INTERVAL', '600'))
+
+# Сколько соединений за опрос ещё считается простоем
+MAINTENANCE_IDLE_QUERIES = int(os.getenv('MAINTENANCE_IDLE_QUERIES', '20'))
+
+# Свободных страниц за одно обслуживание (0 - все)
+MAINTENANCE_VACUUM_PAGES = int(os.getenv('MAINTENANCE_VACUUM_PAGES', '2000'))
+
+# Строк на индекс, которые просматривает ANALYZE (0 - все)
+MAINTENANCE_ANALYSIS_LIMIT = int(os.getenv('MAINTENANCE_ANALYSIS_LIMIT', '1000'))
+
+MAINTENANCE_CHECKPOINT_MODE = os.getenv('MAINTENANCE_CHECKPOINT_MODE', 'TRUNCATE').upper()
+if MAINTENANCE_CHECKPOINT_MODE not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+    print(f"Неизвестный MAINTENANCE_CHECKPOINT_MODE={MAINTENANCE_CHECKPOINT_MODE}, используется PASSIVE")
+    MAINTENANCE_CHECKPOINT_MODE = 'PASSIVE'
+
+# Сколько ждать читателей при checkpoint, секунд: дольше писатели ждать не должны
+MAINTENANCE_BUSY_TIMEOUT = float(os.getenv('MAINTENANCE_BUSY_TIMEOUT', '1'))
+
+# 0 - обслуживание в этом процессе не запускается (например, для отдельных воркеров)
+MAINTENANCE_ENABLED = os.getenv('MAINTENANCE_ENABLED', '1') != '0'
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+# optimize с флагом 0x10000 проверяет все таблицы, а не только использованные
+OPTIMIZE_ALL_TABLES_VERSION = (3, 46, 0)
+
+_maintenance_task = None
+_maintenance_lock = threading.Lock()
+_state = {'runs': 0, 'skipped_busy': 0, 'last_run': None, 'last_error': None}
+
+def enable_incremental_vacuum(cursor):
+    """Включение auto_vacuum = INCREMENTAL (миграция, см. routers/migrations.py)
+
+    Режим существующей БД меняет только VACUUM, а он не выполняется внутри
+    транзакции миграций - поэтому возвращается шаг после коммита.
+    """
+    cursor.execute('PRAGMA auto_vacuum')
+    if cursor.fetchone()[0] == 2:
+        return None
+    return convert_to_incremental
+
+def convert_to_incremental(conn):
+    """Перевод файла БД на auto_vacuum = INCREMENTAL (полный VACUUM, один раз)"""
+    print('Перевод БД на auto_vacuum = INCREMENTAL (VACUUM)...')
+    started = time.monotonic()
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    print(f'✓ VACUUM выполнен за {time.monotonic() - started:.1f} с')
+
+def db_stats(conn=None, world_id=database.DEFAULT_WORLD):
+    """Размер и заполненность файла мира world_id"""
+    own = conn is None
+    conn = conn or database.open_connection(world_id, with_accounts=False)
+    try:
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        freelist_count = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        analyzed = conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+        ).fetchone()[0] > 0
+    finally:
+        if own:
+            conn.close()
+
+    wal_file = database.world_file(world_id) + '-wal'
+    return {
+        'page_size': page_size,
+        'page_count': page_count,
+        'freelist_count': freelist_count,
+        'free_ratio': round(freelist_count / page_count, 4) if page_count else 0,
+        'db_size_bytes': page_size * page_count,
+        'wal_size_bytes': os.path.getsize(wal_file) if os.path.exists(wal_file) else 0,
+        'auto_vacuum': AUTO_VACUUM_MODES.get(auto_vacuum, str(auto_vacuum)),
+        'analyzed': analyzed
+    }
+
+def _timed(timings, step, fn):
+    started = time.monotonic()
+    result = fn()
+    timings[step] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+def _update_statistics(conn):
+    conn.execute(f'PRAGMA analysis_limit = {MAINTENANCE_ANALYSIS_LIMIT}')
+    if sqlite3.sqlite_version_info >= OPTIMIZE_ALL_TABLES_VERSION:
+        conn.execute('PRAGMA optimize = 0x10002')
+        return 'optimize'
+    conn.execute('ANALYZE')
+    return 'analyze'
+
+def _incremental_vacuum(conn):
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return 0
+    before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if not before:
+        return 0
+    # Прагма освобождает по странице на шаг, а execute() делает только первый
+    # шаг запроса без столбцов; executescript выполняет её до конца
+    conn.executescript(f'PRAGMA incremental_vacuum({MAINTENANCE_VACUUM_PAGES})')
+    return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+def _checkpoint(conn):
+    busy, log_pages, checkpointed = conn.execute(
+        f'PRAGMA wal_checkpoint({MAINTENANCE_CHECKPOINT_MODE})'
+    ).fetchone()
+    return {'mode': MAINTENANCE_CHECKPOINT_MODE, 'busy': bool(busy),
+            'wal_pages': log_pages, 'checkpointed_pages': checkpointed}
+
+def _maintain_world(world_id):
+    """Обслуживание файла одного мира"""
+    conn = database.open_connection(world_id, with_accounts=False)
+    conn.execute(f'PRAGMA busy_timeout = {int(MAINTENANCE_BUSY_TIMEOUT * 1000)}')
+    timings = {}
+    try:
+        before = db_stats(conn, world_id)
+        statistics = _timed(timings, 'statistics_ms', lambda: _update_statistics(conn))
+        freed_pages = _timed(timings, 'vacuum_ms', lambda: _incremental_vacuum(conn))
+        checkpoint = _timed(timings, 'checkpoint_ms', lambda: _checkpoint(conn))
+        after = db_stats(conn, world_id)
+    finally:
+        conn.close()
+
+    return {
+        'total_ms': round(sum(timings.values()), 1),
+        **timings,
+        'statistics': statistics,
+        'freed_pages': freed_pages,
+        'checkpoint': checkpoint,
+        'freelist_before': before['freelist_count'],
+        'freelist_after': after['freelist_count']
+    }
+
+def run_maintenance():
+    """Одно обслуживание файлов всех миров (выполняется вне event loop)
+
+    Ошибка в одном мире не мешает обслужить остальные: она попадает в
+    результат мира и в last_error.
+
+    Returns:
+        dict: по мирам - время шагов в мс, освобождённые страницы, результат checkpoint
+    """
+    with _maintenance_lock:
+        started_at = datetime.now().isoformat()
+        results = {}
+        for world_id in worlds.world_ids():
+            try:
+                results[world_id] = _maintain_world(world_id)
+            except Exception as e:
+                print(f"Error in database maintenance of world {world_id}: {e}")
+                _state['last_error'] = {'at': started_at, 'world': world_id, 'error': str(e)}
+                results[world_id] = {'error': str(e)}
+
+        result = {
+            'started_at': started_at,
+            'finished_at': datetime.now().isoformat(),
+            'total_ms': round(sum(r.get('total_ms', 0) for r in results.values()), 1),
+            'freed_pages': sum(r.get('freed_pages', 0) for r in results.values()),
+            'worlds': results
+        }
+        _state['runs'] += 1
+        _state['last_run'] = result
+        return result
+
+def _turn_processing(world_id):
+    conn = database.open_connection(world_id, with_accounts=False)
+    try:
+        row = conn.execute('SELECT turn_processing FROM game_state WHERE id = 1').fetchone()
+    finally:
+        conn.close()
+    return bool(row and row[0])
+
+def is_idle(queries_since_last_poll):
+    """Простаивает ли БД: ни в одном мире не обрабатывается ход и запросов было мало"""
+    if queries_since_last_poll > MAINTENANCE_IDLE_QUERIES:
+        return False
+    return not any(_turn_processing(world_id) for world_id in worlds.world_ids())
+
+def _pool_acquisitions():
+    return sum(stats['created'] + stats['reused'] for stats in database.all_pool_stats().values())
+
+async def run_scheduler():
+    """Цикл обслуживания; работа с БД выполняется в пуле потоков БД"""
+    last_run = time.monotonic()
+    last_acquisitions = _pool_acquisitions()
+    while True:
+        await asyncio.sleep(MAINTENANCE_POLL_SECONDS)
+        acquisitions = _pool_acquisitions()
+        queries, last_acquisitions = acquisitions - last_acquisitions, acquisitions
+        if time.monotonic() - last_run < MAINTENANCE_INTERVAL:
+            continue
+        try:
+            if not await database.run(is_idle, queries):
+                _state['skipped_busy'] += 1
+                continue
+            await database.run(run_maintenance)
+        except Exception as e:
+            print(f"Error in database maintenance: {e}")
+        last_run = time.monotonic()
+        # Собственные запросы обслуживания не считаются нагрузкой
+        last_acquisitions = _pool_acquisitions()
+
+def all_db_stats():
+    """Статистика файлов всех миров: {мир: db_stats}"""
+    return {world_id: db_stats(world_id=world_id) for world_id in worlds.world_ids()}
+
+def stats():
+    """Состояние обслуживания и статистика файлов миров"""
+    return {
+        'enabled': MAINTENANCE_ENABLED,
+        'running': _maintenance_task is not None,
+        'interval_seconds': MAINTENANCE_INTERVAL,
+        **_state,
+        'worlds': all_db_stats(),
+        'pool': database.all_pool_stats()
+    }
+
+def start():
+    """Запуск обслуживания в текущем event loop (вызывается при старте приложения)"""
+    global _maintenance_task
+    if not MAINTENANCE_ENABLED or _maintenance_task is not None:
+        return
+    _maintenance_task = asyncio.get_running_loop().create_task(run_scheduler())
+
+async def stop():
+    global _maintenance_task
+    if _maintenance_task is None:
+        return
+    _maintenance_task.cancel()
+    try:
+        await _maintenance_task
+    except asyncio.CancelledError:
+        pass
+    _maintenance_task = None
+
+def main():
+    parser = argparse.ArgumentParser(description='Обслуживание БД: статистика, incremental vacuum, checkpoint WAL')
+    parser.add_argument('--stats', action='store_true', help='Показать статистику файла БД и выйти')
+    args = parser.parse_args()
+
+    if not args.stats:
+        result = run_maintenance()
+        for world_id, world in result['worlds'].items():
+            if 'error' in world:
+                print(f"[{world_id}] Ошибка обслуживания: {world['error']}")
+                continue
+            print(f"[{world_id}] Обслуживание за {world['total_ms']} мс: {world['statistics']}, "
+                  f"освобождено страниц {world['freed_pages']}, checkpoint {world['checkpoint']}")
+
+    for world_id, world_stats in all_db_stats().items():
+        print(f'[{world_id}]')
+        for key, value in world_stats.items():
+            print(f'  {key:<16} {value}')
+    database.close_all()
+
+if __name__ == '__main__':
+    main()
@@ -1,44 +1,18 @@
 from fastapi import APIRouter, Request, UploadFile, File
 from fastapi.responses import JSONResponse
 import os
-import sqlite3
 import uuid
 from pathlib import Path
 from datetime import datetime
 
+from routers import auth, database
+
 router = APIRouter(prefix='/api/maps', tags=['maps'])
 
 MAPS_DIR = 'maps'
-DB_FILE = 'users.db'
-
-def decode_jwt(token):
-    import jwt
-    JWT_SECRET = 'supersecretkey'
-    JWT_ALGORITHM = 'HS256'
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
-    except jwt.ExpiredSignatureError:
-        return None
-    except jwt.InvalidTokenError:
-        return None
-
-def get_user_by_username(username):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT username, password, email, country, role, banned, muted, ban_until, mute_until, avatar, id FROM users WHERE username=?', (username,))
-    user = c.fetchone()
-    conn.close()
-    return user
 
-@router.get('/list')
-async def get_maps_list(request: Request):
-    token = request.headers.get('Authorization')
-    payload = decode_jwt(token)
-    if not payload:
-        return JSONResponse({'success': False, 'error': 'Unauthorized'}, status_code=401)
-    
-    conn = sqlite3.connect(DB_FILE)
+def _get_maps_list():
+    conn = database.connect()
     c = conn.cursor()
     c.execute('SELECT id, name, filename, uploaded_by, uploaded_at FROM maps ORDER BY id DESC')
     rows = c.fetchall()
@@ -57,45 +31,26 @@ async def get_maps_list(request: Request):
     
     return JSONResponse({'success': True, 'maps': maps})
 
-@router.post('/upload')
-async def upload_map(request: Request):
+@router.get('/list')
+async def get_maps_list(request: Request):
     token = request.headers.get('Authorization')
-    payload = decode_jwt(token)
+    payload = auth.decode_jwt(token)
     if not payload:
         return JSONResponse({'success': False, 'error': 'Unauthorized'}, status_code=401)
     
-    user = get_user_by_username(payload['username'])
-    if not user or user[4] != 'admin':
-        return JSONResponse({'success': False, 'error': 'Only admins can upload maps'}, status_code=403)
-    
-    form = await request.form()
-    name = form.get('name', '').strip() if form.get('name') else ''
-    file = form.get('file')
-    
-    if not name:
-        return JSONResponse({'success': False, 'error': 'Map name is required'}, status_code=400)
-    
-    if not file:
-        return JSONResponse({'success': False, 'error': 'File is required'}, status_code=400)
-    
-    if not file.content_type.startswith('image/'):
-        return JSONResponse({'success': False, 'error': 'Only image files are allowed'}, status_code=400)
-    
-    file_extension = Path(file.filename).suffix
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(MAPS_DIR, unique_filename)
-    
+    return await database.run(_get_maps_list)
+
+def _upload_map(file_path, content, name, unique_filename, username):
     try:
         with open(file_path, 'wb') as f:
-            content = await file.read()
             f.write(content)
         
         timestamp = datetime.utcnow().isoformat() + 'Z'
-        conn = sqlite3.connect(DB_FILE)
+        conn = database.connect()
         c = conn.cursor()
         c.execute(
             'INSERT INTO maps (name, filename, uploaded_by, uploaded_at) VALUES (?, ?, ?, ?)',
-            (name, unique_filename, user[0], timestamp)
+            (name, unique_filename, username, timestamp)
         )
         conn.commit()
         map_id = c.lastrowid
@@ -107,7 +62,7 @@ async def upload_map(request: Request):
                 'id': map_id,
                 'name': name,
                 'file_url': f'/maps_files/{unique_filename}',
-                'uploaded_by': user[0],
+                'uploaded_by': username,
                 'uploaded_at': timestamp
             }
         })
@@ -116,25 +71,39 @@ async def upload_map(request: Request):
             os.remove(file_path)
         return JSONResponse({'success': False, 'error': f'Upload failed: {str(e)}'}, status_code=500)
 
-@router.post('/edit')
-async def edit_map(request: Request):
+@router.post('/upload')
+async def upload_map(request: Request):
     token = request.headers.get('Authorization')
-    payload = decode_jwt(token)
+    payload = auth.decode_jwt(token)
     if not payload:
         return JSONResponse({'success': False, 'error': 'Unauthorized'}, status_code=401)
     
-    user = get_user_by_username(payload['username'])
-    if not user or user[4] != 'admin':
-        return JSONResponse({'success': False, 'error': 'Only admins can edit maps'}, status_code=403)
+    user = await auth.principal(payload['username'])
+    if not user or user.role != 'admin':
+        return JSONResponse({'success': False, 'error': 'Only admins can upload maps'}, status_code=403)
     
-    data = await request.json()
-    map_id = data.get('id')
-    new_name = data.get('name', '').strip()
+    form = await request.form()
+    name = form.get('name', '').strip() if form.get('name') else ''
+    file = form.get('file')
     
-    if not map_id or not new_name:
-        return JSONResponse({'success': False, 'error': 'Map ID and name are required'}, status_code=400)
+    if not name:
+        return JSONResponse({'success': False, 'error': 'Map name is required'}, status_code=400)
+    
+    if not file:
+        return JSONResponse({'success': False, 'error': 'File is required'}, status_code=400)
+    
+    if not file.content_type.startswith('image/'):
+        return JSONResponse({'success': False, 'error': 'Only image files are allowed'}, status_code=400)
     
-    conn = sqlite3.connect(DB_FILE)
+    file_extension = Path(file.filename).suffix
+    unique_filename = f"{uuid.uuid4()}{file_extension}"
+    file_path = os.path.join(MAPS_DIR, unique_filename)
+    
+    content = await file.read()
+    return await database.run(_upload_map, file_path, content, name, unique_filename, user.username)
+
+def _edit_map(map_id, new_name):
+    conn = database.connect()
     c = conn.cursor()
     
     c.execute('SELECT id FROM maps WHERE id=?', (map_id,))
@@ -148,24 +117,28 @@ async def edit_map(request: Request):
     
     return JSONResponse({'success': True})
 
-@router.post('/delete')
-async def delete_map(request: Request):
+@router.post('/edit')
+async def edit_map(request: Request):
     token = request.headers.get('Authorization')
-    payload = decode_jwt(token)
+    payload = auth.decode_jwt(token)
     if not payload:
         return JSONResponse({'success': False, 'error': 'Unauthorized'}, status_code=401)
     
-    user = get_user_by_username(payload['username'])
-    if not user or user[4] != 'admin':
-        return JSONResponse({'success': False, 'error': 'Only admins can delete maps'}, status_code=403)
+    user = await auth.principal(payload['username'])
+    if not user or user.role != 'admin':
+        return JSONResponse({'success': False, 'error': 'Only admins can edit maps'}, status_code=403)
     
     data = await request.json()
     map_id = data.get('id')
+    new_name = data.get('name', '').strip()
     
-    if not map_id:
-        return JSONResponse({'success': False, 'error': 'Map ID is required'}, status_code=400)
+    if not map_id or not new_name:
+        return JSONResponse({'success': False, 'error': 'Map ID and name are required'}, status_code=400)
     
-    conn = sqlite3.connect(DB_FILE)
+    return await database.run(_edit_map, map_id, new_name)
+
+def _delete_map(map_id):
+    conn = database.connect()
     c = conn.cursor()
     
     c.execute('SELECT filename FROM maps WHERE id=?', (map_id,))
@@ -188,4 +161,23 @@ async def delete_map(request: Request):
     except Exception as e:
         print(f"Failed to delete file {filename}: {e}")
     
-    return JSONResponse({'success': True})
\ No newline at end of file
+    return JSONResponse({'success': True})
+
+@router.post('/delete')
+async def delete_map(request: Request):
+    token = request.headers.get('Authorization')
+    payload = auth.decode_jwt(token)
+    if not payload:
+        return JSONResponse({'success': False, 'error': 'Unauthorized'}, status_code=401)
+    
+    user = await auth.principal(payload['username'])
+    if not user or user.role != 'admin':
+        return JSONResponse({'success': False, 'error': 'Only admins can delete maps'}, status_code=403)
+    
+    data = await request.json()
+    map_id = data.get('id')
+    
+    if not map_id:
+        return JSONResponse({'success': False, 'error': 'Map ID is required'}, status_code=400)
+    
+    return await database.run(_delete_map, map_id)
\ No newline at end of file
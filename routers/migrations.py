@@ -0,0 +1,180 @@
+"""Версионные миграции схемы БД.
+
+Роутеры не обращаются к БД при импорте: таблицы создаются и обновляются здесь,
+один раз при старте приложения (main.startup) или из командной строки:
+    python -m routers.migrations            # применить недостающие миграции
+    python -m routers.migrations --status   # показать применённые версии
+
+Применённые версии записываются в таблицу schema_version. Весь прогон идёт в
+одной транзакции BEGIN IMMEDIATE: другой процесс (второй воркер uvicorn) ждёт
+снятия блокировки, затем видит уже применённые версии и ничего не делает.
+Ошибка в миграции откатывает весь прогон.
+
+Операции, которые нельзя выполнить внутри транзакции (VACUUM), миграция
+возвращает функцией conn -> None: она вызывается после коммита прогона, и
+только после её успеха версия записывается в schema_version. Если шаг упал
+(БД занята, нет места, процесс убит), версия остаётся неприменённой и
+миграция повторяется при следующем запуске - поэтому такие миграции сами
+проверяют, нужен ли ещё шаг.
+
+Первые версии - схемы роутеров в том виде, в каком они раньше создавались при
+импорте. Они идемпотентны (CREATE IF NOT EXISTS, проверки PRAGMA table_info),
+поэтому на существующей БД просто достраивают недостающее. Новое изменение
+схемы добавляется в конец MIGRATIONS новой версией; применённые версии не
+правятся задним числом.
+
+Миры (routers/worlds.py): у каждого файла своя таблица schema_version.
+users.db получает все миграции, файл мира - только миграции с областью
+WORLD (игровые таблицы). Учётные таблицы (ACCOUNTS) живут только в users.db.
+"""
+import argparse
+import importlib
+import os
+import threading
+from datetime import datetime
+
+from routers import database
+
+# Сколько ждать, пока миграции применяет другой процесс, секунд
+MIGRATION_LOCK_TIMEOUT = float(os.getenv('MIGRATION_LOCK_TIMEOUT', '300'))
+
+# Область миграции: только users.db или каждый файл с игровыми таблицами
+ACCOUNTS = 'accounts'
+WORLD = 'world'
+
+# (версия, описание, модуль, функция(cursor) -> None или шаг после коммита, область)
+MIGRATIONS = (
+    (1, 'Пользователи, чат и карты', 'main', 'init_db', ACCOUNTS),
+    (2, 'Состояние игры', 'routers.game_main', 'init_game_state', WORLD),
+    (3, 'Страны и экономика', 'routers.economic', 'init_db', WORLD),
+    (4, 'Статистика стран', 'routers.statistics', 'init_statistics_tables', WORLD),
+    (5, 'Технологии', 'routers.tech', 'init_tech_db', WORLD),
+    (6, 'Провинции и постройки', 'routers.provinces', 'init_db', WORLD),
+    (7, 'Персонажи', 'routers.characters', 'init_characters_db', ACCOUNTS),
+    (8, 'Заявки игроков', 'routers.registration', 'init_db', ACCOUNTS),
+    (9, 'Индексы для архивации', 'routers.archive', 'add_retention_indexes', ACCOUNTS),
+    (10, 'Incremental vacuum', 'routers.maintenance', 'enable_incremental_vacuum', WORLD),
+    (11, 'Реестр миров', 'routers.worlds', 'init_db', ACCOUNTS),
+    (12, 'Индекс архивации истории экономики', 'routers.archive', 'add_economy_history_turn_index', WORLD),
+    (13, 'Владелец захвата хода', 'routers.turn_jobs', 'add_claim_columns', WORLD),
+    (14, 'Заявки игроков по мирам', 'routers.registration', 'add_world_column', ACCOUNTS),
+)
+
+_migrate_lock = threading.Lock()
+
+def ensure_version_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+
+def applied_versions(cursor):
+    """Применённые версии: {версия: время применения}"""
+    cursor.execute('SELECT version, applied_at FROM schema_version')
+    return dict(cursor.fetchall())
+
+def _record_version(cursor, version, name):
+    cursor.execute(
+        'INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+        (version, name, datetime.now().isoformat())
+    )
+
+def _resolve(module_name, function_name):
+    return getattr(importlib.import_module(module_name), function_name)
+
+def _applies(scope, world_id):
+    return world_id == database.DEFAULT_WORLD or scope == WORLD
+
+def migrate(world_id=database.DEFAULT_WORLD):
+    """Применяет недостающие миграции по порядку к файлу мира world_id
+
+    Returns:
+        Список применённых в этот раз версий (пустой, если схема актуальна)
+    """
+    with _migrate_lock:
+        conn = database.open_connection(world_id, with_accounts=False)
+        conn.execute(f'PRAGMA busy_timeout = {int(MIGRATION_LOCK_TIMEOUT * 1000)}')
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            ensure_version_table(cursor)
+            done = applied_versions(cursor)
+
+            applied = []
+            after_commit = []
+            for version, name, module_name, function_name, scope in MIGRATIONS:
+                if version in done or not _applies(scope, world_id):
+                    continue
+                prefix = '' if world_id == database.DEFAULT_WORLD else f'[{world_id}] '
+                print(f'{prefix}Миграция {version}: {name}')
+                step = _resolve(module_name, function_name)(cursor)
+                if callable(step):
+                    after_commit.append((version, name, step))
+                    continue
+                _record_version(cursor, version, name)
+                applied.append(version)
+
+            conn.commit()
+            for version, name, step in after_commit:
+                try:
+                    step(conn)
+                except Exception as e:
+                    print(f'Миграция {version} не завершена, будет повторена при следующем запуске: {e}')
+                    continue
+                _record_version(cursor, version, name)
+                conn.commit()
+                applied.append(version)
+            return applied
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+def migrate_all():
+    """Миграции users.db, затем файлов всех зарегистрированных миров
+
+    Returns:
+        dict: мир -> применённые версии
+    """
+    from routers import worlds
+    applied = {database.DEFAULT_WORLD: migrate()}
+    for world_id in worlds.world_ids():
+        if world_id != database.DEFAULT_WORLD:
+            applied[world_id] = migrate(world_id)
+    return applied
+
+def status(world_id=database.DEFAULT_WORLD):
+    """Состояние миграций файла мира: версия, описание, время применения (None - не применена)"""
+    conn = database.open_connection(world_id, with_accounts=False)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+        done = applied_versions(cursor) if cursor.fetchone() else {}
+    finally:
+        conn.close()
+    return [
+        {'version': version, 'name': name, 'applied_at': done.get(version)}
+        for version, name, _, _, scope in MIGRATIONS
+        if _applies(scope, world_id)
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description='Миграции схемы БД')
+    parser.add_argument('--status', action='store_true', help='Показать применённые версии и выйти')
+    parser.add_argument('--world', default=database.DEFAULT_WORLD, help='Мир для --status')
+    args = parser.parse_args()
+
+    if not args.status:
+        for world_id, applied in migrate_all().items():
+            print(f'[{world_id}] Применено миграций: {len(applied)}' if applied else f'[{world_id}] Схема БД актуальна')
+
+    for migration in status(args.world):
+        mark = migration['applied_at'] or 'не применена'
+        print(f"{migration['version']:>4}  {migration['name']:<36} {mark}")
+
+if __name__ == '__main__':
+    main()
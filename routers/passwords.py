@@ -0,0 +1,153 @@
+"""Хеширование и проверка паролей bcrypt в отдельном пуле потоков.
+
+Один bcrypt - 100-300 мс процессора. Раньше /login, /change-password, /verify
+и /reset вызывали его прямо в обработчике, и на это время вставал весь event
+loop: чат и остальные запросы ждали каждого входа. Теперь hash_async и
+verify_async выполняют bcrypt в пуле из PASSWORD_WORKERS потоков (bcrypt
+отпускает GIL, поэтому потоки работают параллельно и не мешают event loop).
+
+Очередь пула ограничена PASSWORD_QUEUE_LIMIT задачами: при переполнении
+поднимается PasswordQueueFull, и обработчик отвечает 503, а не копит
+запросы. stats() показывает глубину очереди и время ожидания.
+
+Стоимость bcrypt задаёт BCRYPT_ROUNDS. Если хеш пользователя сделан с другой
+стоимостью (или пароль ещё не захеширован), он пересчитывается при следующем
+успешном входе (needs_rehash).
+"""
+import asyncio
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+# Стоимость bcrypt (log2 числа раундов); bcrypt допускает 4-31
+BCRYPT_ROUNDS = min(31, max(4, int(os.getenv('BCRYPT_ROUNDS', '12'))))
+
+# Потоков для bcrypt; больше числа ядер ставить бессмысленно
+PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Сколько задач может ждать и выполняться в пуле одновременно
+PASSWORD_QUEUE_LIMIT = int(os.getenv('PASSWORD_QUEUE_LIMIT', '64'))
+
+BCRYPT_PREFIXES = ('$2b$', '$2a$', '$2y$')
+
+_executor = None
+_lock = threading.Lock()
+_state = {
+    'pending': 0,
+    'running': 0,
+    'max_pending': 0,
+    'completed': 0,
+    'rejected': 0,
+    'rehashed': 0,
+    'wait_ms_total': 0.0,
+    'work_ms_total': 0.0
+}
+
+class PasswordQueueFull(Exception):
+    """Очередь пула bcrypt заполнена"""
+
+def hash_password(password: str) -> str:
+    """Хеширует пароль с помощью bcrypt (синхронно, вне event loop)"""
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Проверяет соответствие пароля хешу (синхронно, вне event loop)
+
+    Пароль, который фоновая миграция ещё не захешировала, сравнивается как
+    есть (см. routers/background_migrations.py).
+    """
+    if not is_hashed(hashed_password):
+        return hmac.compare_digest(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+def is_hashed(password):
+    return password.startswith(BCRYPT_PREFIXES)
+
+def hash_rounds(hashed_password):
+    """Стоимость, с которой сделан хеш ($2b$12$... -> 12), или None"""
+    try:
+        return int(hashed_password.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+def needs_rehash(hashed_password):
+    return not is_hashed(hashed_password) or hash_rounds(hashed_password) != BCRYPT_ROUNDS
+
+def _timed_call(fn, args, queued_at):
+    started = time.monotonic()
+    with _lock:
+        _state['running'] += 1
+        _state['wait_ms_total'] += (started - queued_at) * 1000
+    try:
+        return fn(*args)
+    finally:
+        with _lock:
+            _state['running'] -= 1
+            _state['work_ms_total'] += (time.monotonic() - started) * 1000
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix='bcrypt')
+    return _executor
+
+async def _submit(fn, *args):
+    with _lock:
+        if _state['pending'] >= PASSWORD_QUEUE_LIMIT:
+            _state['rejected'] += 1
+            raise PasswordQueueFull()
+        _state['pending'] += 1
+        _state['max_pending'] = max(_state['max_pending'], _state['pending'])
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), _timed_call, fn, args, time.monotonic())
+    finally:
+        with _lock:
+            _state['pending'] -= 1
+            _state['completed'] += 1
+
+async def hash_async(password):
+    return await _submit(hash_password, password)
+
+async def verify_async(plain_password, hashed_password):
+    return await _submit(verify_password, plain_password, hashed_password)
+
+async def rehash_if_needed(plain_password, hashed_password):
+    """Новый хеш, если стоимость старого отличается от BCRYPT_ROUNDS, иначе None
+
+    Вызывается только после успешной проверки пароля.
+    """
+    if not needs_rehash(hashed_password):
+        return None
+    new_hash = await hash_async(plain_password)
+    with _lock:
+        _state['rehashed'] += 1
+    return new_hash
+
+def stats():
+    """Глубина очереди и время bcrypt"""
+    with _lock:
+        completed = _state['completed']
+        return {
+            'rounds': BCRYPT_ROUNDS,
+            'workers': PASSWORD_WORKERS,
+            'queue_limit': PASSWORD_QUEUE_LIMIT,
+            'queued': _state['pending'] - _state['running'],
+            **_state,
+            'avg_wait_ms': round(_state['wait_ms_total'] / completed, 1) if completed else 0,
+            'avg_work_ms': round(_state['work_ms_total'] / completed, 1) if completed else 0,
+            'wait_ms_total': round(_state['wait_ms_total'], 1),
+            'work_ms_total': round(_state['work_ms_total'], 1)
+        }
+
+def shutdown():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -1,17 +1,16 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import JSONResponse
 import sqlite3
-import sys
 import math
 import json
 from datetime import datetime
 
-sys.path.append('..')
+from routers import auth, database, turn_engine
 
 router = APIRouter(prefix="/api/provinces")
 
 def get_db():
-    conn = sqlite3.connect('users.db')
+    conn = database.connect()
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -168,11 +167,8 @@ BUILDING_TYPES = {
     }
 }
 
-def init_db():
-    """Инициализация таблиц провинций и построек"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
+def init_db(cursor):
+    """Инициализация таблиц провинций и построек (миграция, см. routers/migrations.py)"""
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS provinces (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -204,14 +200,12 @@ def init_db():
     if 'production_type' not in columns:
         print('Добавление поля production_type в таблицу buildings...')
         cursor.execute('ALTER TABLE buildings ADD COLUMN production_type TEXT')
-        conn.commit()
         print('✓ Поле production_type добавлено')
     
     # Миграция: добавляем поле funding_percentage если его нет
     if 'funding_percentage' not in columns:
         print('Добавление поля funding_percentage в таблицу buildings...')
         cursor.execute('ALTER TABLE buildings ADD COLUMN funding_percentage INTEGER DEFAULT 100')
-        conn.commit()
         print('✓ Поле funding_percentage добавлено')
     
     if 'building_type_id' in columns and 'building_type_name' not in columns:
@@ -239,10 +233,9 @@ def init_db():
         cursor.execute('ALTER TABLE buildings_new RENAME TO buildings')
         print('✓ Построки мигрированы на систему без БД типов')
     
-    conn.commit()
-    conn.close()
-
-init_db()
+    # Индексы для выборок провинций страны и построек провинции (в т.ч. JOIN при расчёте хода)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_provinces_country_id ON provinces(country_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_buildings_province_id ON buildings(province_id)')
 
 def get_currency_rate(currency_code):
     """Получить курс валюты из конвертера"""
@@ -295,19 +288,7 @@ def calculate_funding_efficiency(funding_percentage):
     
     return max(efficiency, 0)
 
-async def get_current_user(request: Request):
-    """Получение текущего пользователя из токена"""
-    sys.path.append('..')
-    from main import get_current_user as main_get_current_user
-    return await main_get_current_user(request)
-
-@router.get("/country/{country_id}")
-async def get_provinces(country_id: str, request: Request):
-    """Получение провинций страны"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
+def _get_provinces(country_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -318,10 +299,6 @@ async def get_provinces(country_id: str, request: Request):
         if not country:
             return JSONResponse({'success': False, 'error': 'Страна не найдена'}, status_code=404)
         
-        if user['role'] not in ['admin', 'moderator']:
-            if country['player_id'] != user['id']:
-                return JSONResponse({'success': False, 'error': 'Нет доступа к этой стране'}, status_code=403)
-        
         cursor.execute('''
             SELECT id, name, city_name, square, created_at
             FROM provinces
@@ -349,22 +326,12 @@ async def get_provinces(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.post("/")
-async def create_province(request: Request):
-    """Создание провинции (только админ)"""
-    user = await get_current_user(request)
-    if not user or user['role'] != 'admin':
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
-    data = await request.json()
-    country_id = data.get('country_id')
-    name = data.get('name', '').strip()
-    city_name = data.get('city_name', '').strip()
-    square = data.get('square', '').strip()
-    
-    if not all([country_id, name, city_name, square]):
-        return JSONResponse({'success': False, 'error': 'Все поля обязательны'}, status_code=400)
-    
+@router.get("/country/{country_id}")
+async def get_provinces(country_id: str, user=Depends(auth.country_owner_or_admin)):
+    """Получение провинций страны"""
+    return await database.run(_get_provinces, country_id)
+
+def _create_province(country_id, name, city_name, square):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -394,21 +361,21 @@ async def create_province(request: Request):
     finally:
         conn.close()
 
-@router.put("/{province_id}")
-async def update_province(province_id: int, request: Request):
-    """Обновление провинции (только админ)"""
-    user = await get_current_user(request)
-    if not user or user['role'] != 'admin':
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
+@router.post("/")
+async def create_province(request: Request, user=Depends(auth.require_admin)):
+    """Создание провинции (только админ)"""
     data = await request.json()
+    country_id = data.get('country_id')
     name = data.get('name', '').strip()
     city_name = data.get('city_name', '').strip()
     square = data.get('square', '').strip()
     
-    if not all([name, city_name, square]):
+    if not all([country_id, name, city_name, square]):
         return JSONResponse({'success': False, 'error': 'Все поля обязательны'}, status_code=400)
     
+    return await database.run(_create_province, country_id, name, city_name, square)
+
+def _update_province(province_id, name, city_name, square):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -436,22 +403,31 @@ async def update_province(province_id: int, request: Request):
     finally:
         conn.close()
 
-@router.delete("/{province_id}")
-async def delete_province(province_id: int, request: Request):
-    """Удаление провинции (только админ)"""
-    user = await get_current_user(request)
-    if not user or user['role'] != 'admin':
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
+@router.put("/{province_id}")
+async def update_province(province_id: int, request: Request, user=Depends(auth.require_admin)):
+    """Обновление провинции (только админ)"""
+    data = await request.json()
+    name = data.get('name', '').strip()
+    city_name = data.get('city_name', '').strip()
+    square = data.get('square', '').strip()
+    
+    if not all([name, city_name, square]):
+        return JSONResponse({'success': False, 'error': 'Все поля обязательны'}, status_code=400)
     
+    return await database.run(_update_province, province_id, name, city_name, square)
+
+def _delete_province(province_id):
     conn = get_db()
     cursor = conn.cursor()
     
     try:
-        cursor.execute('SELECT id FROM provinces WHERE id = ?', (province_id,))
-        if not cursor.fetchone():
+        cursor.execute('SELECT id, country_id FROM provinces WHERE id = ?', (province_id,))
+        province = cursor.fetchone()
+        if not province:
             return JSONResponse({'success': False, 'error': 'Провинция не найдена'}, status_code=404)
         
         cursor.execute('DELETE FROM provinces WHERE id = ?', (province_id,))
+        turn_engine.mark_dirty(cursor, province['country_id'])
         
         conn.commit()
         
@@ -466,13 +442,12 @@ async def delete_province(province_id: int, request: Request):
     finally:
         conn.close()
 
-@router.get("/{province_id}/buildings")
-async def get_province_buildings(province_id: int, request: Request):
-    """Получение построек провинции"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
+@router.delete("/{province_id}")
+async def delete_province(province_id: int, user=Depends(auth.require_admin)):
+    """Удаление провинции (только админ)"""
+    return await database.run(_delete_province, province_id)
+
+def _get_province_buildings(province_id, user):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -518,15 +493,10 @@ async def get_province_buildings(province_id: int, request: Request):
             # Получаем название производимого снаряжения если установлено
             production_type_name = None
             if row['production_type']:
-                sys.path.append('..')
-                from routers.economic import get_available_military_equipment
-                equipment_response = await get_available_military_equipment()
-                equipment_data = json.loads(equipment_response.body)
-                
-                if equipment_data.get('success'):
-                    all_equipment = equipment_data.get('equipment', {})
-                    if row['production_type'] in all_equipment:
-                        production_type_name = all_equipment[row['production_type']].get('name')
+                from routers.economic import get_military_equipment_types
+                all_equipment = get_military_equipment_types()
+                if row['production_type'] in all_equipment:
+                    production_type_name = all_equipment[row['production_type']].get('name')
             
             funding_percentage = row['funding_percentage'] if row['funding_percentage'] is not None else 100
             
@@ -555,15 +525,12 @@ async def get_province_buildings(province_id: int, request: Request):
     finally:
         conn.close()
 
-@router.get("/building-types")
-async def get_building_types(request: Request):
-    """Получение всех типов построек с учётом доступных технологий"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
-    country_id = request.query_params.get('country_id')
-    
+@router.get("/{province_id}/buildings")
+async def get_province_buildings(province_id: int, user=Depends(auth.require_user)):
+    """Получение построек провинции"""
+    return await database.run(_get_province_buildings, province_id, user)
+
+def _get_building_types(country_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -615,25 +582,14 @@ async def get_building_types(request: Request):
     finally:
         conn.close()
 
-@router.post("/{province_id}/buildings")
-async def build_building(province_id: int, request: Request):
-    """Строительство здания в провинции"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
-    data = await request.json()
-    building_name = data.get('building_name')  # Теперь передаем имя вместо ID
-    
-    if not building_name:
-        return JSONResponse({'success': False, 'error': 'Не указан тип здания'}, status_code=400)
-    
-    # Проверяем существование типа постройки
-    if building_name not in BUILDING_TYPES:
-        return JSONResponse({'success': False, 'error': 'Тип здания не найден'}, status_code=404)
-    
-    building_data = BUILDING_TYPES[building_name]
+@router.get("/building-types")
+async def get_building_types(request: Request, user=Depends(auth.require_user)):
+    """Получение всех типов построек с учётом доступных технологий"""
+    country_id = request.query_params.get('country_id')
     
+    return await database.run(_get_building_types, country_id)
+
+def _build_building(province_id, user, building_name, building_data):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -682,6 +638,7 @@ async def build_building(province_id: int, request: Request):
             VALUES (?, ?, 1, ?)
         ''', (province_id, building_name, built_at))
         
+        turn_engine.mark_dirty(cursor, province['country_id'])
         conn.commit()
         
         return JSONResponse({
@@ -695,19 +652,30 @@ async def build_building(province_id: int, request: Request):
     finally:
         conn.close()
 
-@router.delete("/buildings/{building_id}")
-async def demolish_building(building_id: int, request: Request):
-    """Снос здания"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
+@router.post("/{province_id}/buildings")
+async def build_building(province_id: int, request: Request, user=Depends(auth.require_user)):
+    """Строительство здания в провинции"""
+    data = await request.json()
+    building_name = data.get('building_name')  # Теперь передаем имя вместо ID
+    
+    if not building_name:
+        return JSONResponse({'success': False, 'error': 'Не указан тип здания'}, status_code=400)
     
+    # Проверяем существование типа постройки
+    if building_name not in BUILDING_TYPES:
+        return JSONResponse({'success': False, 'error': 'Тип здания не найден'}, status_code=404)
+    
+    building_data = BUILDING_TYPES[building_name]
+    
+    return await database.run(_build_building, province_id, user, building_name, building_data)
+
+def _demolish_building(building_id, user):
     conn = get_db()
     cursor = conn.cursor()
     
     try:
         cursor.execute('''
-            SELECT b.id, c.player_id
+            SELECT b.id, c.id as country_id, c.player_id
             FROM buildings b
             JOIN provinces p ON b.province_id = p.id
             JOIN countries c ON p.country_id = c.id
@@ -724,6 +692,7 @@ async def demolish_building(building_id: int, request: Request):
         
         cursor.execute('DELETE FROM buildings WHERE id = ?', (building_id,))
         
+        turn_engine.mark_dirty(cursor, building['country_id'])
         conn.commit()
         
         return JSONResponse({
@@ -737,20 +706,13 @@ async def demolish_building(building_id: int, request: Request):
     finally:
         conn.close()
 
+@router.delete("/buildings/{building_id}")
+async def demolish_building(building_id: int, user=Depends(auth.require_user)):
+    """Снос здания"""
+    return await database.run(_demolish_building, building_id, user)
 
-@router.post("/buildings/{building_id}/set-production")
-async def set_building_production(building_id: int, request: Request):
-    """Установка типа производства для здания"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
-    data = await request.json()
-    equipment_code = data.get('equipment_code')
-    
-    if not equipment_code:
-        return JSONResponse({'success': False, 'error': 'Не указан тип снаряжения'}, status_code=400)
-    
+
+def _set_building_production(building_id, user, equipment_code):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -782,15 +744,8 @@ async def set_building_production(building_id: int, request: Request):
         building_category = building_data.get('building_category')
         
         # Импортируем данные о снаряжении
-        sys.path.append('..')
-        from routers.economic import get_available_military_equipment
-        equipment_response = await get_available_military_equipment()
-        equipment_data = json.loads(equipment_response.body)
-        
-        if not equipment_data.get('success'):
-            return JSONResponse({'success': False, 'error': 'Не удалось загрузить данные о снаряжении'}, status_code=500)
-        
-        all_equipment = equipment_data.get('equipment', {})
+        from routers.economic import get_military_equipment_types
+        all_equipment = get_military_equipment_types()
         
         # Проверяем существование выбранного снаряжения
         if equipment_code not in all_equipment:
@@ -829,6 +784,7 @@ async def set_building_production(building_id: int, request: Request):
             WHERE id = ?
         ''', (equipment_code, building_id))
         
+        turn_engine.mark_dirty(cursor, building['country_id'])
         conn.commit()
         
         return JSONResponse({
@@ -844,32 +800,26 @@ async def set_building_production(building_id: int, request: Request):
     finally:
         conn.close()
 
-
-@router.post("/buildings/{building_id}/set-funding")
-async def set_building_funding(building_id: int, request: Request):
-    """Установка процента финансирования для производственного здания (50-200%)"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
+@router.post("/buildings/{building_id}/set-production")
+async def set_building_production(building_id: int, request: Request, user=Depends(auth.require_user)):
+    """Установка типа производства для здания"""
     data = await request.json()
-    funding_percentage = data.get('funding_percentage')
-    
-    if not funding_percentage or not isinstance(funding_percentage, (int, float)):
-        return JSONResponse({'success': False, 'error': 'Не указан процент финансирования'}, status_code=400)
-    
-    funding_percentage = int(funding_percentage)
+    equipment_code = data.get('equipment_code')
     
-    if funding_percentage < 50 or funding_percentage > 200:
-        return JSONResponse({'success': False, 'error': 'Процент финансирования должен быть от 50% до 200%'}, status_code=400)
+    if not equipment_code:
+        return JSONResponse({'success': False, 'error': 'Не указан тип снаряжения'}, status_code=400)
     
+    return await database.run(_set_building_production, building_id, user, equipment_code)
+
+
+def _set_building_funding(building_id, user, funding_percentage):
     conn = get_db()
     cursor = conn.cursor()
     
     try:
         # Получаем информацию о здании и проверяем доступ
         cursor.execute('''
-            SELECT b.id, b.building_type_name, c.player_id
+            SELECT b.id, b.building_type_name, c.id as country_id, c.player_id
             FROM buildings b
             JOIN provinces p ON b.province_id = p.id
             JOIN countries c ON p.country_id = c.id
@@ -903,6 +853,7 @@ async def set_building_funding(building_id: int, request: Request):
             WHERE id = ?
         ''', (funding_percentage, building_id))
         
+        turn_engine.mark_dirty(cursor, building['country_id'])
         conn.commit()
         
         efficiency = calculate_funding_efficiency(funding_percentage)
@@ -921,14 +872,24 @@ async def set_building_funding(building_id: int, request: Request):
     finally:
         conn.close()
 
-
-@router.get("/buildings/{building_id}/available-production")
-async def get_available_production(building_id: int, request: Request):
-    """Получение доступных типов производства для здания"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
+@router.post("/buildings/{building_id}/set-funding")
+async def set_building_funding(building_id: int, request: Request, user=Depends(auth.require_user)):
+    """Установка процента финансирования для производственного здания (50-200%)"""
+    data = await request.json()
+    funding_percentage = data.get('funding_percentage')
+    
+    if not funding_percentage or not isinstance(funding_percentage, (int, float)):
+        return JSONResponse({'success': False, 'error': 'Не указан процент финансирования'}, status_code=400)
     
+    funding_percentage = int(funding_percentage)
+    
+    if funding_percentage < 50 or funding_percentage > 200:
+        return JSONResponse({'success': False, 'error': 'Процент финансирования должен быть от 50% до 200%'}, status_code=400)
+    
+    return await database.run(_set_building_funding, building_id, user, funding_percentage)
+
+
+def _get_available_production(building_id, user):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -986,15 +947,8 @@ async def get_available_production(building_id: int, request: Request):
         researched_techs = [row['tech_id'] for row in cursor.fetchall()]
         
         # Импортируем данные о снаряжении
-        sys.path.append('..')
-        from routers.economic import get_available_military_equipment
-        equipment_response = await get_available_military_equipment()
-        equipment_data = json.loads(equipment_response.body)
-        
-        if not equipment_data.get('success'):
-            return JSONResponse({'success': False, 'error': 'Не удалось загрузить данные о снаряжении'}, status_code=500)
-        
-        all_equipment = equipment_data.get('equipment', {})
+        from routers.economic import get_military_equipment_types
+        all_equipment = get_military_equipment_types()
         
         # Получаем информацию о пользователе для проверки роли
         cursor.execute('SELECT role FROM users WHERE id = ?', (user['id'],))
@@ -1070,3 +1024,8 @@ async def get_available_production(building_id: int, request: Request):
         return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
     finally:
         conn.close()
+
+@router.get("/buildings/{building_id}/available-production")
+async def get_available_production(building_id: int, user=Depends(auth.require_user)):
+    """Получение доступных типов производства для здания"""
+    return await database.run(_get_available_production, building_id, user)
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional
@@ -6,6 +6,8 @@ import sqlite3
 import json
 from datetime import datetime
 
+from routers import auth, auth_cache, database
+
 router = APIRouter(prefix="/api/registration")
 
 class ApplicationData(BaseModel):
@@ -20,15 +22,12 @@ class ApplicationData(BaseModel):
     referral_code: Optional[str] = None
 
 def get_db():
-    conn = sqlite3.connect('users.db')
+    conn = database.connect()
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_db():
-    """Инициализация таблицы заявок"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
+def init_db(cursor):
+    """Инициализация таблицы заявок (миграция, см. routers/migrations.py)"""
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS player_applications (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -53,33 +52,86 @@ def init_db():
         )
     ''')
     
-    conn.commit()
-    conn.close()
+    # Проверка, не занята ли страна другой заявкой (user_id уже индексирован через UNIQUE)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_player_applications_country ON player_applications(country)')
 
-init_db()
+def add_world_column(cursor):
+    """Заявки по мирам (миграция, см. routers/migrations.py)
 
-@router.post("/submit-application")
-async def submit_application(data: ApplicationData, request: Request):
-    """Отправка новой заявки на регистрацию игрока"""
-    
-    import sys
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
+    Игрок подаёт заявку в каждом мире отдельно, поэтому UNIQUE(user_id)
+    заменяется на UNIQUE(user_id, world_id); таблица пересоздаётся, прежние
+    заявки относятся к миру по умолчанию.
+    """
+    cursor.execute('PRAGMA table_info(player_applications)')
+    if 'world_id' in [column[1] for column in cursor.fetchall()]:
+        return
+    cursor.execute('''
+        CREATE TABLE player_applications_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            world_id TEXT NOT NULL DEFAULT 'main',
+            username TEXT NOT NULL,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            country_origin TEXT NOT NULL,
+            age INTEGER NOT NULL,
+            country TEXT NOT NULL,
+            religion TEXT,
+            ethnicity TEXT,
+            relatives TEXT,
+            referral_code TEXT,
+            status TEXT DEFAULT 'pending',
+            rejection_reason TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            reviewed_by INTEGER,
+            reviewed_at TEXT,
+            UNIQUE (user_id, world_id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    columns = (
+        'id, user_id, username, first_name, last_name, country_origin, age, country, religion, ethnicity, '
+        'relatives, referral_code, status, rejection_reason, created_at, updated_at, reviewed_by, reviewed_at'
+    )
+    cursor.execute(f'INSERT INTO player_applications_new ({columns}) SELECT {columns} FROM player_applications')
+    cursor.execute('DROP TABLE player_applications')
+    cursor.execute('ALTER TABLE player_applications_new RENAME TO player_applications')
+    # Занятость страны проверяется в пределах мира
+    cursor.execute('CREATE INDEX idx_player_applications_country ON player_applications(world_id, country)')
+
+def country_taken(cursor, world_id, country_id, user_id=None):
+    """Занята ли страна в мире: заявкой (кроме отклонённых) или игроком в countries мира"""
+    cursor.execute(
+        "SELECT id FROM player_applications WHERE world_id = ? AND country = ? AND status != 'rejected' AND user_id IS NOT ?",
+        (world_id, country_id, user_id)
+    )
+    if cursor.fetchone():
+        return True
+    cursor.execute(
+        'SELECT id FROM countries WHERE id = ? AND player_id IS NOT NULL AND player_id IS NOT ?',
+        (country_id, user_id)
+    )
+    return cursor.fetchone() is not None
+
+def occupied_countries(cursor, world_id):
+    """Страны мира, занятые заявками или игроками"""
+    cursor.execute('''
+        SELECT country FROM player_applications WHERE world_id = ? AND status != 'rejected'
+        UNION
+        SELECT id FROM countries WHERE player_id IS NOT NULL
+    ''', (world_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+def _submit_application(data, user):
     conn = get_db()
     cursor = conn.cursor()
     
     try:
+        world_id = database.current_world()
         cursor.execute(
-            "SELECT id, status FROM player_applications WHERE user_id = ?",
-            (user['id'],)
+            "SELECT id, status FROM player_applications WHERE user_id = ? AND world_id = ?",
+            (user['id'], world_id)
         )
         existing = cursor.fetchone()
         
@@ -96,11 +148,7 @@ async def submit_application(data: ApplicationData, request: Request):
                     "error": "Ваша заявка уже находится на рассмотрении."
                 }, status_code=400)
         
-        cursor.execute(
-            "SELECT id FROM player_applications WHERE country = ? AND status != 'rejected'",
-            (data.country,)
-        )
-        if cursor.fetchone():
+        if country_taken(cursor, world_id, data.country):
             return JSONResponse({
                 "success": False,
                 "error": "Эта страна уже занята"
@@ -110,12 +158,13 @@ async def submit_application(data: ApplicationData, request: Request):
         
         cursor.execute('''
             INSERT INTO player_applications (
-                user_id, username, first_name, last_name, country_origin, age, country,
+                user_id, world_id, username, first_name, last_name, country_origin, age, country,
                 religion, ethnicity, relatives, referral_code, status,
                 created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             user['id'],
+            world_id,
             user['username'],
             data.first_name,
             data.last_name,
@@ -148,28 +197,20 @@ async def submit_application(data: ApplicationData, request: Request):
     finally:
         conn.close()
 
-@router.post("/update-application")
-async def update_application(data: ApplicationData, request: Request):
-    """Обновление существующей заявки"""
-    
-    import sys
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
+@router.post("/submit-application")
+async def submit_application(data: ApplicationData, user=Depends(auth.require_user)):
+    """Отправка новой заявки на регистрацию игрока"""
+    return await database.run(_submit_application, data, user)
+
+def _update_application(data, user):
     conn = get_db()
     cursor = conn.cursor()
     
     try:
+        world_id = database.current_world()
         cursor.execute(
-            "SELECT id, status, country FROM player_applications WHERE user_id = ?",
-            (user['id'],)
+            "SELECT id, status, country FROM player_applications WHERE user_id = ? AND world_id = ?",
+            (user['id'], world_id)
         )
         existing = cursor.fetchone()
         
@@ -186,11 +227,7 @@ async def update_application(data: ApplicationData, request: Request):
             }, status_code=400)
         
         if existing['country'] != data.country:
-            cursor.execute(
-                "SELECT id FROM player_applications WHERE country = ? AND status != 'rejected' AND user_id != ?",
-                (data.country, user['id'])
-            )
-            if cursor.fetchone():
+            if country_taken(cursor, world_id, data.country, user['id']):
                 return JSONResponse({
                     "success": False,
                     "error": "Эта страна уже занята"
@@ -214,7 +251,7 @@ async def update_application(data: ApplicationData, request: Request):
                 rejection_reason = NULL,
                 reviewed_by = NULL,
                 reviewed_at = NULL
-            WHERE user_id = ?
+            WHERE id = ?
         ''', (
             data.first_name,
             data.last_name,
@@ -226,7 +263,7 @@ async def update_application(data: ApplicationData, request: Request):
             data.relatives,
             data.referral_code,
             now,
-            user['id']
+            existing['id']
         ))
         
         conn.commit()
@@ -246,21 +283,12 @@ async def update_application(data: ApplicationData, request: Request):
     finally:
         conn.close()
 
-@router.get("/my-application")
-async def get_my_application(request: Request):
-    """Получение заявки текущего пользователя"""
-    
-    import sys
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
+@router.post("/update-application")
+async def update_application(data: ApplicationData, user=Depends(auth.require_user)):
+    """Обновление существующей заявки"""
+    return await database.run(_update_application, data, user)
+
+def _get_my_application(user):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -271,8 +299,8 @@ async def get_my_application(request: Request):
                 religion, ethnicity, relatives, referral_code, status, rejection_reason,
                 created_at, updated_at, reviewed_at
             FROM player_applications
-            WHERE user_id = ?
-        ''', (user['id'],))
+            WHERE user_id = ? AND world_id = ?
+        ''', (user['id'], database.current_world()))
         
         application = cursor.fetchone()
         
@@ -312,28 +340,19 @@ async def get_my_application(request: Request):
     finally:
         conn.close()
 
-@router.post("/cancel-application")
-async def cancel_application(request: Request):
-    """Отзыв заявки"""
-    
-    import sys
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
+@router.get("/my-application")
+async def get_my_application(user=Depends(auth.require_user)):
+    """Получение заявки текущего пользователя"""
+    return await database.run(_get_my_application, user)
+
+def _cancel_application(user):
     conn = get_db()
     cursor = conn.cursor()
     
     try:
         cursor.execute(
-            "SELECT id, status FROM player_applications WHERE user_id = ?",
-            (user['id'],)
+            "SELECT id, status FROM player_applications WHERE user_id = ? AND world_id = ?",
+            (user['id'], database.current_world())
         )
         existing = cursor.fetchone()
         
@@ -349,7 +368,7 @@ async def cancel_application(request: Request):
                 "error": "Нельзя отозвать одобренную заявку"
             }, status_code=400)
         
-        cursor.execute("DELETE FROM player_applications WHERE user_id = ?", (user['id'],))
+        cursor.execute("DELETE FROM player_applications WHERE id = ?", (existing['id'],))
         conn.commit()
         
         return JSONResponse({
@@ -367,27 +386,17 @@ async def cancel_application(request: Request):
     finally:
         conn.close()
 
-@router.get("/occupied-countries")
-async def get_occupied_countries(request: Request):
-    """Получение списка занятых стран"""
-    
-    import sys
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
+@router.post("/cancel-application")
+async def cancel_application(user=Depends(auth.require_user)):
+    """Отзыв заявки"""
+    return await database.run(_cancel_application, user)
+
+def _get_occupied_countries():
     conn = get_db()
     cursor = conn.cursor()
     
     try:
-        cursor.execute("SELECT country FROM player_applications WHERE status != 'rejected'")
-        countries = [row['country'] for row in cursor.fetchall()]
+        countries = occupied_countries(cursor, database.current_world())
         
         return JSONResponse({
             "success": True,
@@ -403,38 +412,27 @@ async def get_occupied_countries(request: Request):
     finally:
         conn.close()
 
-@router.get("/admin/all-applications")
-async def get_all_applications(request: Request):
-    """Получение всех заявок для админ панели"""
-    
-    import sys
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
-    if user.get('role') != 'admin':
-        raise HTTPException(status_code=403, detail="Access denied")
-    
+@router.get("/occupied-countries")
+async def get_occupied_countries(user=Depends(auth.require_user)):
+    """Получение списка занятых стран"""
+    return await database.run(_get_occupied_countries)
+
+def _get_all_applications():
     conn = get_db()
     cursor = conn.cursor()
     
     try:
         cursor.execute('''
             SELECT 
-                id, user_id, username,
+                id, user_id, world_id, username,
                 first_name, last_name, country_origin, age,
                 country, religion, ethnicity, relatives, referral_code,
                 status, rejection_reason, created_at, updated_at,
                 reviewed_by, reviewed_at
             FROM player_applications
+            WHERE world_id = ?
             ORDER BY created_at DESC
-        ''')
+        ''', (database.current_world(),))
         
         applications = cursor.fetchall()
         
@@ -452,24 +450,12 @@ async def get_all_applications(request: Request):
     finally:
         conn.close()
 
-@router.get("/admin/pending-applications")
-async def get_pending_applications(request: Request):
-    """Получение всех заявок на рассмотрении (только для админов)"""
-    
-    import sys
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
-    if user.get('role') != 'admin':
-        raise HTTPException(status_code=403, detail="Access denied")
-    
+@router.get("/admin/all-applications")
+async def get_all_applications(user=Depends(auth.require_admin)):
+    """Получение всех заявок для админ панели"""
+    return await database.run(_get_all_applications)
+
+def _get_pending_applications():
     conn = get_db()
     cursor = conn.cursor()
     
@@ -480,9 +466,9 @@ async def get_pending_applications(request: Request):
                 experience, playtime, motivation, skills, additional_info,
                 status, created_at, updated_at
             FROM player_applications
-            WHERE status = 'pending'
+            WHERE status = 'pending' AND world_id = ?
             ORDER BY created_at DESC
-        ''')
+        ''', (database.current_world(),))
         
         applications = cursor.fetchall()
         
@@ -500,6 +486,11 @@ async def get_pending_applications(request: Request):
     finally:
         conn.close()
 
+@router.get("/admin/pending-applications")
+async def get_pending_applications(user=Depends(auth.require_admin)):
+    """Получение всех заявок на рассмотрении (только для админов)"""
+    return await database.run(_get_pending_applications)
+
 class ApproveApplicationData(BaseModel):
     application_id: int
     first_name: str
@@ -512,31 +503,15 @@ class ApproveApplicationData(BaseModel):
     referral_code: Optional[str] = None
     relatives: Optional[str] = None
 
-@router.post("/admin/approve-application")
-async def approve_application(data: ApproveApplicationData, request: Request):
-    """Одобрение заявки (только для админов)"""
-    
-    import sys
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
-    if user.get('role') != 'admin':
-        raise HTTPException(status_code=403, detail="Access denied")
-    
+def _approve_application(data, user):
     conn = get_db()
     cursor = conn.cursor()
     
     try:
+        # Страна создаётся в мире запроса - заявка должна быть из него же
         cursor.execute(
-            "SELECT user_id, status FROM player_applications WHERE id = ?",
-            (data.application_id,)
+            "SELECT user_id, status FROM player_applications WHERE id = ? AND world_id = ?",
+            (data.application_id, database.current_world())
         )
         application = cursor.fetchone()
         
@@ -661,7 +636,8 @@ async def approve_application(data: ApproveApplicationData, request: Request):
                 now
             ))
         
-        import json
+        # Флаг available в countries.json - общий для всех миров и задаётся
+        # администратором; занятость страны в мире - это countries.player_id
         countries_path = 'data/countries.json'
         country_name = data.assigned_country
         
@@ -672,11 +648,7 @@ async def approve_application(data: ApproveApplicationData, request: Request):
             for country_data in countries_list:
                 if country_data['id'] == data.assigned_country:
                     country_name = country_data['name']
-                    country_data['available'] = False
                     break
-            
-            with open(countries_path, 'w', encoding='utf-8') as f:
-                json.dump(countries_list, f, ensure_ascii=False, indent=4)
         except Exception as e:
             print(f"Error loading country name from countries.json: {e}")
         
@@ -702,6 +674,8 @@ async def approve_application(data: ApproveApplicationData, request: Request):
                 'Золото',
                 user_id
             ))
+            from routers.turn_engine import mark_dirty
+            mark_dirty(cursor, data.assigned_country)
             country_created = True
         else:
             # Создаём новую страну
@@ -764,6 +738,7 @@ async def approve_application(data: ApproveApplicationData, request: Request):
                 print(f"Error processing referral rewards: {e}")
         
         conn.commit()
+        auth_cache.invalidate(user_id=user_id)
         
         return JSONResponse({
             "success": True,
@@ -780,35 +755,23 @@ async def approve_application(data: ApproveApplicationData, request: Request):
     finally:
         conn.close()
 
+@router.post("/admin/approve-application")
+async def approve_application(data: ApproveApplicationData, user=Depends(auth.require_admin)):
+    """Одобрение заявки (только для админов)"""
+    return await database.run(_approve_application, data, user)
+
 class RejectApplicationData(BaseModel):
     application_id: int
     reason: str
 
-@router.post("/admin/reject-application")
-async def reject_application(data: RejectApplicationData, request: Request):
-    """Отклонение заявки (только для админов)"""
-    
-    import sys
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
-    if user.get('role') != 'admin':
-        raise HTTPException(status_code=403, detail="Access denied")
-    
+def _reject_application(data, user):
     conn = get_db()
     cursor = conn.cursor()
     
     try:
         cursor.execute(
-            "SELECT status FROM player_applications WHERE id = ?",
-            (data.application_id,)
+            "SELECT status FROM player_applications WHERE id = ? AND world_id = ?",
+            (data.application_id, database.current_world())
         )
         application = cursor.fetchone()
         
@@ -852,3 +815,8 @@ async def reject_application(data: RejectApplicationData, request: Request):
         }, status_code=500)
     finally:
         conn.close()
+
+@router.post("/admin/reject-application")
+async def reject_application(data: RejectApplicationData, user=Depends(auth.require_admin)):
+    """Отклонение заявки (только для админов)"""
+    return await database.run(_reject_application, data, user)
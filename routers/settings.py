@@ -1,11 +1,12 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional
 import json
-import sys
 import os
 
+from routers import auth, database
+
 router = APIRouter(prefix="/api/settings")
 
 RULES_FILE = 'data/rules.txt'
@@ -28,23 +29,9 @@ class UpdateCountryData(BaseModel):
 class DeleteCountryData(BaseModel):
     id: str
 
-async def check_admin(request: Request):
-    """Проверка прав администратора"""
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user or user.get('role') != 'admin':
-        return None
-    return user
-
 @router.get("/rules")
-async def get_rules(request: Request):
+async def get_rules(user=Depends(auth.require_admin)):
     """Получение содержимого файла правил"""
-    user = await check_admin(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Нет доступа'}, status_code=403)
-    
     try:
         if not os.path.exists(RULES_FILE):
             return JSONResponse({'success': False, 'error': 'Файл правил не найден'})
@@ -57,12 +44,8 @@ async def get_rules(request: Request):
         return JSONResponse({'success': False, 'error': str(e)})
 
 @router.post("/rules")
-async def update_rules(data: RulesData, request: Request):
+async def update_rules(data: RulesData, user=Depends(auth.require_admin)):
     """Обновление файла правил"""
-    user = await check_admin(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Нет доступа'}, status_code=403)
-    
     try:
         os.makedirs(os.path.dirname(RULES_FILE), exist_ok=True)
         
@@ -88,12 +71,8 @@ async def get_countries(request: Request):
         return JSONResponse({'success': False, 'error': str(e)})
 
 @router.post("/countries/add")
-async def add_country(data: CountryData, request: Request):
+async def add_country(data: CountryData, user=Depends(auth.require_admin)):
     """Добавление новой страны"""
-    user = await check_admin(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Нет доступа'}, status_code=403)
-    
     try:
         if not os.path.exists(COUNTRIES_FILE):
             countries = []
@@ -118,12 +97,8 @@ async def add_country(data: CountryData, request: Request):
         return JSONResponse({'success': False, 'error': str(e)})
 
 @router.post("/countries/update")
-async def update_country(data: UpdateCountryData, request: Request):
+async def update_country(data: UpdateCountryData, user=Depends(auth.require_admin)):
     """Обновление страны"""
-    user = await check_admin(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Нет доступа'}, status_code=403)
-    
     try:
         if not os.path.exists(COUNTRIES_FILE):
             return JSONResponse({'success': False, 'error': 'Файл стран не найден'})
@@ -153,12 +128,8 @@ async def update_country(data: UpdateCountryData, request: Request):
         return JSONResponse({'success': False, 'error': str(e)})
 
 @router.post("/countries/delete")
-async def delete_country(data: DeleteCountryData, request: Request):
+async def delete_country(data: DeleteCountryData, user=Depends(auth.require_admin)):
     """Удаление страны"""
-    user = await check_admin(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Нет доступа'}, status_code=403)
-    
     try:
         if not os.path.exists(COUNTRIES_FILE):
             return JSONResponse({'success': False, 'error': 'Файл стран не найден'})
@@ -175,20 +146,9 @@ async def delete_country(data: DeleteCountryData, request: Request):
     except Exception as e:
         return JSONResponse({'success': False, 'error': str(e)})
 
-@router.get("/referral")
-async def get_referral_code(request: Request):
-    """Получение реферального кода пользователя"""
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Нет доступа'}, status_code=403)
-    
+def _get_referral_code(user):
     try:
-        import sqlite3
-        DB_FILE = 'users.db'
-        conn = sqlite3.connect(DB_FILE)
+        conn = database.connect()
         c = conn.cursor()
         c.execute('SELECT referral_code FROM users WHERE username=?', (user['username'],))
         result = c.fetchone()
@@ -200,3 +160,8 @@ async def get_referral_code(request: Request):
             return JSONResponse({'success': False, 'error': 'Реферальный код не найден'})
     except Exception as e:
         return JSONResponse({'success': False, 'error': str(e)})
+
+@router.get("/referral")
+async def get_referral_code(user=Depends(auth.require_user)):
+    """Получение реферального кода пользователя"""
+    return await database.run(_get_referral_code, user)
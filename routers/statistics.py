@@ -1,21 +1,17 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import JSONResponse
 import sqlite3
-import sys
-sys.path.append('..')
+from routers import auth, database, turn_engine
 
 router = APIRouter(prefix="/api/statistics")
 
 def get_db():
-    conn = sqlite3.connect('users.db')
+    conn = database.connect()
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_statistics_tables():
-    """Инициализация таблиц статистики для стран"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
+def init_statistics_tables(cursor):
+    """Инициализация таблиц статистики для стран (миграция, см. routers/migrations.py)"""
     # Таблица основной статистики страны (население)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS country_stats (
@@ -61,25 +57,8 @@ def init_statistics_tables():
             UNIQUE(country_id, layer_name)
         )
     ''')
-    
-    conn.commit()
-    conn.close()
-
-# Инициализируем таблицы при импорте модуля
-init_statistics_tables()
-
-async def get_current_user(request: Request):
-    """Получение текущего пользователя из токена"""
-    from main import get_current_user as main_get_current_user
-    return await main_get_current_user(request)
 
-@router.get("/country/{country_id}")
-async def get_country_statistics(country_id: str, request: Request):
-    """Получение всей статистики для страны"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
+def _get_country_statistics(country_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -91,10 +70,6 @@ async def get_country_statistics(country_id: str, request: Request):
         if not country:
             return JSONResponse({'success': False, 'error': 'Страна не найдена'}, status_code=404)
         
-        if user['role'] not in ['admin', 'moderator']:
-            if country['player_id'] != user['id']:
-                return JSONResponse({'success': False, 'error': 'Доступ запрещён'}, status_code=403)
-        
         # Получаем население
         cursor.execute('SELECT population FROM country_stats WHERE country_id = ?', (country_id,))
         stats = cursor.fetchone()
@@ -138,19 +113,12 @@ async def get_country_statistics(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.post("/country/{country_id}/population")
-async def update_population(country_id: str, request: Request):
-    """Обновление населения страны (только для админа)"""
-    user = await get_current_user(request)
-    if not user or user['role'] != 'admin':
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
-    data = await request.json()
-    population = data.get('population', 0.0)
-    
-    if population < 0:
-        return JSONResponse({'success': False, 'error': 'Население не может быть отрицательным'}, status_code=400)
-    
+@router.get("/country/{country_id}")
+async def get_country_statistics(country_id: str, user=Depends(auth.country_owner_or_admin)):
+    """Получение всей статистики для страны"""
+    return await database.run(_get_country_statistics, country_id)
+
+def _update_population(country_id, population):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -164,6 +132,7 @@ async def update_population(country_id: str, request: Request):
             VALUES (?, ?)
             ON CONFLICT(country_id) DO UPDATE SET population = ?
         ''', (country_id, population, population))
+        turn_engine.mark_dirty(cursor, country_id)
         conn.commit()
         
         return JSONResponse({
@@ -179,21 +148,18 @@ async def update_population(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.post("/country/{country_id}/religions")
-async def update_religions(country_id: str, request: Request):
-    """Обновление религий страны (только для админа)"""
-    user = await get_current_user(request)
-    if not user or user['role'] != 'admin':
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
+@router.post("/country/{country_id}/population")
+async def update_population(country_id: str, request: Request, user=Depends(auth.require_admin)):
+    """Обновление населения страны (только для админа)"""
     data = await request.json()
-    religions = data.get('religions', {})
+    population = data.get('population', 0.0)
     
-    # Проверяем, что сумма процентов не превышает 100
-    total = sum(religions.values())
-    if total > 100:
-        return JSONResponse({'success': False, 'error': f'Сумма процентов превышает 100% ({total}%)'}, status_code=400)
+    if population < 0:
+        return JSONResponse({'success': False, 'error': 'Население не может быть отрицательным'}, status_code=400)
     
+    return await database.run(_update_population, country_id, population)
+
+def _update_religions(country_id, religions):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -227,25 +193,20 @@ async def update_religions(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.post("/country/{country_id}/cultures")
-async def update_cultures(country_id: str, request: Request):
-    """Обновление культур страны (только для админа)"""
-    user = await get_current_user(request)
-    if not user or user['role'] != 'admin':
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
+@router.post("/country/{country_id}/religions")
+async def update_religions(country_id: str, request: Request, user=Depends(auth.require_admin)):
+    """Обновление религий страны (только для админа)"""
     data = await request.json()
-    cultures = data.get('cultures', {})
-    
-    # Проверяем, что сумма процентов наций не превышает 100
-    total = 0.0
-    for ethnos_data in cultures.values():
-        for nation_percentage in ethnos_data.get('nations', {}).values():
-            total += nation_percentage
+    religions = data.get('religions', {})
     
+    # Проверяем, что сумма процентов не превышает 100
+    total = sum(religions.values())
     if total > 100:
-        return JSONResponse({'success': False, 'error': f'Сумма процентов наций превышает 100% ({total}%)'}, status_code=400)
+        return JSONResponse({'success': False, 'error': f'Сумма процентов превышает 100% ({total}%)'}, status_code=400)
     
+    return await database.run(_update_religions, country_id, religions)
+
+def _update_cultures(country_id, cultures):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -280,21 +241,24 @@ async def update_cultures(country_id: str, request: Request):
     finally:
         conn.close()
 
-@router.post("/country/{country_id}/social-layers")
-async def update_social_layers(country_id: str, request: Request):
-    """Обновление социальных слоёв страны (только для админа)"""
-    user = await get_current_user(request)
-    if not user or user['role'] != 'admin':
-        return JSONResponse({'success': False, 'error': 'Требуются права администратора'}, status_code=403)
-    
+@router.post("/country/{country_id}/cultures")
+async def update_cultures(country_id: str, request: Request, user=Depends(auth.require_admin)):
+    """Обновление культур страны (только для админа)"""
     data = await request.json()
-    social_layers = data.get('social_layers', {})
+    cultures = data.get('cultures', {})
+    
+    # Проверяем, что сумма процентов наций не превышает 100
+    total = 0.0
+    for ethnos_data in cultures.values():
+        for nation_percentage in ethnos_data.get('nations', {}).values():
+            total += nation_percentage
     
-    # Проверяем, что сумма процентов не превышает 100
-    total = sum(social_layers.values())
     if total > 100:
-        return JSONResponse({'success': False, 'error': f'Сумма процентов превышает 100% ({total}%)'}, status_code=400)
+        return JSONResponse({'success': False, 'error': f'Сумма процентов наций превышает 100% ({total}%)'}, status_code=400)
     
+    return await database.run(_update_cultures, country_id, cultures)
+
+def _update_social_layers(country_id, social_layers):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -313,6 +277,7 @@ async def update_social_layers(country_id: str, request: Request):
                 VALUES (?, ?, ?)
             ''', (country_id, layer_name, percentage))
         
+        turn_engine.mark_dirty(cursor, country_id)
         conn.commit()
         
         return JSONResponse({
@@ -328,6 +293,19 @@ async def update_social_layers(country_id: str, request: Request):
     finally:
         conn.close()
 
+@router.post("/country/{country_id}/social-layers")
+async def update_social_layers(country_id: str, request: Request, user=Depends(auth.require_admin)):
+    """Обновление социальных слоёв страны (только для админа)"""
+    data = await request.json()
+    social_layers = data.get('social_layers', {})
+    
+    # Проверяем, что сумма процентов не превышает 100
+    total = sum(social_layers.values())
+    if total > 100:
+        return JSONResponse({'success': False, 'error': f'Сумма процентов превышает 100% ({total}%)'}, status_code=400)
+    
+    return await database.run(_update_social_layers, country_id, social_layers)
+
 @router.get("/reference/religions")
 async def get_religions_reference():
     """Получение справочника религий"""
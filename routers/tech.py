@@ -1,31 +1,23 @@
-from fastapi import APIRouter, Request, HTTPException
+from fastapi import APIRouter, Depends
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import List
 import sqlite3
-import sys
 from datetime import datetime
 
-sys.path.append('..')
 from routers.provinces import BUILDING_TYPES
 
+from routers import auth, database
+
 router = APIRouter(prefix="/api/tech", tags=["technologies"])
 
 def get_db():
-    conn = sqlite3.connect('users.db')
+    conn = database.connect()
     conn.row_factory = sqlite3.Row
     return conn
 
-async def get_current_user(request: Request):
-    """Получение текущего пользователя из токена"""
-    from main import get_current_user as main_get_current_user
-    return await main_get_current_user(request)
-
-def init_tech_db():
-    """Инициализация таблицы прогресса технологий"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
+def init_tech_db(cursor):
+    """Инициализация таблицы прогресса технологий (миграция, см. routers/migrations.py)"""
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS country_technologies (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -36,11 +28,6 @@ def init_tech_db():
             FOREIGN KEY (country_id) REFERENCES countries (id)
         )
     ''')
-    
-    conn.commit()
-    conn.close()
-
-init_tech_db()
 
 # СУХОПУТНЫЕ ВОЙСКА
 LAND_FORCES_TECH = {
@@ -1019,12 +1006,7 @@ def is_tech_visible(tech_id: str, researched_ids: set, all_techs_map: dict, all_
     return False
 
 
-@router.get("/tree/{category}")
-async def get_tech_tree(category: str, request: Request, country_id: str = None, show_hidden: bool = False):
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
+def _get_tech_tree(category, country_id, show_hidden, user):
     tech_data = None
     if category == "land_forces":
         tech_data = LAND_FORCES_TECH
@@ -1106,6 +1088,10 @@ async def get_tech_tree(category: str, request: Request, country_id: str = None,
     
     return JSONResponse({"success": True, "data": sorted_tech_data})
 
+@router.get("/tree/{category}")
+async def get_tech_tree(category: str, country_id: str = None, show_hidden: bool = False, user=Depends(auth.require_user)):
+    return await database.run(_get_tech_tree, category, country_id, show_hidden, user)
+
 @router.get("/player/progress")
 async def get_player_tech_progress():
     return JSONResponse({
@@ -1115,33 +1101,7 @@ async def get_player_tech_progress():
         "research_progress": 0
     })
 
-@router.get("/country/{country_id}/progress")
-async def get_country_tech_progress(country_id: str, request: Request):
-    """Получить прогресс страны по технологиям"""
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
-    if user.get('role') not in ['admin', 'moderator']:
-        conn = get_db()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("SELECT player_id FROM countries WHERE id = ?", (country_id,))
-            country = cursor.fetchone()
-            if not country or country['player_id'] != user['id']:
-                return JSONResponse({
-                    "success": False,
-                    "error": "Нет доступа к этой стране"
-                }, status_code=403)
-        finally:
-            conn.close()
-    
+def _get_country_tech_progress(country_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -1173,23 +1133,16 @@ async def get_country_tech_progress(country_id: str, request: Request):
     finally:
         conn.close()
 
+@router.get("/country/{country_id}/progress")
+async def get_country_tech_progress(country_id: str, user=Depends(auth.country_owner_or_admin)):
+    """Получить прогресс страны по технологиям"""
+    return await database.run(_get_country_tech_progress, country_id)
+
 class ResearchTechData(BaseModel):
     tech_id: str
     country_id: str
 
-@router.post("/research")
-async def research_technology(data: ResearchTechData, request: Request):
-    """Изучить технологию для страны"""
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
+def _research_technology(data, user):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -1289,24 +1242,12 @@ async def research_technology(data: ResearchTechData, request: Request):
     finally:
         conn.close()
 
-@router.get("/admin/countries")
-async def get_countries_for_tech_view(request: Request):
-    sys.path.append('..')
-    from main import get_current_user
-    
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({
-            "success": False,
-            "error": "Требуется авторизация"
-        }, status_code=401)
-    
-    if user.get('role') not in ['admin', 'moderator']:
-        return JSONResponse({
-            "success": False,
-            "error": "Доступно только для администраторов"
-        }, status_code=403)
-    
+@router.post("/research")
+async def research_technology(data: ResearchTechData, user=Depends(auth.require_user)):
+    """Изучить технологию для страны"""
+    return await database.run(_research_technology, data, user)
+
+def _get_countries_for_tech_view():
     conn = get_db()
     cursor = conn.cursor()
     
@@ -1348,14 +1289,12 @@ async def get_countries_for_tech_view(request: Request):
     finally:
         conn.close()
 
+@router.get("/admin/countries")
+async def get_countries_for_tech_view(user=Depends(auth.require_staff)):
+    return await database.run(_get_countries_for_tech_view)
 
-@router.get("/country/{country_id}/buildings-bonuses")
-async def get_buildings_bonuses(country_id: str, request: Request):
-    """Получение бонусов от зданий для образования и науки"""
-    user = await get_current_user(request)
-    if not user:
-        return JSONResponse({'success': False, 'error': 'Требуется авторизация'}, status_code=401)
-    
+
+def _get_buildings_bonuses(country_id):
     conn = get_db()
     cursor = conn.cursor()
     
@@ -1367,10 +1306,6 @@ async def get_buildings_bonuses(country_id: str, request: Request):
         if not country:
             return JSONResponse({'success': False, 'error': 'Страна не найдена'}, status_code=404)
         
-        if user['role'] not in ['admin', 'moderator']:
-            if country['player_id'] != user['id']:
-                return JSONResponse({'success': False, 'error': 'Доступ запрещён'}, status_code=403)
-        
         # Подсчитываем бонусы от зданий
         cursor.execute('''
             SELECT 
@@ -1438,3 +1373,8 @@ async def get_buildings_bonuses(country_id: str, request: Request):
         }, status_code=500)
     finally:
         conn.close()
+
+@router.get("/country/{country_id}/buildings-bonuses")
+async def get_buildings_bonuses(country_id: str, user=Depends(auth.country_owner_or_admin)):
+    """Получение бонусов от зданий для образования и науки"""
+    return await database.run(_get_buildings_bonuses, country_id)
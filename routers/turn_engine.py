@@ -0,0 +1,418 @@
+"""Движок расчёта хода.
+
+Все входные таблицы читаются одним SELECT каждая (постройки - одним JOIN с
+провинциями), курсы валют - один раз за ход. Расчёт всех стран идёт в памяти,
+а результаты записываются пакетно через executemany. Формулы экономики
+находятся в economy_kernel.
+"""
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from routers import economy_kernel
+
+# Страны без актуальной кэшированной дельты хода (нет записи или dirty = 1)
+DIRTY_COUNTRIES_SQL = '''
+    SELECT c.id FROM countries c
+    LEFT JOIN country_turn_deltas d ON d.country_id = c.id
+    WHERE d.country_id IS NULL OR d.dirty = 1
+'''
+
+CONVERTER_DATA_FILE = 'data/converter_data.json'
+
+def load_currency_rates():
+    """Таблица курсов валют конвертера: код -> курс к золоту"""
+    try:
+        with open(CONVERTER_DATA_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return {code: info['rate'] for code, info in data.get('currencies', {}).items()}
+    except Exception as e:
+        print(f'Ошибка получения курсов валют: {e}')
+        return {}
+
+def _country_filter(column, country_ids, dirty_only=False):
+    """Условие WHERE для выборки только указанных (или только «грязных») стран"""
+    if dirty_only:
+        return f' WHERE {column} IN ({DIRTY_COUNTRIES_SQL})', ()
+    if country_ids is None:
+        return '', ()
+    placeholders = ', '.join('?' for _ in country_ids)
+    return f' WHERE {column} IN ({placeholders})', tuple(country_ids)
+
+def mark_dirty(cursor, country_id):
+    """Помечает кэшированную дельту хода страны как устаревшую
+
+    Вызывается при любом изменении входных данных хода: налогов, заработка,
+    образования/науки, статистики, валюты, провинций и построек.
+    """
+    cursor.execute('UPDATE country_turn_deltas SET dirty = 1 WHERE country_id = ?', (country_id,))
+
+def mark_currency_dirty(cursor, currency_code):
+    """Курс валюты изменился - устаревают дельты стран, у которых она основная"""
+    cursor.execute(
+        'UPDATE country_turn_deltas SET dirty = 1 WHERE country_id IN (SELECT id FROM countries WHERE main_currency = ?)',
+        (currency_code,)
+    )
+
+def load_world(cursor, country_ids=None, dirty_only=False):
+    """Загрузка входных данных хода для всех стран (по одному запросу на таблицу)
+
+    Args:
+        country_ids: Необязательный список стран; по умолчанию загружаются все
+        dirty_only: Загрузить только страны без актуальной дельты хода
+
+    Returns:
+        dict: country_id -> входные данные страны
+    """
+    from routers.economic import get_military_equipment_types
+    from routers.provinces import BUILDING_TYPES, calculate_funding_efficiency
+
+    world = {}
+    currency_rates = load_currency_rates()
+
+    where, params = _country_filter('id', country_ids, dirty_only)
+    cursor.execute('SELECT id, country_name, main_currency FROM countries' + where, params)
+    for row in cursor.fetchall():
+        world[row['id']] = {
+            'country_name': row['country_name'],
+            'main_currency': row['main_currency'],
+            'currency_rate': currency_rates.get(row['main_currency'], 1),
+            'balance': 0.0,
+            'population': None,  # В миллионах; None - статистики нет
+            'social_layers': {},
+            'tax_settings': {},
+            'income_settings': {},
+            'education_science': None,
+            'buildings': []
+        }
+
+    # Баланс основной валюты
+    where, params = _country_filter('cc.country_id', country_ids, dirty_only)
+    cursor.execute('''
+        SELECT cc.country_id, cc.amount
+        FROM country_currencies cc
+        JOIN countries c ON c.id = cc.country_id AND c.main_currency = cc.currency_code
+    ''' + where, params)
+    for row in cursor.fetchall():
+        world[row['country_id']]['balance'] = float(row['amount'])
+
+    where, params = _country_filter('country_id', country_ids, dirty_only)
+
+    cursor.execute('SELECT country_id, population FROM country_stats' + where, params)
+    for row in cursor.fetchall():
+        if row['country_id'] in world:
+            world[row['country_id']]['population'] = row['population']
+
+    # Слои читаются в порядке UNIQUE-индекса (country_id, слой), как и в запросах по одной стране
+    cursor.execute('SELECT country_id, layer_name, percentage FROM country_social_layers'
+                   + where + ' ORDER BY country_id, layer_name', params)
+    for row in cursor.fetchall():
+        if row['country_id'] in world:
+            world[row['country_id']]['social_layers'][row['layer_name']] = row['percentage']
+
+    cursor.execute('SELECT country_id, social_layer, tax_rate FROM country_tax_settings'
+                   + where + ' ORDER BY country_id, social_layer', params)
+    for row in cursor.fetchall():
+        if row['country_id'] in world:
+            world[row['country_id']]['tax_settings'][row['social_layer']] = row['tax_rate']
+
+    cursor.execute('SELECT country_id, social_layer, avg_income FROM country_income_settings'
+                   + where + ' ORDER BY country_id, social_layer', params)
+    for row in cursor.fetchall():
+        if row['country_id'] in world:
+            world[row['country_id']]['income_settings'][row['social_layer']] = row['avg_income']
+
+    cursor.execute('SELECT country_id, education_level, science_level FROM country_education_science' + where, params)
+    for row in cursor.fetchall():
+        if row['country_id'] in world:
+            world[row['country_id']]['education_science'] = (row['education_level'], row['science_level'])
+
+    # Постройки всех стран одним запросом; удалённые из справочника типы пропускаются
+    equipment_types = get_military_equipment_types()
+    where, params = _country_filter('p.country_id', country_ids, dirty_only)
+    cursor.execute('''
+        SELECT p.country_id, b.building_type_name, b.production_type, b.funding_percentage
+        FROM buildings b
+        JOIN provinces p ON b.province_id = p.id
+    ''' + where + ' ORDER BY p.country_id, b.id', params)
+    for row in cursor.fetchall():
+        building_type = BUILDING_TYPES.get(row['building_type_name'])
+        if row['country_id'] not in world or not building_type:
+            continue
+        funding = row['funding_percentage'] or 100
+        maintenance = building_type['maintenance_cost']
+        equipment = equipment_types.get(row['production_type'])
+        world[row['country_id']]['buildings'].append({
+            'maintenance': int(maintenance * funding / 100),
+            'base_maintenance': maintenance,
+            'efficiency': calculate_funding_efficiency(funding),
+            'production_type': row['production_type'] if equipment else None,
+            'batch_size': equipment.get('batch_size', 1) if equipment else 0,
+            'price': equipment.get('price', 1) if equipment else 0
+        })
+
+    return world
+
+def compute_turn(world, progress=None):
+    """Расчёт хода для всех стран через экономическое ядро
+
+    Args:
+        world: Результат load_world
+        progress: Необязательный callback(обработано, всего)
+
+    Returns:
+        dict: country_id -> изменения страны за ход
+    """
+    inputs = economy_kernel.build_inputs(world)
+    tax_income = economy_kernel.compute_tax(inputs)['tax_income']
+    research_gain = economy_kernel.compute_research(inputs)
+
+    # Постройки всех стран - плоские массивы с индексом страны
+    building_country, buildings = [], []
+    for i, country_id in enumerate(inputs['country_ids']):
+        for building in world[country_id]['buildings']:
+            building_country.append(i)
+            buildings.append(building)
+
+    maintenance, _ = economy_kernel.compute_maintenance(
+        building_country,
+        [b['maintenance'] for b in buildings],
+        [world[country_id]['currency_rate'] for country_id in inputs['country_ids']]
+    )
+    units = economy_kernel.compute_production(
+        [b['base_maintenance'] for b in buildings],
+        [b['batch_size'] for b in buildings],
+        [b['price'] for b in buildings],
+        [b['efficiency'] for b in buildings]
+    )
+
+    production = [{} for _ in inputs['country_ids']]
+    for i, building, produced in zip(building_country, buildings, units):
+        if building['production_type'] and produced > 0:
+            country_production = production[i]
+            country_production[building['production_type']] = country_production.get(building['production_type'], 0) + int(produced)
+
+    results = {}
+    for i, country_id in enumerate(inputs['country_ids']):
+        country = world[country_id]
+        income = float(tax_income[i])
+        # Расходы - содержание построек с учётом финансирования
+        expenses = float(maintenance[i])
+        results[country_id] = {
+            'country_name': country['country_name'],
+            'main_currency': country['main_currency'],
+            'balance_start': country['balance'],
+            'balance_end': country['balance'] + income - expenses,
+            'income': income,
+            'expenses': expenses,
+            'tax_income': income,
+            'tax_settings': country['tax_settings'],
+            'research_gain': int(research_gain[i]),
+            'production': production[i]
+        }
+
+    if progress:
+        progress(len(results), len(results))
+    return results
+
+def _compute_shard(shard_index, shard):
+    """Расчёт одного шарда в процессе пула (функция должна быть picklable)"""
+    started = time.perf_counter()
+    results = compute_turn(shard)
+    return shard_index, results, time.perf_counter() - started
+
+def compute_turn_parallel(world, workers, progress=None):
+    """Расчёт хода шардами в ProcessPoolExecutor
+
+    Страны делятся на workers непрерывных шардов; каждый шард считается тем же
+    compute_turn, что и в последовательном режиме, поэтому результаты идентичны.
+
+    Returns:
+        (results, shards): результаты в порядке world и тайминги шардов
+    """
+    items = list(world.items())
+    total = len(items)
+    shard_size = -(-total // workers) if total else 0
+    shards = [dict(items[i:i + shard_size]) for i in range(0, total, shard_size)] if total else []
+
+    merged = {}
+    timings = [None] * len(shards)
+    processed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_compute_shard, index, shard) for index, shard in enumerate(shards)]
+        for future in as_completed(futures):
+            shard_index, shard_results, seconds = future.result()
+            merged.update(shard_results)
+            timings[shard_index] = {
+                'shard': shard_index,
+                'countries': len(shard_results),
+                'seconds': round(seconds, 4)
+            }
+            processed += len(shard_results)
+            if progress:
+                progress(processed, total)
+
+    if progress and not shards:
+        progress(0, 0)
+
+    # Порядок записи такой же, как в последовательном режиме
+    results = {country_id: merged[country_id] for country_id in world}
+    return results, timings
+
+def apply_turn(cursor, results, turn_number):
+    """Пакетная запись результатов хода: балансы, история экономики, очки исследований
+    и произведённое снаряжение"""
+    now = datetime.now().isoformat()
+
+    cursor.executemany(
+        '''INSERT INTO country_currencies (country_id, currency_code, amount, created_at, updated_at)
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(country_id, currency_code)
+           DO UPDATE SET amount = excluded.amount, updated_at = excluded.updated_at''',
+        [(country_id, r['main_currency'], r['balance_end'], now, now)
+         for country_id, r in results.items()]
+    )
+
+    cursor.executemany(
+        '''INSERT INTO economy_history
+           (country_id, turn_number, balance_start, balance_end, income, expenses,
+            tax_income, tax_settings, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT(country_id, turn_number)
+           DO UPDATE SET balance_end = excluded.balance_end, income = excluded.income,
+                         expenses = excluded.expenses, tax_income = excluded.tax_income''',
+        [(country_id, turn_number, r['balance_start'], r['balance_end'], r['income'],
+          r['expenses'], r['tax_income'], json.dumps(r['tax_settings']), now)
+         for country_id, r in results.items()]
+    )
+
+    cursor.executemany(
+        'UPDATE countries SET research_points = research_points + ? WHERE id = ?',
+        [(r['research_gain'], country_id)
+         for country_id, r in results.items() if r['research_gain'] > 0]
+    )
+
+    cursor.executemany(
+        '''INSERT INTO country_military_equipment (country_id, equipment_code, amount, ever_had, created_at, updated_at)
+           VALUES (?, ?, ?, 1, ?, ?)
+           ON CONFLICT(country_id, equipment_code)
+           DO UPDATE SET amount = country_military_equipment.amount + excluded.amount,
+                         ever_had = 1, updated_at = excluded.updated_at''',
+        [(country_id, code, amount, now, now)
+         for country_id, r in results.items() for code, amount in r['production'].items()]
+    )
+
+def compute_world(world, progress=None, workers=1):
+    """Расчёт хода последовательно или шардами в пуле процессов
+
+    Args:
+        workers: Число процессов; 1 - последовательный расчёт в текущем потоке
+
+    Returns:
+        (results, shards): результаты по странам и тайминги шардов
+    """
+    if workers > 1 and len(world) > 1:
+        return compute_turn_parallel(world, workers, progress)
+
+    started = time.perf_counter()
+    results = compute_turn(world, progress)
+    shards = [{'shard': 0, 'countries': len(results), 'seconds': round(time.perf_counter() - started, 4)}]
+    return results, shards
+
+def load_cached_results(cursor):
+    """Результаты хода для стран с актуальной кэшированной дельтой
+
+    Дельта (доходы, расходы, очки исследований, производство) берётся из кэша, а баланс
+    читается заново - он меняется покупками между ходами.
+    """
+    cursor.execute('''
+        SELECT c.id, c.country_name, c.main_currency, cc.amount,
+               d.income, d.expenses, d.tax_income, d.research_gain, d.tax_settings, d.production
+        FROM countries c
+        JOIN country_turn_deltas d ON d.country_id = c.id AND d.dirty = 0
+        LEFT JOIN country_currencies cc ON cc.country_id = c.id AND cc.currency_code = c.main_currency
+    ''')
+
+    results = {}
+    for row in cursor.fetchall():
+        balance = float(row['amount']) if row['amount'] is not None else 0.0
+        results[row['id']] = {
+            'country_name': row['country_name'],
+            'main_currency': row['main_currency'],
+            'balance_start': balance,
+            'balance_end': balance + row['income'] - row['expenses'],
+            'income': row['income'],
+            'expenses': row['expenses'],
+            'tax_income': row['tax_income'],
+            'tax_settings': json.loads(row['tax_settings']),
+            'research_gain': row['research_gain'],
+            'production': json.loads(row['production'])
+        }
+    return results
+
+def store_deltas(cursor, results):
+    """Сохранение свежерассчитанных дельт хода в кэш со сброшенным флагом dirty"""
+    now = datetime.now().isoformat()
+    cursor.executemany(
+        '''INSERT INTO country_turn_deltas
+           (country_id, income, expenses, tax_income, research_gain, tax_settings, production, dirty, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)
+           ON CONFLICT(country_id)
+           DO UPDATE SET income = excluded.income, expenses = excluded.expenses,
+                         tax_income = excluded.tax_income, research_gain = excluded.research_gain,
+                         tax_settings = excluded.tax_settings, production = excluded.production,
+                         dirty = 0, updated_at = excluded.updated_at''',
+        [(country_id, r['income'], r['expenses'], r['tax_income'], r['research_gain'],
+          json.dumps(r['tax_settings']), json.dumps(r['production']), now)
+         for country_id, r in results.items()]
+    )
+
+def collect_turn(cursor, progress=None, workers=1, incremental=True):
+    """Результаты хода для всех стран
+
+    В инкрементальном режиме пересчитываются только «грязные» страны,
+    для остальных применяются кэшированные дельты.
+
+    Returns:
+        (results, fresh, shards): все результаты, только пересчитанные и тайминги шардов
+    """
+    if not incremental:
+        fresh, shards = compute_world(load_world(cursor), progress, workers)
+        return fresh, fresh, shards
+
+    cached = load_cached_results(cursor)
+
+    # Страны из кэша считаются уже обработанными
+    def offset_progress(processed, total):
+        progress(len(cached) + processed, len(cached) + total)
+
+    fresh, shards = compute_world(load_world(cursor, dirty_only=True),
+                                  offset_progress if progress else None, workers)
+    return {**cached, **fresh}, fresh, shards
+
+def process_turn(cursor, turn_number, progress=None, workers=1, incremental=True):
+    """Полный расчёт хода: загрузка, вычисление и запись (без commit)
+
+    Вызывающий код должен открыть транзакцию (BEGIN IMMEDIATE) до вызова, чтобы
+    изменения входных данных во время расчёта не потерялись при сбросе флага dirty.
+
+    Returns:
+        (results, shards, recomputed): результаты по странам, тайминги шардов
+        и число пересчитанных стран
+    """
+    results, fresh, shards = collect_turn(cursor, progress, workers, incremental)
+
+    # Запись выполняет единственный писатель в одной транзакции
+    apply_turn(cursor, results, turn_number)
+    store_deltas(cursor, fresh)
+    return results, shards, len(fresh)
+
+def preview_turn(cursor, workers=1):
+    """Расчёт хода без записи в БД (пробный прогон)
+
+    Returns:
+        dict: country_id -> результаты страны
+    """
+    results, _, _ = collect_turn(cursor, workers=workers)
+    return results
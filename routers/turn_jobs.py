@@ -0,0 +1,404 @@
+"""Фоновая обработка ходов.
+
+Переход хода выполняется в отдельном потоке со своим соединением с БД, поэтому
+HTTP-запрос администратора и event loop (включая WebSocket чата) не блокируются.
+Флаг game_state.turn_processing захватывается атомарно и виден всем воркерам.
+Вместе с флагом в game_state записываются id задачи и время захвата, а сама
+задача хранит владельца (хост:pid) и отметку updated_at, которую поток хода
+обновляет раз в TURN_JOB_HEARTBEAT_SECONDS. Захват считается брошенным, только
+если процесс-владелец на этом хосте завершён или отметка старше
+TURN_JOB_STALE_SECONDS: такой захват снимается при старте приложения и
+перехватывается следующим запуском хода. Ход, который идёт в другом воркере,
+перезапуск не трогает.
+
+Состояние задач хранится в отдельном файле TURN_JOBS_DB_FILE (таблица
+turn_jobs), а не в памяти процесса: GET /turn-jobs/{id} отвечает любой воркер
+uvicorn, а не только запустивший ход. Файл отдельный, потому что поток хода
+держит блокировку записи БД мира на всё время расчёта. Прогресс пишется не
+чаще раза в JOB_PROGRESS_INTERVAL секунд.
+
+У каждого мира свой game_state и свой файл БД: поток хода работает в мире,
+из которого запущен, и ходы разных миров идут параллельно.
+"""
+import contextvars
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from routers import archive, database, turn_engine, turn_snapshots
+
+# Число процессов для шардированного расчёта хода (1 - последовательный режим)
+TURN_ENGINE_WORKERS = int(os.getenv('TURN_ENGINE_WORKERS', '1'))
+
+# Файл с состоянием задач (общий для всех миров и воркеров)
+TURN_JOBS_DB_FILE = os.getenv('TURN_JOBS_DB_FILE', 'turn_jobs.db')
+
+# Сколько завершённых задач хранить для /turn-jobs/{id}
+MAX_STORED_JOBS = 50
+
+# Как часто записывать прогресс расчёта, секунд
+JOB_PROGRESS_INTERVAL = 1.0
+
+# Как часто поток хода обновляет отметку updated_at задачи, секунд
+TURN_JOB_HEARTBEAT_SECONDS = float(os.getenv('TURN_JOB_HEARTBEAT_SECONDS', '5'))
+
+# Через сколько секунд без отметки захват хода считается брошенным
+TURN_JOB_STALE_SECONDS = float(os.getenv('TURN_JOB_STALE_SECONDS', '60'))
+
+OWNER_HOST = socket.gethostname()
+
+_JSON_FIELDS = ('shards',)
+
+_schema_ready = set()
+
+# Задачи, которые выполняются в этом процессе
+_local_jobs = set()
+_local_lock = threading.Lock()
+
+def get_db():
+    return database.get_db()
+
+def add_claim_columns(cursor):
+    """Владелец захвата хода в game_state (миграция, см. routers/migrations.py)"""
+    cursor.execute('PRAGMA table_info(game_state)')
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'turn_job_id' not in columns:
+        cursor.execute('ALTER TABLE game_state ADD COLUMN turn_job_id TEXT')
+    if 'turn_claimed_at' not in columns:
+        cursor.execute('ALTER TABLE game_state ADD COLUMN turn_claimed_at TEXT')
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+def claim_turn_processing(cursor, job_id):
+    """Атомарно помечает, что ход обрабатывает задача job_id. False - ход уже обрабатывается
+
+    Брошенный захват (см. claim_is_stale) перехватывается.
+    """
+    now = datetime.now().isoformat()
+    cursor.execute(
+        'UPDATE game_state SET turn_processing = 1, turn_job_id = ?, turn_claimed_at = ? WHERE id = 1 AND turn_processing = 0',
+        (job_id, now)
+    )
+    if cursor.rowcount == 1:
+        return True
+
+    cursor.execute('SELECT turn_job_id, turn_claimed_at FROM game_state WHERE id = 1')
+    state = cursor.fetchone()
+    if not state or not claim_is_stale(state['turn_job_id'], state['turn_claimed_at']):
+        return False
+    print(f"Захват хода задачей {state['turn_job_id']} брошен - ход перехватывает задача {job_id}")
+    _mark_abandoned(state['turn_job_id'])
+    cursor.execute(
+        '''UPDATE game_state SET turn_job_id = ?, turn_claimed_at = ?
+           WHERE id = 1 AND turn_processing = 1 AND turn_job_id IS ?''',
+        (job_id, now, state['turn_job_id'])
+    )
+    return cursor.rowcount == 1
+
+def release_turn_processing(cursor, job_id):
+    """Снимает флаг, только если он всё ещё принадлежит задаче job_id"""
+    cursor.execute(
+        'UPDATE game_state SET turn_processing = 0, turn_job_id = NULL WHERE id = 1 AND turn_job_id IS ?',
+        (job_id,)
+    )
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _seconds_since(timestamp):
+    return (datetime.now() - datetime.fromisoformat(timestamp)).total_seconds()
+
+def claim_is_stale(job_id, claimed_at):
+    """Брошен ли захват хода: владелец завершён или давно не отмечался"""
+    job = _load_job(job_id) if job_id else None
+    if job is None:
+        # Запись задачи ещё не создана (или захват сделан до миграции 13)
+        return not claimed_at or _seconds_since(claimed_at) > TURN_JOB_STALE_SECONDS
+    if job['status'] != 'running':
+        return True
+
+    host, _, pid = (job['owner'] or '').rpartition(':')
+    if host == OWNER_HOST and pid.isdigit():
+        if int(pid) == os.getpid():
+            # pid мог достаться этому процессу после перезапуска контейнера
+            with _local_lock:
+                return job_id not in _local_jobs
+        if not _pid_alive(int(pid)):
+            return True
+    return _seconds_since(job['updated_at']) > TURN_JOB_STALE_SECONDS
+
+def _mark_abandoned(job_id):
+    if not job_id:
+        return
+    conn = open_jobs_db()
+    try:
+        conn.execute(
+            "UPDATE turn_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ? AND status = 'running'",
+            ('Процесс, обрабатывавший ход, остановлен', datetime.now().isoformat(), job_id)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def recover_after_restart():
+    """Снятие брошенного захвата хода при старте приложения (после миграций)"""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT turn_processing, turn_job_id, turn_claimed_at FROM game_state WHERE id = 1')
+        state = cursor.fetchone()
+        if state and state['turn_processing']:
+            if not claim_is_stale(state['turn_job_id'], state['turn_claimed_at']):
+                # Ход считает другой воркер - его флаг и дельты не трогаем
+                print(f"Ход обрабатывается задачей {state['turn_job_id']} - восстановление пропущено")
+                return
+            _mark_abandoned(state['turn_job_id'])
+            release_turn_processing(cursor, state['turn_job_id'])
+        # Формулы могли измениться вместе с кодом - после перезапуска пересчитываем всё
+        cursor.execute('UPDATE country_turn_deltas SET dirty = 1')
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        # БД мира заняла задача хода, начатая другим воркером за это время
+        print(f"Turn recovery skipped: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def open_jobs_db():
+    conn = sqlite3.connect(TURN_JOBS_DB_FILE, timeout=database.DB_BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    if TURN_JOBS_DB_FILE not in _schema_ready:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS turn_jobs (
+                id TEXT PRIMARY KEY,
+                world TEXT NOT NULL,
+                status TEXT NOT NULL,
+                turn_from INTEGER,
+                turn_to INTEGER,
+                countries_total INTEGER,
+                countries_processed INTEGER NOT NULL DEFAULT 0,
+                countries_recomputed INTEGER,
+                workers INTEGER,
+                shards TEXT NOT NULL DEFAULT '[]',
+                snapshot TEXT,
+                started_by TEXT,
+                started_at TEXT NOT NULL,
+                finished_at TEXT,
+                error TEXT,
+                owner TEXT,
+                updated_at TEXT
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_turn_jobs_started_at ON turn_jobs(started_at)')
+        conn.commit()
+        _schema_ready.add(TURN_JOBS_DB_FILE)
+    return conn
+
+def _load_job(job_id):
+    conn = open_jobs_db()
+    try:
+        row = conn.execute('SELECT * FROM turn_jobs WHERE id = ?', (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return dict(row) if row else None
+
+def get_job(job_id):
+    """Снимок состояния задачи (или None); выполняется вне event loop"""
+    job = _load_job(job_id)
+    if not job:
+        return None
+
+    for field in _JSON_FIELDS:
+        job[field] = json.loads(job[field])
+    started = datetime.fromisoformat(job['started_at'])
+    finished = datetime.fromisoformat(job['finished_at']) if job['finished_at'] else datetime.now()
+    job['elapsed_seconds'] = round((finished - started).total_seconds(), 3)
+    return job
+
+def _insert_job(job):
+    conn = open_jobs_db()
+    try:
+        columns = ', '.join(job)
+        placeholders = ', '.join('?' for _ in job)
+        conn.execute(f'INSERT INTO turn_jobs ({columns}) VALUES ({placeholders})', tuple(job.values()))
+        conn.execute(
+            '''DELETE FROM turn_jobs WHERE status != 'running' AND id NOT IN (
+                   SELECT id FROM turn_jobs ORDER BY started_at DESC LIMIT ?)''',
+            (MAX_STORED_JOBS,)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def _update_job(job_id, **fields):
+    for field in _JSON_FIELDS:
+        if field in fields:
+            fields[field] = json.dumps(fields[field])
+    assignments = ', '.join(f'{field} = ?' for field in fields)
+    conn = open_jobs_db()
+    try:
+        conn.execute(f'UPDATE turn_jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def resolve_workers(workers=None):
+    """Число процессов для расчёта: явное значение или TURN_ENGINE_WORKERS, не больше числа ядер"""
+    if workers is None:
+        workers = TURN_ENGINE_WORKERS
+    return max(1, min(int(workers), os.cpu_count() or 1))
+
+def start_turn_job(started_by=None, workers=None):
+    """Запуск перехода хода в фоновом потоке
+
+    Args:
+        started_by: Имя администратора
+        workers: Число процессов расчёта (None - из TURN_ENGINE_WORKERS)
+
+    Returns:
+        (job_id, None) при успешном запуске или (None, текст ошибки)
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT current_turn FROM game_state WHERE id = 1')
+        state = cursor.fetchone()
+        if not state:
+            return None, 'Состояние игры не найдено'
+
+        job_id = new_job_id()
+        if not claim_turn_processing(cursor, job_id):
+            return None, 'Ход уже обрабатывается'
+        conn.commit()
+        current_turn = state['current_turn']
+    finally:
+        conn.close()
+
+    return launch_turn_job(job_id, current_turn, started_by, workers), None
+
+def launch_turn_job(job_id, current_turn, started_by=None, workers=None):
+    """Регистрация задачи и запуск потока; флаг turn_processing уже захвачен задачей job_id
+
+    Returns:
+        str: id задачи
+    """
+    workers = resolve_workers(workers)
+    started_at = datetime.now().isoformat()
+    with _local_lock:
+        _local_jobs.add(job_id)
+    _insert_job({
+        'id': job_id,
+        'world': database.current_world(),
+        'status': 'running',
+        'turn_from': current_turn,
+        'turn_to': current_turn + 1,
+        'workers': workers,
+        'started_by': started_by,
+        'started_at': started_at,
+        'owner': f'{OWNER_HOST}:{os.getpid()}',
+        'updated_at': started_at
+    })
+
+    # Поток наследует мир запуска (contextvars сами в потоки не передаются)
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(_run_turn_job, job_id, workers),
+                     name=f'turn-job-{job_id[:8]}', daemon=True).start()
+    return job_id
+
+def _heartbeat(job_id, stop_event):
+    """Отметка updated_at, по которой другие воркеры видят, что задача жива"""
+    while not stop_event.wait(TURN_JOB_HEARTBEAT_SECONDS):
+        try:
+            _update_job(job_id, updated_at=datetime.now().isoformat())
+        except sqlite3.Error as e:
+            print(f"Error updating turn job heartbeat: {e}")
+
+def _run_turn_job(job_id, workers):
+    """Тело фоновой задачи: расчёт хода и снятие флага обработки"""
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, stop_heartbeat),
+                     name=f'turn-heartbeat-{job_id[:8]}', daemon=True).start()
+    try:
+        _process_claimed_turn(job_id, workers)
+    finally:
+        stop_heartbeat.set()
+        with _local_lock:
+            _local_jobs.discard(job_id)
+
+def _process_claimed_turn(job_id, workers):
+    last_write = 0.0
+
+    def progress(processed, total):
+        nonlocal last_write
+        now = time.monotonic()
+        if processed < total and now - last_write < JOB_PROGRESS_INTERVAL:
+            return
+        last_write = now
+        _update_job(job_id, countries_processed=processed, countries_total=total,
+                    updated_at=datetime.now().isoformat())
+
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        # Весь ход - одна транзакция: входные данные не меняются между чтением и записью
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT current_turn, turn_job_id FROM game_state WHERE id = 1')
+        state = cursor.fetchone()
+        if state['turn_job_id'] != job_id:
+            raise RuntimeError('Захват хода перехвачен другой задачей')
+        current_turn = state['current_turn']
+        new_turn = current_turn + 1
+
+        # Снимок до первой записи хода - точка отката для /snapshots/{turn}/restore
+        snapshot_path = turn_snapshots.take_snapshot(current_turn)
+        _update_job(job_id, snapshot=os.path.basename(snapshot_path))
+
+        _, shards, recomputed = turn_engine.process_turn(cursor, current_turn, progress, workers)
+
+        now = datetime.now().isoformat()
+        cursor.execute(
+            'UPDATE game_state SET current_turn = ?, turn_processing = 0, turn_job_id = NULL, updated_at = ? WHERE id = 1',
+            (new_turn, now)
+        )
+        conn.commit()
+
+        _update_job(job_id, status='completed', turn_from=current_turn, turn_to=new_turn,
+                    shards=shards, countries_recomputed=recomputed, finished_at=now)
+
+        try:
+            turn_snapshots.compact_snapshots()
+        except Exception as compact_error:
+            print(f"Error compacting turn snapshots: {compact_error}")
+
+        try:
+            archive.run_retention()
+        except Exception as archive_error:
+            print(f"Error archiving old rows: {archive_error}")
+    except Exception as e:
+        print(f"Error advancing turn: {e}")
+        conn.rollback()
+        try:
+            release_turn_processing(cursor, job_id)
+            conn.commit()
+        except Exception as release_error:
+            print(f"Error releasing turn processing flag: {release_error}")
+        try:
+            _update_job(job_id, status='failed', error=str(e), finished_at=datetime.now().isoformat())
+        except Exception as job_error:
+            print(f"Error saving turn job status: {job_error}")
+    finally:
+        conn.close()
@@ -0,0 +1,303 @@
+"""Снимки игрового состояния перед ходами и откат к ним.
+
+Перед каждым ходом игровые таблицы (GAME_TABLES) копируются в новый файл
+отдельным соединением: ATTACH файла снимка и INSERT ... SELECT в одной
+читающей транзакции. Пользователи, хеши паролей, почта и чат в снимок не
+попадают. Читатели не блокируются, а транзакция хода уже держит блокировку
+записи, поэтому снимок согласован с тем, что увидит расчёт.
+
+После хода снимки старше TURN_SNAPSHOT_RAW последних сжимаются gzip, а всё
+сверх TURN_SNAPSHOT_RETENTION удаляется; несжатые снимки больше не
+переписываются. Снимки прежнего формата (копия всей БД) при обслуживании один
+раз ужимаются до игровых таблиц.
+
+Сжатие, запись снимка и чтение его при откате идут под блокировкой каталога
+снимков мира (flock на <каталог>/.lock): ход одного воркера не может заменить
+или удалить файл, который сжимает или читает другой.
+
+Снимки мира по умолчанию лежат в SNAPSHOT_DIR, остальных миров - в
+SNAPSHOT_DIR/<мир>.
+"""
+import contextlib
+import fcntl
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime
+
+from routers import database
+
+SNAPSHOT_DIR = os.getenv('TURN_SNAPSHOT_DIR', 'snapshots')
+
+# Сколько последних снимков хранить (0 - не удалять)
+TURN_SNAPSHOT_RETENTION = int(os.getenv('TURN_SNAPSHOT_RETENTION', '20'))
+
+# Сколько последних снимков оставлять несжатыми для быстрого отката
+TURN_SNAPSHOT_RAW = int(os.getenv('TURN_SNAPSHOT_RAW', '3'))
+
+# Таблицы игрового состояния. Пользователи, чат, карты, персонажи и заявки
+# при откате хода не трогаются
+GAME_TABLES = (
+    'game_state',
+    'countries',
+    'country_currencies',
+    'country_resources',
+    'country_military_equipment',
+    'country_stats',
+    'country_social_layers',
+    'country_religions',
+    'country_cultures',
+    'country_tax_settings',
+    'country_income_settings',
+    'country_education_science',
+    'country_technologies',
+    'country_turn_deltas',
+    'economy_history',
+    'provinces',
+    'buildings'
+)
+
+# Сжатие следующего хода может начаться, пока идёт сжатие предыдущего или откат
+# (в этом или другом воркере; миры друг друга не ждут)
+_compact_locks = {}
+_compact_locks_guard = threading.Lock()
+
+LOCK_FILE = '.lock'
+
+_SNAPSHOT_NAME = re.compile(r'^turn_(\d+)\.db(\.gz)?$')
+
+def snapshot_dir():
+    """Каталог снимков текущего мира"""
+    world_id = database.current_world()
+    if world_id == database.DEFAULT_WORLD:
+        return SNAPSHOT_DIR
+    return os.path.join(SNAPSHOT_DIR, world_id)
+
+@contextlib.contextmanager
+def _compact_lock():
+    """Блокировка каталога снимков текущего мира между потоками и процессами"""
+    with _compact_locks_guard:
+        thread_lock = _compact_locks.setdefault(database.current_world(), threading.Lock())
+    with thread_lock:
+        os.makedirs(snapshot_dir(), exist_ok=True)
+        fd = os.open(os.path.join(snapshot_dir(), LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+def _snapshot_path(turn_number, compressed=False):
+    return os.path.join(snapshot_dir(), f'turn_{turn_number:06d}.db' + ('.gz' if compressed else ''))
+
+def list_snapshots():
+    """Список снимков, от новых к старым
+
+    Returns:
+        list: dict с turn, file, compressed, size_bytes, created_at
+    """
+    directory = snapshot_dir()
+    if not os.path.isdir(directory):
+        return []
+
+    snapshots = {}
+    for name in os.listdir(directory):
+        match = _SNAPSHOT_NAME.match(name)
+        if not match:
+            continue
+        turn = int(match.group(1))
+        compressed = bool(match.group(2))
+        # Если остались обе версии (прерванное сжатие), несжатая главнее
+        if turn in snapshots and not snapshots[turn]['compressed']:
+            continue
+        path = os.path.join(directory, name)
+        stat = os.stat(path)
+        snapshots[turn] = {
+            'turn': turn,
+            'file': name,
+            'compressed': compressed,
+            'size_bytes': stat.st_size,
+            'created_at': datetime.fromtimestamp(stat.st_mtime).isoformat()
+        }
+
+    return [snapshots[turn] for turn in sorted(snapshots, reverse=True)]
+
+def take_snapshot(turn_number):
+    """Снимок игровых таблиц перед обработкой хода turn_number
+
+    Вызывается внутри транзакции хода (после BEGIN IMMEDIATE, до первой записи):
+    копию делает отдельное соединение, которое только читает БД мира.
+
+    Returns:
+        str: путь к файлу снимка
+    """
+    os.makedirs(snapshot_dir(), exist_ok=True)
+    path = _snapshot_path(turn_number)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.turn_{turn_number:06d}_', suffix='.db.tmp', dir=snapshot_dir())
+    os.close(fd)
+
+    try:
+        _copy_game_tables(tmp_path)
+        with _compact_lock():
+            os.replace(tmp_path, path)
+            stale = _snapshot_path(turn_number, compressed=True)
+            if os.path.exists(stale):
+                os.remove(stale)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+def _copy_game_tables(target_path):
+    """Копия GAME_TABLES мира в пустой файл target_path (одна читающая транзакция)"""
+    source = database.open_connection()
+    source.isolation_level = None
+    try:
+        source.execute('ATTACH DATABASE ? AS snapshot', (target_path,))
+        source.execute('BEGIN')
+        placeholders = ', '.join('?' for _ in GAME_TABLES)
+        tables = source.execute(
+            f"SELECT name, sql FROM main.sqlite_master WHERE type = 'table' AND name IN ({placeholders})",
+            GAME_TABLES
+        ).fetchall()
+        for table, create_sql in tables:
+            # CREATE TABLE "name" (...) -> CREATE TABLE snapshot."name" (...)
+            columns_sql = create_sql[create_sql.index('('):]
+            source.execute(f'CREATE TABLE snapshot."{table}" {columns_sql}')
+            source.execute(f'INSERT INTO snapshot."{table}" SELECT * FROM main."{table}"')
+        source.execute('COMMIT')
+        source.execute('DETACH DATABASE snapshot')
+    finally:
+        source.close()
+
+def _strip_snapshot(path):
+    """Ужимает снимок прежнего формата (копия всей БД) до игровых таблиц
+
+    Returns:
+        bool: был ли файл переписан
+    """
+    conn = sqlite3.connect(path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+        foreign = [table for (table,) in cursor.fetchall() if table not in GAME_TABLES]
+        if not foreign:
+            return False
+        for table in foreign:
+            cursor.execute(f'DROP TABLE "{table}"')
+        conn.commit()
+        cursor.execute('VACUUM')
+        return True
+    finally:
+        conn.close()
+
+def _compress(path):
+    with open(path, 'rb') as src, gzip.open(path + '.gz.tmp', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(path + '.gz.tmp', path + '.gz')
+    os.remove(path)
+
+def compact_snapshots():
+    """Обслуживание каталога снимков после хода
+
+    - снимки прежнего формата ужимаются до игровых таблиц (один раз);
+    - всё старше TURN_SNAPSHOT_RAW последних сжимается gzip;
+    - всё сверх TURN_SNAPSHOT_RETENTION последних удаляется.
+    """
+    with _compact_lock():
+        snapshots = list_snapshots()
+        for index, snapshot in enumerate(snapshots):
+            path = os.path.join(snapshot_dir(), snapshot['file'])
+
+            if TURN_SNAPSHOT_RETENTION and index >= TURN_SNAPSHOT_RETENTION:
+                os.remove(path)
+                continue
+
+            if snapshot['compressed']:
+                continue
+
+            _strip_snapshot(path)
+            if index >= TURN_SNAPSHOT_RAW:
+                _compress(path)
+
+def restore_snapshot(turn_number):
+    """Откат игровых таблиц к снимку перед ходом turn_number
+
+    Таблицы переписываются в одной транзакции; колонки берутся общие для снимка
+    и текущей схемы, так что снимки переживают миграции. Кэш дельт помечается
+    устаревшим, флаг обработки хода снимается.
+
+    Returns:
+        (restored_turn, None) или (None, текст ошибки)
+    """
+    # Снимок копируется под блокировкой: сжатие в этом или другом воркере не
+    # заменит файл, пока он читается. Сам откат идёт уже по копии
+    with _compact_lock():
+        snapshot = next((s for s in list_snapshots() if s['turn'] == turn_number), None)
+        if not snapshot:
+            return None, 'Снимок для этого хода не найден'
+
+        path = os.path.join(snapshot_dir(), snapshot['file'])
+        fd, tmp_path = tempfile.mkstemp(suffix='.db', dir=snapshot_dir())
+        with os.fdopen(fd, 'wb') as dst, (gzip.open if snapshot['compressed'] else open)(path, 'rb') as src:
+            shutil.copyfileobj(src, dst)
+
+    try:
+        return _restore_snapshot(tmp_path)
+    finally:
+        os.remove(tmp_path)
+
+def _restore_snapshot(path):
+    conn = database.open_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('ATTACH DATABASE ? AS snapshot', (path,))
+        cursor.execute('BEGIN IMMEDIATE')
+
+        cursor.execute('SELECT turn_processing FROM main.game_state WHERE id = 1')
+        state = cursor.fetchone()
+        if state and state[0]:
+            conn.rollback()
+            return None, 'Идёт обработка хода'
+
+        # Расписание автоматических ходов - настройка, а не состояние хода: не откатываем
+        cursor.execute('SELECT auto_turn_interval, next_turn_at FROM main.game_state WHERE id = 1')
+        schedule = cursor.fetchone() or (0, None)
+
+        cursor.execute("SELECT name FROM snapshot.sqlite_master WHERE type = 'table'")
+        snapshot_tables = {row[0] for row in cursor.fetchall()}
+
+        for table in GAME_TABLES:
+            if table not in snapshot_tables:
+                continue
+            cursor.execute(f'PRAGMA main.table_info("{table}")')
+            main_columns = [row[1] for row in cursor.fetchall()]
+            cursor.execute(f'PRAGMA snapshot.table_info("{table}")')
+            snapshot_columns = {row[1] for row in cursor.fetchall()}
+            columns = ', '.join(f'"{c}"' for c in main_columns if c in snapshot_columns)
+
+            cursor.execute(f'DELETE FROM main."{table}"')
+            cursor.execute(f'INSERT INTO main."{table}" ({columns}) SELECT {columns} FROM snapshot."{table}"')
+
+        cursor.execute('''
+            UPDATE main.game_state
+            SET turn_processing = 0, turn_job_id = NULL, auto_turn_interval = ?, next_turn_at = ?, updated_at = ?
+            WHERE id = 1
+        ''', (schedule[0], schedule[1], datetime.now().isoformat()))
+        cursor.execute('UPDATE main.country_turn_deltas SET dirty = 1')
+        cursor.execute('SELECT current_turn FROM main.game_state WHERE id = 1')
+        restored_turn = cursor.fetchone()[0]
+        conn.commit()
+        return restored_turn, None
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
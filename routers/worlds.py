@@ -0,0 +1,166 @@
+"""Миры: несколько кампаний в одном процессе.
+
+Учётные таблицы общие (users.db), игровые таблицы каждого мира - в отдельном
+файле WORLDS_DIR/<id>.db (см. routers/database.py). Мир по умолчанию
+(database.DEFAULT_WORLD) хранит игровые таблицы в самом users.db, поэтому
+существующая кампания продолжает работать без переноса данных.
+
+Мир запроса выбирается заголовком X-World, параметром ?world= или cookie
+world (в этом порядке); без них - мир по умолчанию. WorldMiddleware выставляет
+его в контекст запроса, и все соединения из database.connect()/get_db()
+открываются к файлу этого мира.
+
+Реестр миров - таблица worlds в users.db. Новый мир создаётся администратором
+(POST /api/admin/game/worlds): файл мира получает миграции игровых таблиц и
+своё game_state, ходы в нём идут независимо от других миров.
+"""
+import os
+import re
+import threading
+from datetime import datetime
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from routers import database
+
+router = APIRouter(prefix='/api/worlds', tags=['worlds'])
+
+WORLD_ID_PATTERN = re.compile(r'^[a-z0-9_-]{1,32}$')
+
+WORLD_HEADER = 'X-World'
+WORLD_COOKIE = 'world'
+
+# Известные миры процесса; новый мир другого процесса подхватывается при промахе
+_known_worlds = {database.DEFAULT_WORLD}
+_known_lock = threading.Lock()
+
+def init_db(cursor):
+    """Реестр миров (миграция, см. routers/migrations.py)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS worlds (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+
+def _accounts_connection():
+    # Реестр лежит в users.db - читаем его из пула мира по умолчанию
+    with database.use_world(database.DEFAULT_WORLD):
+        return database.get_db()
+
+def list_worlds():
+    """Все миры, первым - мир по умолчанию"""
+    conn = _accounts_connection()
+    try:
+        rows = conn.execute('SELECT id, name, created_at FROM worlds ORDER BY created_at').fetchall()
+    finally:
+        conn.close()
+    worlds = [{'id': database.DEFAULT_WORLD, 'name': 'Основной мир', 'created_at': None}]
+    worlds += [dict(row) for row in rows if row['id'] != database.DEFAULT_WORLD]
+    return worlds
+
+def world_ids():
+    return [world['id'] for world in list_worlds()]
+
+def player_countries(user_id):
+    """Страны игрока по мирам: {мир: id страны} (членство - countries.player_id мира)"""
+    countries = {}
+    for world_id in world_ids():
+        with database.use_world(world_id):
+            conn = database.get_db()
+        try:
+            row = conn.execute('SELECT id FROM countries WHERE player_id = ?', (user_id,)).fetchone()
+        finally:
+            conn.close()
+        if row:
+            countries[world_id] = row['id']
+    return countries
+
+def refresh_known_worlds():
+    ids = world_ids()
+    with _known_lock:
+        _known_worlds.update(ids)
+
+def is_known(world_id):
+    return world_id in _known_worlds
+
+async def ensure_known(world_id):
+    """Есть ли такой мир; при промахе перечитывает реестр (мир мог создать другой процесс)"""
+    if is_known(world_id):
+        return True
+    if not WORLD_ID_PATTERN.match(world_id):
+        return False
+    await database.run(refresh_known_worlds)
+    return is_known(world_id)
+
+def create_world(world_id, name):
+    """Создание мира: файл с игровыми таблицами и запись в реестре
+
+    Returns:
+        (мир, None) или (None, текст ошибки)
+    """
+    from routers import migrations
+
+    if not WORLD_ID_PATTERN.match(world_id or ''):
+        return None, 'Идентификатор мира: 1-32 символа a-z, 0-9, _ и -'
+    if world_id == database.DEFAULT_WORLD or world_id in world_ids():
+        return None, 'Мир с таким идентификатором уже существует'
+
+    os.makedirs(database.WORLDS_DIR, exist_ok=True)
+    # Схема - до записи в реестр: мир не становится виден, пока файл не готов
+    migrations.migrate(world_id)
+
+    created_at = datetime.now().isoformat()
+    conn = _accounts_connection()
+    try:
+        conn.execute('INSERT INTO worlds (id, name, created_at) VALUES (?, ?, ?)',
+                     (world_id, name or world_id, created_at))
+        conn.commit()
+    finally:
+        conn.close()
+
+    with _known_lock:
+        _known_worlds.add(world_id)
+    return {'id': world_id, 'name': name or world_id, 'created_at': created_at}, None
+
+class WorldMiddleware(BaseHTTPMiddleware):
+    """Выставляет мир запроса в контекст для database.connect()/get_db()"""
+
+    async def dispatch(self, request, call_next):
+        world_id = request.headers.get(WORLD_HEADER) or request.query_params.get('world')
+        if world_id:
+            if not await ensure_known(world_id):
+                return JSONResponse({'success': False, 'error': 'Мир не найден'}, status_code=404)
+        else:
+            world_id = request.cookies.get(WORLD_COOKIE) or database.DEFAULT_WORLD
+            # cookie могла остаться от удалённого мира - тогда мир по умолчанию
+            if not await ensure_known(world_id):
+                world_id = database.DEFAULT_WORLD
+
+        with database.use_world(world_id):
+            return await call_next(request)
+
+@router.get('')
+async def get_worlds():
+    """Список миров (доступно всем)"""
+    try:
+        worlds = await database.run(list_worlds)
+        return JSONResponse({'success': True, 'worlds': worlds, 'default': database.DEFAULT_WORLD})
+    except Exception as e:
+        print(f"Error listing worlds: {e}")
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+@router.post('/select')
+async def select_world(request: Request):
+    """Выбор мира для последующих запросов браузера (cookie world)"""
+    data = await request.json()
+    world_id = data.get('world') or database.DEFAULT_WORLD
+    if not await ensure_known(world_id):
+        return JSONResponse({'success': False, 'error': 'Мир не найден'}, status_code=404)
+
+    response = JSONResponse({'success': True, 'world': world_id})
+    response.set_cookie(WORLD_COOKIE, world_id, samesite='lax')
+    return response